@@ -66,5 +66,6 @@ setup(
     entry_points={
     'console_scripts': [
         'main=Prediction_Model.main:main',
+        'serve=Prediction_Model.serving.server:main',
     ]}
 )
\ No newline at end of file
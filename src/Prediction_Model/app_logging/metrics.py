@@ -0,0 +1,254 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def peak_rss_bytes():
+    """
+    Peak resident memory of the process so far.
+
+    Returns:
+    int or None: Peak RSS in bytes, None when the platform does not report it.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def optional_stage(metrics, name, rows=None, **labels):
+    """
+    Time a stage when metrics are collected, do nothing otherwise.
+
+    Parameters:
+    metrics (StageMetrics or None): Collector of the current run.
+    name (str): Name of the stage.
+    rows (int, optional): Number of rows processed.
+    **labels: Extra dimensions of the stage.
+
+    Returns:
+    A context manager yielding the mutable record of the call.
+    """
+    if metrics is None:
+        return nullcontext({'rows': rows})
+    return metrics.stage(name, rows, **labels)
+
+
+class StageMetrics:
+    """
+    Wall time, throughput and memory of the stages of a pipeline run.
+
+    Stages are timed with the `stage` context manager. Repeated stages with the same name and
+    labels, such as the chunks of a streaming prediction, are aggregated into one record.
+    Records can be exported as JSON, as a Prometheus text file and as MLflow metrics.
+
+    Attributes:
+    pipeline (str): Name of the instrumented pipeline, used as the metric prefix.
+    trace_memory (bool): Also record the peak Python allocation of every stage with tracemalloc.
+    """
+    def __init__(self, pipeline, trace_memory=False):
+        """
+        Initialize the StageMetrics.
+
+        Parameters:
+        pipeline (str): Name of the instrumented pipeline, e.g. 'prediction' or 'training'.
+        trace_memory (bool): Record the peak Python allocation of every stage. Slows down
+                             allocation heavy code and is approximate when stages overlap.
+        """
+        self.pipeline = pipeline
+        self.trace_memory = trace_memory
+        self.started_at = time.time()
+        self._records = {}
+        self._lock = threading.Lock()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, rows=None, **labels):
+        """
+        Time a stage.
+
+        Parameters:
+        name (str): Name of the stage.
+        rows (int, optional): Number of rows processed, used for the throughput.
+        **labels: Extra dimensions of the stage, e.g. cluster=3.
+
+        Yields:
+        dict: Mutable record of this call, set 'rows' on it when the count is only known inside the stage.
+        """
+        call = {'rows': rows}
+        traced_start = None
+        if self.trace_memory:
+            traced_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield call
+        finally:
+            seconds = time.perf_counter() - start
+            traced_peak = None
+            if traced_start is not None:
+                traced_peak = max(0, tracemalloc.get_traced_memory()[1] - traced_start)
+            self.record(name, seconds, call['rows'], traced_peak, **labels)
+
+    def record(self, name, seconds, rows=None, traced_peak_bytes=None, **labels):
+        """
+        Add a measurement taken elsewhere, e.g. in a worker process.
+
+        Parameters:
+        name (str): Name of the stage.
+        seconds (float): Wall time of the stage.
+        rows (int, optional): Number of rows processed.
+        traced_peak_bytes (int, optional): Peak Python allocation of the stage.
+        **labels: Extra dimensions of the stage.
+        """
+        self._add(name, {k: str(v) for k, v in labels.items()}, 1, seconds, seconds, rows, peak_rss_bytes(), traced_peak_bytes)
+
+    def merge(self, records):
+        """
+        Add the aggregated records of another run, e.g. one returned by a worker process.
+
+        Parameters:
+        records (list): Output of `StageMetrics.records`.
+        """
+        for entry in records:
+            self._add(entry['stage'], entry['labels'], entry['calls'], entry['seconds'], entry['max_seconds'],
+                      entry['rows'], entry['peak_rss_bytes'], entry['traced_peak_bytes'])
+
+    def _add(self, name, labels, calls, seconds, max_seconds, rows, rss, traced_peak_bytes):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            entry = self._records.get(key)
+            if entry is None:
+                entry = self._records[key] = {'stage': name, 'labels': dict(key[1]), 'calls': 0, 'seconds': 0.0,
+                                              'max_seconds': 0.0, 'rows': None, 'peak_rss_bytes': None,
+                                              'traced_peak_bytes': None}
+            entry['calls'] += calls
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], max_seconds)
+            if rows is not None:
+                entry['rows'] = (entry['rows'] or 0) + int(rows)
+            if rss is not None:
+                entry['peak_rss_bytes'] = max(entry['peak_rss_bytes'] or 0, rss)
+            if traced_peak_bytes is not None:
+                entry['traced_peak_bytes'] = max(entry['traced_peak_bytes'] or 0, traced_peak_bytes)
+
+    def records(self):
+        """
+        Aggregated stage records in the order the stages were first seen.
+
+        Returns:
+        list: One dict per stage with calls, seconds, max_seconds, rows, rows_per_second and memory.
+        """
+        with self._lock:
+            records = [dict(entry) for entry in self._records.values()]
+        for entry in records:
+            entry['rows_per_second'] = entry['rows'] / entry['seconds'] if entry['rows'] and entry['seconds'] > 0 else None
+        return records
+
+    def to_dict(self):
+        return {'pipeline': self.pipeline,
+                'started_at': self.started_at,
+                'peak_rss_bytes': peak_rss_bytes(),
+                'stages': self.records()}
+
+    def summary(self):
+        """
+        One line per stage, for the application logs.
+
+        Returns:
+        str: Human readable summary of the stages.
+        """
+        lines = []
+        for entry in self.records():
+            labels = ''.join(f" {k}={v}" for k, v in entry['labels'].items())
+            line = f"{entry['stage']}{labels}: {entry['seconds']:.4f}s over {entry['calls']} call(s)"
+            if entry['rows_per_second'] is not None:
+                line += f", {entry['rows_per_second']:.0f} rows/s"
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def write_json(self, path):
+        """
+        Write the metrics as a JSON document.
+
+        Parameters:
+        path (str): Output file.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def write_prometheus(self, path):
+        """
+        Write the metrics in the Prometheus text exposition format, for the node exporter textfile collector.
+
+        Parameters:
+        path (str): Output file, written atomically.
+        """
+        prefix = f"cement_{self.pipeline}_stage"
+        series = {'seconds_total': [], 'calls_total': [], 'rows_total': [], 'rows_per_second': [],
+                  'peak_rss_bytes': [], 'traced_peak_bytes': []}
+        for entry in self.records():
+            labels = dict(stage=entry['stage'], **entry['labels'])
+            label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+            series['seconds_total'].append((label_text, entry['seconds']))
+            series['calls_total'].append((label_text, entry['calls']))
+            for name in ('rows_total', 'rows_per_second', 'peak_rss_bytes', 'traced_peak_bytes'):
+                value = entry['rows' if name == 'rows_total' else name]
+                if value is not None:
+                    series[name].append((label_text, value))
+
+        lines = []
+        for name, samples in series.items():
+            if not samples:
+                continue
+            lines.append(f"# TYPE {prefix}_{name} {'counter' if name.endswith('_total') else 'gauge'}")
+            lines.extend(f"{prefix}_{name}{{{label_text}}} {value}" for label_text, value in samples)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The collector may read the file at any time, so it is replaced in one step
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+    def export(self, metrics_dir):
+        """
+        Write the JSON and Prometheus files of the pipeline.
+
+        Parameters:
+        metrics_dir (str): Directory receiving `<pipeline>_metrics.json` and `<pipeline>_metrics.prom`.
+        """
+        self.write_json(os.path.join(metrics_dir, f"{self.pipeline}_metrics.json"))
+        self.write_prometheus(os.path.join(metrics_dir, f"{self.pipeline}_metrics.prom"))
+
+    def mlflow_metrics(self, stage_filter=None):
+        """
+        Flatten the records into MLflow metric names.
+
+        Parameters:
+        stage_filter (callable, optional): Keeps only the records for which it returns True.
+
+        Returns:
+        dict: Metric name to value, e.g. {'stage.elbow_search.seconds': 1.2}.
+        """
+        metrics = {}
+        for entry in self.records():
+            if stage_filter is not None and not stage_filter(entry):
+                continue
+            name = '.'.join(['stage', entry['stage']] + [f"{k}_{v}" for k, v in entry['labels'].items()])
+            metrics[f"{name}.seconds"] = entry['seconds']
+            for field in ('rows_per_second', 'peak_rss_bytes', 'traced_peak_bytes'):
+                if entry[field] is not None:
+                    metrics[f"{name}.{field}"] = entry[field]
+        return metrics
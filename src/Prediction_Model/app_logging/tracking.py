@@ -0,0 +1,230 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from Prediction_Model.config.config import (MLFLOW_URI,
+                                            TRACKING_FALLBACK_DIR,
+                                            TRACKING_UPLOAD_WORKERS,
+                                            TRACKING_RETRIES,
+                                            TRACKING_RETRY_BACKOFF)
+
+# Limits of a single MlflowClient.log_batch call
+MAX_METRICS_PER_BATCH = 1000
+MAX_PARAMS_PER_BATCH = 100
+MAX_TAGS_PER_BATCH = 100
+# Tag identifying a run to the client that created it
+RUN_KEY_TAG = 'client_run_key'
+
+
+class TrackedRun:
+    """
+    Handle of a run that is being logged in the background.
+    """
+    def __init__(self, future):
+        self._future = future
+
+    def done(self):
+        return self._future.done()
+
+    def result(self, timeout=None):
+        """
+        Wait for the run to be logged.
+
+        Parameters:
+        timeout (float, optional): Seconds to wait, None waits until the run is logged.
+
+        Returns:
+        tuple: (run_id (str), model_uri (str or None)) of the logged run.
+        """
+        return self._future.result(timeout)
+
+
+class AsyncTracker:
+    """
+    Logs MLflow runs from background threads, so training never waits on the tracking server.
+
+    Every run is sent as one job: the run is created, its params, metrics and tags are sent
+    in as few log_batch calls as possible, and its model is uploaded, with several runs in
+    flight at once. Failed calls are retried with exponential backoff, a run is looked up by
+    a key generated here before it is created again, so no run is duplicated. Once the tracking
+    server stays unreachable, the remaining runs go to a local MLflow file store.
+    `flush` waits for every submitted run.
+
+    Attributes:
+    experiment_name (str): Experiment receiving the runs.
+    fallback_active (bool): The runs are logged to the local file store.
+    """
+    def __init__(self, log_file, logger, experiment_name, tracking_uri=MLFLOW_URI, fallback_dir=TRACKING_FALLBACK_DIR,
+                 max_workers=TRACKING_UPLOAD_WORKERS, retries=TRACKING_RETRIES, backoff=TRACKING_RETRY_BACKOFF):
+        """
+        Initialize the AsyncTracker. Nothing is sent until the first run is submitted.
+
+        Parameters:
+        log_file: Log file object.
+        logger: Logger object.
+        experiment_name (str): Experiment receiving the runs, created when missing.
+        tracking_uri (str, optional): MLflow tracking server.
+        fallback_dir (str, optional): Local file store used when the server is unreachable.
+        max_workers (int, optional): Runs logged at the same time.
+        retries (int, optional): Retries of a failed tracking call.
+        backoff (float, optional): Seconds before the first retry, doubled at every retry.
+        """
+        self.log_file = log_file
+        self.logger = logger
+        self.experiment_name = experiment_name
+        self.tracking_uri = tracking_uri
+        self.fallback_dir = fallback_dir
+        self.retries = retries
+        self.backoff = backoff
+        self.fallback_active = False
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='mlflow-tracking')
+        self._lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+        self._client = None
+        self._experiment_id = None
+        self._pending = []
+
+    def log_run(self, run_name=None, params=None, metrics=None, tags=None, model=None, model_path=None):
+        """
+        Queue a run and return immediately.
+
+        Parameters:
+        run_name (str, optional): Name of the run.
+        params (dict, optional): Parameters of the run.
+        metrics (dict, optional): Metrics of the run.
+        tags (dict, optional): Tags of the run.
+        model (optional): sklearn model saved as an artifact of the run.
+        model_path (str, optional): Artifact path of the model.
+
+        Returns:
+        TrackedRun: Handle resolving to the run id and the model URI.
+        """
+        future = self._executor.submit(self._log, run_name, dict(params or {}), dict(metrics or {}),
+                                       dict(tags or {}), model, model_path)
+        with self._lock:
+            self._pending.append(future)
+        return TrackedRun(future)
+
+    def flush(self):
+        """
+        Wait until every submitted run is logged.
+
+        Returns:
+        int: Number of runs that could not be logged, their errors are written to the log.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        failed = 0
+        for future in pending:
+            error = future.exception()
+            if error is not None:
+                failed += 1
+                self.logger.add_log(self.log_file, f"Error while logging an MLflow run :: {str(error)}")
+        return failed
+
+    def close(self):
+        """
+        Flush the submitted runs and stop the background threads.
+
+        Returns:
+        int: Number of runs that could not be logged.
+        """
+        failed = self.flush()
+        self._executor.shutdown(wait=True)
+        return failed
+
+    def _retry(self, func, *args, **kwargs):
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def _create_run(self, client, experiment_id, run_name):
+        # A create_run that failed on the way back may have created the run, a retry finds it by its key
+        run_key = uuid.uuid4().hex
+        for attempt in range(self.retries + 1):
+            try:
+                if attempt:
+                    runs = client.search_runs([experiment_id], filter_string=f"tags.{RUN_KEY_TAG} = '{run_key}'", max_results=1)
+                    if runs:
+                        return runs[0]
+                return client.create_run(experiment_id, run_name=run_name, tags={RUN_KEY_TAG: run_key})
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def _experiment_id_of(self, client):
+        experiment = client.get_experiment_by_name(self.experiment_name)
+        if experiment is not None:
+            return experiment.experiment_id
+        return client.create_experiment(self.experiment_name)
+
+    def _connect(self, fallback=False):
+        # Concurrent runs create the experiment once, without blocking log_run meanwhile
+        from mlflow.tracking import MlflowClient
+        with self._connect_lock:
+            if fallback and not self.fallback_active:
+                self._client = None
+                self.fallback_active = True
+            if self._client is None:
+                if self.fallback_active:
+                    os.makedirs(self.fallback_dir, exist_ok=True)
+                    client = MlflowClient(tracking_uri=pathlib.Path(self.fallback_dir).resolve().as_uri())
+                else:
+                    client = MlflowClient(tracking_uri=self.tracking_uri)
+                self._experiment_id = self._retry(self._experiment_id_of, client)
+                self._client = client
+            return self._client, self._experiment_id
+
+    def _log(self, run_name, params, metrics, tags, model, model_path):
+        if not self.fallback_active:
+            try:
+                return self._log_to(*self._connect(), run_name, params, metrics, tags, model, model_path)
+            except Exception as e:
+                self.logger.add_log(self.log_file, f"MLflow tracking server unreachable, logging to {self.fallback_dir} :: {str(e)}")
+                tags['tracking_fallback'] = 'true'
+                return self._log_to(*self._connect(fallback=True), run_name, params, metrics, tags, model, model_path)
+        return self._log_to(*self._connect(), run_name, params, metrics, tags, model, model_path)
+
+    def _log_to(self, client, experiment_id, run_name, params, metrics, tags, model, model_path):
+        from mlflow.entities import Metric, Param, RunTag
+        run = self._create_run(client, experiment_id, run_name)
+        run_id = run.info.run_id
+        timestamp = int(time.time() * 1000)
+        metric_list = [Metric(key, float(value), timestamp, 0) for key, value in metrics.items()]
+        param_list = [Param(key, str(value)) for key, value in params.items()]
+        tag_list = [RunTag(key, str(value)) for key, value in tags.items()]
+        while metric_list or param_list or tag_list:
+            self._retry(client.log_batch, run_id,
+                        metrics=metric_list[:MAX_METRICS_PER_BATCH],
+                        params=param_list[:MAX_PARAMS_PER_BATCH],
+                        tags=tag_list[:MAX_TAGS_PER_BATCH])
+            metric_list = metric_list[MAX_METRICS_PER_BATCH:]
+            param_list = param_list[MAX_PARAMS_PER_BATCH:]
+            tag_list = tag_list[MAX_TAGS_PER_BATCH:]
+
+        model_uri = None
+        if model is not None:
+            self._retry(self._upload_model, client, run_id, model, model_path)
+            model_uri = f"{run.info.artifact_uri}/{model_path}"
+        self._retry(client.set_terminated, run_id)
+        return run_id, model_uri
+
+    @staticmethod
+    def _upload_model(client, run_id, model, model_path):
+        # Saved locally and uploaded through the client, the fluent API keeps one active run per process
+        import mlflow.sklearn
+        local_dir = tempfile.mkdtemp()
+        try:
+            mlflow.sklearn.save_model(model, os.path.join(local_dir, model_path))
+            client.log_artifacts(run_id, os.path.join(local_dir, model_path), artifact_path=model_path)
+        finally:
+            shutil.rmtree(local_dir, ignore_errors=True)
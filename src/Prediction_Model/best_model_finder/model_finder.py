@@ -1,14 +1,78 @@
-import mlflow
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import r2_score, mean_squared_error
-from sklearn.model_selection import GridSearchCV
+from sklearn.base import clone
+from sklearn.model_selection import GridSearchCV, RandomizedSearchCV, ParameterGrid, cross_validate
 from sklearn.linear_model import LinearRegression
 from sklearn.ensemble import GradientBoostingRegressor
 from sklearn.svm import SVR
-from Prediction_Model.config.config import MLFLOW_URI, MLFLOW_EXPERIMENT_NAME
+from Prediction_Model.app_logging.metrics import optional_stage
+from Prediction_Model.utils.cpu_budget import resolve_n_jobs
+from Prediction_Model.config.config import (RANDOM_SEED,
+                                            CANDIDATE_MODELS,
+                                            CANDIDATE_N_JOBS,
+                                            SEARCH_STRATEGY,
+                                            SEARCH_CV_FOLDS,
+                                            SEARCH_N_JOBS,
+                                            SEARCH_N_ITER,
+                                            SEARCH_HALVING_FACTOR,
+                                            SEARCH_BUDGET_SECONDS,
+                                            SEARCH_MAX_EVALUATIONS)
+
+# Score optimized by every search strategy
+SEARCH_SCORING = 'neg_mean_squared_error'
+
+# Candidate models compared before tuning, selected by name in CANDIDATE_MODELS
+CANDIDATE_ESTIMATORS = {
+    'RandomForest': RandomForestRegressor,
+    'SVR': SVR,
+    'LinearRegression': LinearRegression,
+    'GradientBoostingRegressor': GradientBoostingRegressor,
+}
+
+# Hyperparameter grids searched for the best candidate, candidates without a grid keep their defaults
+PARAM_GRIDS = {
+    'RandomForest': {
+        'n_estimators': [50, 100, 150],
+        'max_depth': [None, 10, 20],
+        'min_samples_split': [2, 5, 10]
+    },
+    'SVR': {
+        'kernel': ['linear', 'rbf'],
+        'C': [1, 10, 100],
+        'epsilon': [0.1, 0.01, 0.001]
+    },
+    'GradientBoostingRegressor': {
+        'n_estimators': [50, 100],
+        'learning_rate': [0.05, 0.01, 0.001],
+        'max_depth': [3, 5, 10]
+    }
+}
+
+
+def search_config():
+    """
+    Settings that decide which model a cluster ends up with, besides its data.
+
+    Returns:
+    dict: Candidates, parameter grids and search settings.
+    """
+    return {'candidates': list(CANDIDATE_MODELS),
+            'param_grids': PARAM_GRIDS,
+            'strategy': SEARCH_STRATEGY,
+            'cv': SEARCH_CV_FOLDS,
+            'n_iter': SEARCH_N_ITER,
+            'halving_factor': SEARCH_HALVING_FACTOR,
+            'budget_seconds': SEARCH_BUDGET_SECONDS,
+            'max_evaluations': SEARCH_MAX_EVALUATIONS,
+            'scoring': SEARCH_SCORING,
+            'random_seed': RANDOM_SEED}
 
 class BestModelFinder:
-    def __init__(self, log_file, logger, X_train, y_train, X_test, y_test, cluster_number):
+    def __init__(self, log_file, logger, X_train, y_train, X_test, y_test, cluster_number, metrics=None, estimator_jobs=None):
         """
         Initialize the BestModelFinder object.
 
@@ -19,6 +83,9 @@ class BestModelFinder:
         y_train (array-like): Target values for training.
         X_test (array-like): Test input samples.
         y_test (array-like): Target values for testing.
+        cluster_number (int): The cluster the models are trained for.
+        metrics (StageMetrics, optional): Collector receiving the fit and grid search times.
+        estimator_jobs (int, optional): n_jobs given to the candidates that support it, as allocated by the CPU budget.
         """
         self.log_file = log_file
         self.logger = logger
@@ -27,44 +94,78 @@ class BestModelFinder:
         self.y_train = y_train
         self.y_test = y_test
         self.cluster_number = cluster_number
-        mlflow.set_tracking_uri(uri=MLFLOW_URI)
+        self.metrics = metrics
+        self.estimator_jobs = estimator_jobs
+        self.candidate_results = {}
+        self.search_stats = {}
+        self.tracking_record = None
     
-    def find_best_model(self):
+    def _evaluate_candidate(self, model_name):
+        """
+        Fit one candidate and score it on the test split.
+
+        Parameters:
+        model_name (str): Key of the candidate in CANDIDATE_ESTIMATORS.
+
+        Returns:
+        dict: The fitted model with its R2 score, fit time and predict time.
+        """
+        model = CANDIDATE_ESTIMATORS[model_name]()
+        if self.estimator_jobs is not None and 'n_jobs' in model.get_params():
+            model.set_params(n_jobs=self.estimator_jobs)
+        with optional_stage(self.metrics, 'model_fit', len(self.X_train), cluster=self.cluster_number, model=model_name):
+            start = time.perf_counter()
+            model.fit(self.X_train, self.y_train)
+            fit_seconds = time.perf_counter() - start
+        with optional_stage(self.metrics, 'model_predict', len(self.X_test), cluster=self.cluster_number, model=model_name):
+            start = time.perf_counter()
+            y_pred = model.predict(self.X_test)
+            predict_seconds = time.perf_counter() - start
+        return {'model': model,
+                'r2_score': r2_score(self.y_test, y_pred),
+                'fit_seconds': fit_seconds,
+                'predict_seconds': predict_seconds}
+
+    def find_best_model(self, candidates=CANDIDATE_MODELS, n_jobs=CANDIDATE_N_JOBS):
         """
         Train models without hyperparameter tuning and find the best model.
 
+        The candidates are fitted concurrently on a thread pool, the sklearn estimators release
+        the GIL while fitting. Their scores and timings are kept in `candidate_results`.
+
+        Parameters:
+        candidates (list): Names of the candidates, keys of CANDIDATE_ESTIMATORS.
+        n_jobs (int): Maximum number of candidates fitted at the same time, -1 for every core.
+
         Returns:
         tuple: Best model name and best model instance.
         """
         try:
             self.logger.add_log(self.log_file, 'Starting model comparison process.')
-
-            # Define models
-            models = {
-                'RandomForest': RandomForestRegressor(),
-                'SVR': SVR(),
-                'LinearRegression': LinearRegression(),
-                'GradientBoostingRegressor': GradientBoostingRegressor()
-            }
+            unknown = [name for name in candidates if name not in CANDIDATE_ESTIMATORS]
+            if unknown or not candidates:
+                raise ValueError(f"Unknown candidate models {unknown}, expected names from {list(CANDIDATE_ESTIMATORS)}")
 
             best_model_name = None
             best_score = float('-inf')
             best_model_instance = None
 
-            mlflow.set_experiment(MLFLOW_EXPERIMENT_NAME)
-
             # Train each model and evaluate on the validation set
-            for model_name, model in models.items():
-                model.fit(self.X_train, self.y_train)
-                y_pred = model.predict(self.X_test)
-                score = r2_score(self.y_test, y_pred)
+            with ThreadPoolExecutor(max_workers=resolve_n_jobs(n_jobs, len(candidates))) as executor:
+                futures = {model_name: executor.submit(self._evaluate_candidate, model_name) for model_name in candidates}
+                self.candidate_results = {model_name: future.result() for model_name, future in futures.items()}
 
-                self.logger.add_log(self.log_file, f'{model_name} R2 score: {score}')
+            # Walking the candidates in configured order keeps the choice deterministic on ties
+            for model_name in candidates:
+                result = self.candidate_results[model_name]
+                score = result['r2_score']
+                self.logger.add_log(self.log_file, f"{model_name} R2 score: {score}, fit {result['fit_seconds']:.3f}s, "
+                                                   f"predict {result['predict_seconds']:.4f}s")
 
                 if score > best_score:
                     best_score = score
                     best_model_name = model_name
-                    best_model_instance = model
+                    best_model_instance = result['model']
 
             self.logger.add_log(self.log_file, f'Best model before tuning: {best_model_name} with R2 score: {best_score}')
 
@@ -75,9 +176,100 @@ class BestModelFinder:
             self.logger.add_log(self.log_file, error_message)
             raise Exception(error_message)
 
-    def optimize_best_model(self, best_model_name, best_model_instance):
+    def _budget_search(self, estimator, param_grid, cv, n_jobs, budget_seconds, max_evaluations):
         """
-        Perform hyperparameter optimization using GridSearchCV on the best model.
+        Cross-validate grid points in random order until the time or evaluation budget is spent.
+
+        Returns:
+        tuple: (best estimator refitted on the training split, best score, best params, number of candidates, compute seconds)
+        """
+        candidates = list(ParameterGrid(param_grid))
+        random.Random(RANDOM_SEED).shuffle(candidates)
+        start = time.perf_counter()
+        best_score, best_params = float('-inf'), None
+        evaluated, compute_seconds = 0, 0.0
+        for params in candidates:
+            # The first candidate is always evaluated so that a model is returned
+            if evaluated and ((budget_seconds is not None and time.perf_counter() - start >= budget_seconds) or
+                              (max_evaluations is not None and evaluated >= max_evaluations)):
+                break
+            scores = cross_validate(clone(estimator).set_params(**params), self.X_train, self.y_train, cv=cv,
+                                    scoring=SEARCH_SCORING, n_jobs=n_jobs)
+            evaluated += 1
+            compute_seconds += float(np.sum(scores['fit_time']) + np.sum(scores['score_time']))
+            # A failed fit scores NaN, which never compares greater
+            if scores['test_score'].mean() > best_score:
+                best_score, best_params = float(scores['test_score'].mean()), params
+        if best_params is None:
+            raise ValueError(f"No hyperparameters of {type(estimator).__name__} could be scored, "
+                             f"every cross-validation of the {evaluated} evaluated grid points failed")
+        best_estimator = clone(estimator).set_params(**best_params).fit(self.X_train, self.y_train)
+        return best_estimator, best_score, best_params, evaluated, compute_seconds
+
+    def search(self, estimator, param_grid, strategy=SEARCH_STRATEGY, cv=SEARCH_CV_FOLDS, n_jobs=SEARCH_N_JOBS,
+               n_iter=SEARCH_N_ITER, budget_seconds=SEARCH_BUDGET_SECONDS, max_evaluations=SEARCH_MAX_EVALUATIONS):
+        """
+        Tune the hyperparameters of an estimator and record the compute spent in `search_stats`.
+
+        Parameters:
+        estimator: The estimator to tune, it is cloned before every fit.
+        param_grid (dict): Candidate values of every hyperparameter.
+        strategy (str): 'grid' (exhaustive), 'halving' (successive halving over the grid),
+                        'random' (n_iter random grid points) or 'budget' (random grid points until
+                        budget_seconds or max_evaluations is reached).
+        cv (int): Number of cross-validation folds.
+        n_jobs (int): Number of parallel fits, -1 for every core.
+        n_iter (int): Number of grid points sampled by the 'random' strategy.
+        budget_seconds (float, optional): Wall-clock budget of the 'budget' strategy.
+        max_evaluations (int, optional): Maximum number of grid points evaluated by the 'budget' strategy.
+
+        Returns:
+        tuple: (best estimator refitted on the training split, best cross-validated score, best params)
+        """
+        start = time.perf_counter()
+        n_points = len(ParameterGrid(param_grid))
+        if strategy == 'budget':
+            best_estimator, best_score, best_params, n_candidates, compute_seconds = self._budget_search(
+                estimator, param_grid, cv, n_jobs, budget_seconds, max_evaluations)
+            n_fits = n_candidates * cv
+        else:
+            if strategy == 'grid':
+                searcher = GridSearchCV(estimator, param_grid, cv=cv, scoring=SEARCH_SCORING, n_jobs=n_jobs)
+            elif strategy == 'halving':
+                from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+                from sklearn.model_selection import HalvingGridSearchCV
+                searcher = HalvingGridSearchCV(estimator, param_grid, cv=cv, scoring=SEARCH_SCORING, n_jobs=n_jobs,
+                                               factor=SEARCH_HALVING_FACTOR, random_state=RANDOM_SEED)
+            elif strategy == 'random':
+                searcher = RandomizedSearchCV(estimator, param_grid, n_iter=min(n_iter, n_points), cv=cv,
+                                              scoring=SEARCH_SCORING, n_jobs=n_jobs, random_state=RANDOM_SEED)
+            else:
+                raise ValueError(f"Unknown search strategy '{strategy}', expected 'grid', 'halving', 'random' or 'budget'")
+            searcher.fit(self.X_train, self.y_train)
+            results = searcher.cv_results_
+            best_estimator, best_score, best_params = searcher.best_estimator_, float(searcher.best_score_), searcher.best_params_
+            # Halving evaluates some grid points several times, on growing subsets
+            n_fits = len(results['params']) * searcher.n_splits_
+            n_candidates = len({repr(sorted(params.items())) for params in results['params']})
+            compute_seconds = float(np.sum(results['mean_fit_time'] + results['mean_score_time']) * searcher.n_splits_)
+
+        self.search_stats = {'strategy': strategy,
+                             'grid_points': n_points,
+                             'candidates_evaluated': n_candidates,
+                             'fits': n_fits,
+                             'wall_seconds': time.perf_counter() - start,
+                             'compute_seconds': compute_seconds}
+        return best_estimator, best_score, best_params
+
+    def optimize_best_model(self, best_model_name, best_model_instance, strategy=SEARCH_STRATEGY, n_jobs=SEARCH_N_JOBS):
+        """
+        Perform hyperparameter optimization on the best model.
+
+        Parameters:
+        best_model_name (str): Name of the best candidate.
+        best_model_instance: The fitted best candidate.
+        strategy (str): Search strategy, see `search`.
+        n_jobs (int): Number of parallel search fits, -1 for every core.
 
         Returns:
         tuple: Best model name and best model instance after hyperparameter tuning.
@@ -85,51 +277,40 @@ class BestModelFinder:
         try:
             self.logger.add_log(self.log_file, f'Starting hyperparameter tuning for the best model: {best_model_name}.')
 
-            # Define parameter grids for hyperparameter tuning
-            param_grids = {
-                'RandomForest': {
-                    'n_estimators': [50, 100, 150],
-                    'max_depth': [None, 10, 20],
-                    'min_samples_split': [2, 5, 10],
-                    'n_jobs': [2]
-                },
-                'SVR': {
-                    'kernel': ['linear', 'rbf'],
-                    'C': [1, 10, 100],
-                    'epsilon': [0.1, 0.01, 0.001]
-                },
-                'GradientBoostingRegressor': {
-                    'n_estimators': [50, 100],
-                    'learning_rate': [0.05, 0.01, 0.001],
-                    'max_depth': [3, 5, 10]
-                }
-            }
-
-            if best_model_name in param_grids:
-                grid_search = GridSearchCV(best_model_instance, param_grids[best_model_name], cv=5, scoring='neg_mean_squared_error')
-                grid_search.fit(self.X_train, self.y_train)
-
-                best_model_instance = grid_search.best_estimator_
-                best_score = grid_search.best_score_
+            if best_model_name in PARAM_GRIDS:
+                with optional_stage(self.metrics, 'hyperparameter_search', len(self.X_train), cluster=self.cluster_number,
+                                    model=best_model_name, strategy=strategy):
+                    best_model_instance, best_score, best_params = self.search(best_model_instance, PARAM_GRIDS[best_model_name], strategy, n_jobs=n_jobs)
+                best_metrics = {'neg_mean_squared_error': best_score}
+                best_metrics.update({f'search.{key}': value for key, value in self.search_stats.items() if key != 'strategy'})
 
                 self.logger.add_log(self.log_file, f'Hyperparameter tuning completed for {best_model_name}.')
-                self.logger.add_log(self.log_file, f'Best params: {grid_search.best_params_}')
+                self.logger.add_log(self.log_file, f'Best params: {best_params}')
                 self.logger.add_log(self.log_file, f'Best score: {best_score}')
+                self.logger.add_log(self.log_file, f'Search compute: {self.search_stats}')
+            else:
+                best_params = best_model_instance.get_params()
+                best_metrics = {}
 
-                # Log parameters and metrics for the best model
-                with mlflow.start_run():
-                    mlflow.log_params(grid_search.best_params_)
-                    mlflow.log_metrics({'neg_mean_squared_error': best_score})
-
-                    # Log the best model
-                    custom_model_name = "prediction_model" + "_" + str(self.cluster_number)
-                    mlflow.sklearn.log_model(sk_model=best_model_instance, artifact_path=custom_model_name)
-                    mlflow.set_tag("model_name", custom_model_name)
+            # Evaluate on test data
+            y_pred = best_model_instance.predict(self.X_test)
+            best_metrics['r2_score'] = r2_score(self.y_test, y_pred)
+            for model_name, result in self.candidate_results.items():
+                best_metrics.update({f'candidate.{model_name}.{key}': result[key]
+                                     for key in ('r2_score', 'fit_seconds', 'predict_seconds')})
+            if self.metrics is not None:
+                best_metrics.update(self.metrics.mlflow_metrics(lambda entry: entry['labels'].get('cluster') == str(self.cluster_number)))
 
-                    # Evaluate on test data
-                    y_pred = best_model_instance.predict(self.X_test)
-                    r2 = r2_score(self.y_test, y_pred)
-                    mlflow.log_metrics({'r2_score': r2})
+            # Parameters, metrics and the best model of the MLflow run, logged by the caller with AsyncTracker.log_run
+            custom_model_name = "prediction_model" + "_" + str(self.cluster_number)
+            tags = {"model_name": custom_model_name}
+            if best_model_name in PARAM_GRIDS:
+                tags["search_strategy"] = strategy
+            self.tracking_record = {'params': best_params,
+                                    'metrics': best_metrics,
+                                    'tags': tags,
+                                    'model': best_model_instance,
+                                    'model_path': custom_model_name}
 
             return best_model_name, best_model_instance
 
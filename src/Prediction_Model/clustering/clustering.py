@@ -1,9 +1,25 @@
-import matplotlib.pyplot as plt
-from kneed import KneeLocator
-from sklearn.cluster import KMeans
+import hashlib
+import json
+import os
+import threading
+import numpy as np
 from Prediction_Model.file_operations.file_methods import FileOperations
 from Prediction_Model.data_preprocessing.data_preprocessing import Preprocessor
-from Prediction_Model.config.config import PACKAGE_ROOT, RANDOM_SEED, CLUSTERING_MODEL_NAME, MODELS_DIR
+from Prediction_Model.config.config import (PACKAGE_ROOT,
+                                            RANDOM_SEED,
+                                            CLUSTERING_MODEL_NAME,
+                                            MODELS_DIR,
+                                            ELBOW_CACHE_DIR,
+                                            ELBOW_CACHE_ENABLED,
+                                            ELBOW_CACHE_KEEP,
+                                            ELBOW_N_JOBS,
+                                            ELBOW_PLOT)
+
+
+def _kmeans_inertia(data, n_clusters):
+    from sklearn.cluster import KMeans
+    return KMeans(n_clusters=n_clusters, init='k-means++', random_state=RANDOM_SEED).fit(data).inertia_
+
 
 class KMeansClustering:
     def __init__(self, logger_file, logger):
@@ -16,36 +32,121 @@ class KMeansClustering:
         """
         self.log_file = logger_file
         self.logger = logger
+        self.model = None
+        self.plot_thread = None
+
+    @staticmethod
+    def data_fingerprint(data, max_clusters):
+        """
+        Fingerprint the inputs of an elbow search.
 
-    def elbow_plot(self, data, max_clusters=10):
+        Parameters:
+        data (numpy.ndarray or pandas.DataFrame): The dataset to be clustered.
+        max_clusters (int): The maximum number of clusters considered.
+
+        Returns:
+        str: Hex digest identifying the data, the search range and the KMeans settings.
+        """
+        import sklearn
+        digest = hashlib.blake2b(digest_size=16)
+        if hasattr(data, 'columns'):
+            digest.update(json.dumps([str(col) for col in data.columns]).encode('utf-8'))
+        X = np.ascontiguousarray(data, dtype=np.float64)
+        digest.update(json.dumps([X.shape, max_clusters, RANDOM_SEED, sklearn.__version__]).encode('utf-8'))
+        digest.update(X.tobytes())
+        return digest.hexdigest()
+
+    def _load_cached_distortions(self, fingerprint):
+        cache_file = os.path.join(ELBOW_CACHE_DIR, fingerprint + '.json')
+        if not os.path.exists(cache_file):
+            return None
+        try:
+            with open(cache_file) as f:
+                distortions = json.load(f)['distortions']
+            # Marks the curve as recently used for pruning
+            os.utime(cache_file)
+            return distortions
+        except (OSError, ValueError, KeyError):
+            # A corrupt entry is recomputed and overwritten
+            return None
+
+    def _save_cached_distortions(self, fingerprint, distortions):
+        os.makedirs(ELBOW_CACHE_DIR, exist_ok=True)
+        cache_file = os.path.join(ELBOW_CACHE_DIR, fingerprint + '.json')
+        tmp_file = cache_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'distortions': distortions}, f)
+        os.replace(tmp_file, cache_file)
+        self._prune_cache()
+
+    def _prune_cache(self, keep=ELBOW_CACHE_KEEP):
+        # Every new training file adds a curve, only the most recently used ones are kept
+        cache_files = [os.path.join(ELBOW_CACHE_DIR, name) for name in os.listdir(ELBOW_CACHE_DIR) if name.endswith('.json')]
+        cache_files.sort(key=os.path.getmtime, reverse=True)
+        for cache_file in cache_files[keep:]:
+            try:
+                os.remove(cache_file)
+            except FileNotFoundError:
+                continue
+            self.logger.add_log(self.log_file, f"Removed the cached inertia curve {os.path.basename(cache_file)[:-len('.json')]}.")
+
+    def _render_plot(self, distortions, plot_file):
+        # Figure API instead of pyplot, which is not safe to use outside the main thread
+        from matplotlib.figure import Figure
+        try:
+            n_clusters = range(1, len(distortions) + 1)
+            fig = Figure(figsize=(8, 5))
+            ax = fig.add_subplot()
+            ax.plot(n_clusters, distortions, marker='o', linestyle='--')
+            ax.set_xlabel('Number of clusters')
+            ax.set_ylabel('Distortion')
+            ax.set_title('Elbow Plot')
+            ax.set_xticks(list(n_clusters))
+            ax.grid(True)
+            fig.savefig(plot_file)
+            self.logger.add_log(self.log_file, 'Created Elbow plot and saved it.')
+        except Exception as e:
+            self.logger.add_log(self.log_file, 'Error while creating the elbow plot::'+str(e))
+
+    def elbow_plot(self, data, max_clusters=10, plot=ELBOW_PLOT, use_cache=ELBOW_CACHE_ENABLED, n_jobs=ELBOW_N_JOBS):
         """
         Find the optimal number of clusters for KMeans clustering using the elbow method.
 
+        The KMeans models for k=1..max_clusters are fitted concurrently and their inertia curve
+        is cached by a fingerprint of the data, so retraining on unchanged data skips the fits.
+        The plot is rendered on a background thread, see `plot_thread`.
+
         Parameters:
         data (numpy.ndarray or pandas.DataFrame): The dataset to be clustered.
         max_clusters (int): The maximum number of clusters to consider. Defaults to 10.
+        plot (bool): Save the elbow plot to clustering/K-Means_Elbow.PNG.
+        use_cache (bool): Reuse the inertia curve computed for the same data.
+        n_jobs (int): Number of concurrent fits, -1 for every core.
 
         Returns:
         int: The optimal number of clusters.
         """
         self.logger.add_log(self.log_file, 'Entered the elbow_plot method of the KMeansClustering class')
-        distortions = []
+        # Knee detection is only needed here, not when the package is imported
+        from kneed import KneeLocator
         try:
-            for i in range(1, max_clusters + 1):
-                kmeans = KMeans(n_clusters=i, init='k-means++', random_state=RANDOM_SEED)
-                kmeans.fit(data)
-                distortions.append(kmeans.inertia_)
-
-            # Plot the elbow plot
-            plt.figure(figsize=(8, 5))
-            plt.plot(range(1, max_clusters + 1), distortions, marker='o', linestyle='--')
-            plt.xlabel('Number of clusters')
-            plt.ylabel('Distortion')
-            plt.title('Elbow Plot')
-            plt.xticks(range(1, max_clusters + 1))
-            plt.grid(True)
-            plt.savefig(f'{PACKAGE_ROOT}/clustering/K-Means_Elbow.PNG')
-            self.logger.add_log(self.log_file, 'Created Elbow plot and saved it.')
+            fingerprint = self.data_fingerprint(data, max_clusters) if use_cache else None
+            distortions = self._load_cached_distortions(fingerprint) if use_cache else None
+            if distortions is not None:
+                self.logger.add_log(self.log_file, f'Reused the cached inertia curve {fingerprint}.')
+            else:
+                from joblib import Parallel, delayed
+                # The process-based backend also caps the BLAS and OpenMP threads of every fit
+                distortions = Parallel(n_jobs=n_jobs)(delayed(_kmeans_inertia)(data, k) for k in range(1, max_clusters + 1))
+                distortions = [float(d) for d in distortions]
+                if use_cache:
+                    self._save_cached_distortions(fingerprint, distortions)
+
+            if plot:
+                self.plot_thread = threading.Thread(target=self._render_plot,
+                                                    args=(distortions, f'{PACKAGE_ROOT}/clustering/K-Means_Elbow.PNG'),
+                                                    name='elbow-plot')
+                self.plot_thread.start()
 
             # Find the optimal number of clusters using the KneeLocator
             kn = KneeLocator(range(1, max_clusters + 1), distortions, curve='convex', direction='decreasing')
@@ -56,25 +157,29 @@ class KMeansClustering:
             self.logger.add_log(self.log_file, 'Error while creating the elbow plot and finding optimal number of clusters::'+str(e))
             raise Exception()
 
-    def create_clusters(self, dataframe, optimal_clusters):
+    def create_clusters(self, dataframe, optimal_clusters, models_dir=MODELS_DIR):
         """
         Perform KMeans clustering on the provided DataFrame.
 
         Parameters:
         dataframe (pandas.DataFrame): DataFrame containing data to be clustered.
         optimal_clusters (int): The optimal number of clusters.
+        models_dir (str, optional): Directory the clustering model is saved to, e.g. the directory of the generation being trained.
 
         Returns:
         pandas.DataFrame: DataFrame with an additional 'cluster' column indicating cluster assignments.
         """
         self.logger.add_log(self.log_file, 'Entered the create_clusters method of the KMeansClustering class')
+        from sklearn.cluster import KMeans
         file_operations = FileOperations(self.log_file, self.logger)
         try:
-            data = dataframe.copy()
+            # Shallow, the features may be mapped from the feature store and are not modified
+            data = dataframe.copy(deep=False)
             kmeans = KMeans(n_clusters=optimal_clusters, init='k-means++', random_state=RANDOM_SEED)
             y_pred = kmeans.fit_predict(data)
             # Save the model
-            file_operations.save_model(kmeans, CLUSTERING_MODEL_NAME, MODELS_DIR)
+            file_operations.save_model(kmeans, CLUSTERING_MODEL_NAME, models_dir)
+            self.model = kmeans
 
             data['cluster'] = y_pred
             self.logger.add_log(self.log_file, 'Trained clustering model and saved it.')
@@ -83,3 +188,25 @@ class KMeansClustering:
         except Exception as e:
             self.logger.add_log(self.log_file, 'Error while training clustering model::'+str(e))
             raise Exception()
+
+    def assign_clusters(self, dataframe, model):
+        """
+        Assign the rows to the clusters of an already trained KMeans model.
+
+        Parameters:
+        dataframe (pandas.DataFrame): DataFrame containing data to be clustered.
+        model (sklearn.cluster.KMeans): The trained clustering model.
+
+        Returns:
+        pandas.DataFrame: DataFrame with an additional 'cluster' column indicating cluster assignments.
+        """
+        self.logger.add_log(self.log_file, 'Entered the assign_clusters method of the KMeansClustering class')
+        try:
+            data = dataframe.copy(deep=False)
+            data['cluster'] = model.predict(dataframe)
+            self.model = model
+            self.logger.add_log(self.log_file, 'Assigned the data to the existing clusters.')
+            return data
+        except Exception as e:
+            self.logger.add_log(self.log_file, 'Error while assigning clusters::'+str(e))
+            raise Exception()
@@ -1,10 +1,10 @@
 import pathlib 
 import os
-import Prediction_Model
 from datetime import datetime
 
 """General Paths"""
-PACKAGE_ROOT = pathlib.Path(Prediction_Model.__file__).parent
+# Resolved from this file so importing the config does not import the package itself
+PACKAGE_ROOT = pathlib.Path(__file__).resolve().parent.parent
 APP_LOGS_DIR = os.path.join(PACKAGE_ROOT, "Application_Logs")
 DATA_DIR = os.path.join(PACKAGE_ROOT, "DATA")
 # Regex pattern for validating file names
@@ -19,16 +19,60 @@ TRAINING_FILES_DIR = os.path.join(DATA_DIR, "Training_Batch_Files")
 TRAINING_DATA_DIR = os.path.join(DATA_DIR, "Training_File_From_Db")
 # Training data file name
 TRAINING_DATA_FILE = "input_file.csv"
+# Memory-mapped preprocessed training features, keyed by a hash of the training data file
+FEATURE_STORE_DIR = os.path.join(DATA_DIR, "Feature_Store")
+# Number of feature store entries kept, older ones are removed
+FEATURE_STORE_KEEP = 3
 # Logs for training data ingestion
 TRAINING_DATA_INGESTION_LOGS_FILE = os.path.join(APP_LOGS_DIR, "train_data_ingestion_logs.log")
 # Logs for training data validation
 TRAINING_DATA_VALIDATION_LOGS_FILE = os.path.join(APP_LOGS_DIR, "train_data_validation_logs.log")
+# Threads inspecting raw files concurrently during column validation
+RAW_VALIDATION_WORKERS = 16
+# Data rows read from every raw file to check that they fit its header, the rest of the file is never read
+RAW_VALIDATION_SAMPLE_ROWS = 100
 # Logs for training process
 TRAINING_LOGS = os.path.join(APP_LOGS_DIR, 'training_logs.log')
-# Directories for good, bad, and archived training data
-GOOD_RAW_DIR_TRAIN = os.path.join(PACKAGE_ROOT, TRAINING_VALIDATED, "Good_Raw_Data")
-BAD_RAW_DIR_TRAIN = os.path.join(PACKAGE_ROOT, TRAINING_VALIDATED, "Bad_Raw_Data")
+# Train the cluster models concurrently: None (sequential, the default) or the opt-in 'process'
+TRAINING_PARALLEL_BACKEND = os.environ.get('TRAINING_PARALLEL_BACKEND') or None
+# Retrain only the clusters whose training data or search configuration changed since the last generation
+INCREMENTAL_TRAINING = os.environ.get('INCREMENTAL_TRAINING', '0') == '1'
+# Stream the training data in chunks and fit incremental estimators, for training sets larger than memory
+OUT_OF_CORE_TRAINING = os.environ.get('OUT_OF_CORE_TRAINING', '0') == '1'
+# Rows read, preprocessed and learned from at a time in out-of-core training
+OUT_OF_CORE_CHUNK_SIZE = int(os.environ.get('OUT_OF_CORE_CHUNK_SIZE', 100000))
+# Rows sampled for the elbow search in out-of-core training
+OUT_OF_CORE_SAMPLE_ROWS = 50000
+# Passes of the incremental regressors over the training rows
+OUT_OF_CORE_EPOCHS = 5
+# Total cores shared by every parallel level of training (clusters, candidates, search folds, BLAS), 0 uses every core
+CPU_BUDGET = int(os.environ.get('CPU_BUDGET', 0))
+# Comma separated candidate models compared on every cluster, see best_model_finder/model_finder.py
+CANDIDATE_MODELS = [name.strip() for name in os.environ.get('CANDIDATE_MODELS', 'RandomForest,SVR,LinearRegression,GradientBoostingRegressor').split(',') if name.strip()]
+# Maximum number of candidate models fitted at the same time, -1 uses every core
+CANDIDATE_N_JOBS = -1
+# Hyperparameter search of the best candidate: 'grid' (exhaustive), or the opt-in 'halving', 'random' or 'budget'
+SEARCH_STRATEGY = os.environ.get('SEARCH_STRATEGY', 'grid')
+# Number of cross-validation folds of the hyperparameter search
+SEARCH_CV_FOLDS = 5
+# Number of parallel search fits, -1 uses every core
+SEARCH_N_JOBS = -1
+# Number of grid points sampled by the 'random' strategy
+SEARCH_N_ITER = 10
+# Fraction of candidates kept at every round of the 'halving' strategy is 1 / SEARCH_HALVING_FACTOR
+SEARCH_HALVING_FACTOR = 3
+# Wall-clock budget of the 'budget' strategy in seconds, None for no time limit
+SEARCH_BUDGET_SECONDS = 60
+# Maximum number of grid points evaluated by the 'budget' strategy, None for no limit
+SEARCH_MAX_EVALUATIONS = None
+# Verdicts of the last training data validation, the accepted files are inserted in the DB where they are
+VALIDATION_MANIFEST_TRAIN = os.path.join(PACKAGE_ROOT, TRAINING_VALIDATED, "validation_manifest.json")
+# Directory receiving the rejected training files
 ARCHIVE_DIR_TRAIN = os.path.join(PACKAGE_ROOT, TRAINING_VALIDATED, "Archive")
+# Training files already inserted in the DB, so validation only processes new or changed files
+INGESTION_LEDGER_TRAIN = os.path.join(PACKAGE_ROOT, TRAINING_VALIDATED, "ingestion_ledger.json")
+# Empty the training table and ingest every training file again, ignoring the ledger
+INGESTION_FORCE_FULL = os.environ.get('INGESTION_FORCE_FULL', '0') == '1'
 # List of numeric columns in the training dataframe
 NUMERIC_COLS = ['Cement _component_1', 'Blast Furnace Slag _component_2',
                 'Fly Ash _component_3', 'Water_component_4',
@@ -51,10 +95,12 @@ PREDICTION_DATA_INGESTION_LOGS_FILE = os.path.join(APP_LOGS_DIR, "prediction_dat
 PREDICTION_DATA_VALIDATION_LOGS_FILE = os.path.join(APP_LOGS_DIR, "prediction_data_validation_logs.log")
 # Logs for training process
 PREDICTION_LOGS = os.path.join(APP_LOGS_DIR, 'prediction_logs.log')
-# Directories for good, bad, and archived prediction data
-GOOD_RAW_DIR_PRED = os.path.join(PACKAGE_ROOT, PREDICTION_VALIDATED, "Good_Raw_Data")
-BAD_RAW_DIR_PRED = os.path.join(PACKAGE_ROOT, PREDICTION_VALIDATED, "Bad_Raw_Data")
+# Verdicts of the last prediction data validation, the accepted files are inserted in the DB where they are
+VALIDATION_MANIFEST_PRED = os.path.join(PACKAGE_ROOT, PREDICTION_VALIDATED, "validation_manifest.json")
+# Directory receiving the rejected prediction files
 ARCHIVE_DIR_PRED = os.path.join(PACKAGE_ROOT, PREDICTION_VALIDATED, "Archive")
+# Directory the file uploaded in the app is written to, once, before it is validated
+UPLOAD_DIR_PRED = os.path.join(PACKAGE_ROOT, PREDICTION_VALIDATED, "Uploads")
 # List of numeric columns in the training dataframe
 NUMERIC_COLS_PRED = ['Cement _component_1', 'Blast Furnace Slag _component_2',
                 'Fly Ash _component_3', 'Water_component_4',
@@ -63,15 +109,81 @@ NUMERIC_COLS_PRED = ['Cement _component_1', 'Blast Furnace Slag _component_2',
                 ]
 PREDICTION_OUTPUT_DIR = os.path.join(PACKAGE_ROOT,DATA_DIR,'Prediction_output')
 PREDICTION_OUTPUT_FILE = os.path.join(PREDICTION_OUTPUT_DIR, 'prediction.csv')
+# Maximum number of rows scored by a single model.predict call
+PREDICTION_BATCH_SIZE = 10000
+# Score cluster partitions concurrently: None (sequential), 'thread' or 'process'
+PREDICTION_PARALLEL_BACKEND = 'thread'
+# Maximum number of scoring workers, -1 uses every core
+PREDICTION_N_JOBS = -1
+# Inputs with fewer rows are scored sequentially, dispatching them to the pool costs more than it saves
+PREDICTION_PARALLEL_MIN_ROWS = 2000
+# Flatten tree ensembles into the array-backed engine of predict/tree_engine.py
+COMPILE_TREE_ENSEMBLES = True
+# Largest batch scored with the array-backed engine, bigger batches use the sklearn model
+TREE_ENGINE_MAX_BATCH_ROWS = 128
+# Answer repeated mix designs from an in-memory cache instead of rescoring them
+PREDICTION_CACHE_ENABLED = False
+# Maximum number of cached rows
+PREDICTION_CACHE_SIZE = 100000
+# Lifetime of a cached prediction in seconds, None keeps it until evicted
+PREDICTION_CACHE_TTL_SECONDS = 3600
+# Read, score and write the prediction input in chunks instead of loading it whole
+PREDICTION_STREAMING = False
+# Number of rows per chunk in streaming prediction
+PREDICTION_CHUNK_SIZE = 50000
 
 
 """Model Paths"""
 # Directory for storing trained models
 MODELS_DIR = os.path.join(PACKAGE_ROOT, "Models")
-PREDICTION_MODELS_DIR = os.path.join(MODELS_DIR, "Prediction_Models")
+# Every training run writes its models to a new directory here, never modified once published
+GENERATIONS_DIR = os.path.join(MODELS_DIR, "generations")
+# Subdirectories of a generation holding the cluster models and the scalers fitted on each cluster's training split
+PREDICTION_MODELS_SUBDIR = "Prediction_Models"
+SCALERS_SUBDIR = "Scalers"
+# Manifest of a generation, mapping every cluster to its trained model, scaler and MLflow run
+MODEL_MANIFEST_NAME = "model_manifest.json"
+# Manifest of models trained before generation directories, read when the current generation has no directory
+MODEL_MANIFEST_FILE = os.path.join(MODELS_DIR, MODEL_MANIFEST_NAME)
 # Random seed for reproducibility
 RANDOM_SEED = 42
 CLUSTERING_MODEL_NAME = 'Kmeans'
+# Name of the compiled inference pipeline (log transform, routing, scaling and cluster models)
+INFERENCE_PIPELINE_NAME = 'InferencePipeline'
+# Arrays of the inference pipeline at least this large are stored as memory-mappable .npy files
+MAPPED_ARRAY_MIN_BYTES = 4096
+# Pointer to the current model generation, replaced atomically once every model of the generation is saved
+MODEL_GENERATION_FILE = os.path.join(MODELS_DIR, "generation.txt")
+# Number of published generations kept on disk, older ones are removed after every training run
+MODEL_GENERATIONS_KEEP = 3
+# Number of model generations kept loaded in memory by the model registry
+MODEL_REGISTRY_CAPACITY = 2
+# Inertia curves of previous elbow searches, keyed by a fingerprint of the clustered data
+ELBOW_CACHE_DIR = os.path.join(MODELS_DIR, "Elbow_Cache")
+# Skip the elbow search when the clustered data did not change
+ELBOW_CACHE_ENABLED = True
+# Number of cached inertia curves kept, the least recently used are removed
+ELBOW_CACHE_KEEP = 3
+# Number of KMeans fits run concurrently by the elbow search, -1 uses every core
+ELBOW_N_JOBS = -1
+# Render clustering/K-Means_Elbow.PNG during training, headless jobs leave it off
+ELBOW_PLOT = os.environ.get('ELBOW_PLOT', '0') == '1'
+
+"""Online Serving Configs"""
+# Address of the online scoring server
+SERVING_HOST = os.environ.get('SERVING_HOST', '127.0.0.1')
+SERVING_PORT = int(os.environ.get('SERVING_PORT', 8090))
+# Maximum number of rows scored together in one micro-batch
+SERVING_MAX_BATCH_SIZE = 256
+# Connections waiting to be accepted, the stdlib default of 5 drops clients when many send at once
+SERVING_BACKLOG = 128
+# How long the first request of a micro-batch waits for others to join, in milliseconds
+SERVING_MAX_WAIT_MS = 2
+# Load the sklearn tree ensembles next to their array-backed copies when serving, which
+# speeds up very large batches at the cost of a private copy of every forest per process
+SERVING_LOAD_TREE_MODELS = False
+# Log file of the online scoring server
+SERVING_LOGS = os.path.join(APP_LOGS_DIR, 'serving_logs.log')
 
 """MLFlow and MySQL Configs"""
 # URI for MLFlow tracking
@@ -79,6 +191,14 @@ now = datetime.now()
 date_time = now.strftime("%Y%m%d_%H%M%S") 
 MLFLOW_URI = os.environ.get('MLFLOW_URI')
 MLFLOW_EXPERIMENT_NAME = f"cement_st_pred_{date_time}"
+# Local MLflow file store receiving the runs while the tracking server is unreachable
+TRACKING_FALLBACK_DIR = os.path.join(PACKAGE_ROOT, "mlruns")
+# Runs uploaded to MLflow at the same time, in background threads
+TRACKING_UPLOAD_WORKERS = 4
+# Retries of a failed tracking call, with exponential backoff
+TRACKING_RETRIES = 3
+# Seconds before the first retry of a tracking call
+TRACKING_RETRY_BACKOFF = 0.5
 # Table name for storing good raw data in the database
 GOOD_RAW_TABLE_TRAIN = "good_training_data"
 GOOD_RAW_TABLE_PREDICTION = "good_prediction_data"
@@ -89,3 +209,15 @@ USERNAME_MYSQL = os.environ.get('MYSQL_USER')
 PASSWORD_MYSQL = os.environ.get('MYSQL_PASSWORD')
 DATABASE = os.environ.get('MYSQL_DATABASE')
 HOST = os.environ.get('MYSQL_HOST')
+
+"""Metrics Configs"""
+# Directory receiving the per-stage metrics of the last training and prediction runs (JSON and Prometheus text files)
+METRICS_DIR = os.path.join(APP_LOGS_DIR, "Metrics")
+# Record the peak Python allocation of every stage with tracemalloc, slows down allocation heavy stages
+METRICS_TRACE_MEMORY = False
+
+"""Import Time Benchmark"""
+# Cold import times recorded by utils/import_benchmark.py
+IMPORT_TIME_BASELINE_FILE = os.path.join(PACKAGE_ROOT, "import_time_baseline.json")
+# Allowed slowdown over the baseline before the benchmark fails, as a fraction
+IMPORT_TIME_TOLERANCE = 0.25
@@ -32,3 +32,39 @@ class Data_Loader:
             error_message = f"Error occurred while reading {self.data_type} data: {str(e)}"
             self.logger_obj.add_log(self.log_file_obj, error_message)
             raise Exception(error_message)
+
+    def get_data_in_chunks(self, chunk_size):
+        """
+        Read data from the source file in bounded chunks.
+
+        Parameters:
+        chunk_size (int): Maximum number of rows per chunk.
+
+        Yields:
+        pandas.DataFrame: The next chunk of the loaded data.
+        """
+        try:
+            self.logger_obj.add_log(self.log_file_obj, f"Entered into get_data_in_chunks function of Data_Loader class for {self.data_type} data.")
+            with pd.read_csv(self.file, chunksize=chunk_size) as reader:
+                for chunk in reader:
+                    yield chunk
+            self.logger_obj.add_log(self.log_file_obj, f"{self.data_type.capitalize()} data read successfully.")
+        except Exception as e:
+            error_message = f"Error occurred while reading {self.data_type} data: {str(e)}"
+            self.logger_obj.add_log(self.log_file_obj, error_message)
+            raise Exception(error_message)
+
+    def count_rows(self):
+        """
+        Count the data rows of the source file without parsing it.
+
+        Returns:
+        int: Number of non-empty lines after the header.
+        """
+        try:
+            with open(self.file, 'rb') as f:
+                return max(0, sum(1 for line in f if line.strip()) - 1)
+        except Exception as e:
+            error_message = f"Error occurred while counting {self.data_type} data rows: {str(e)}"
+            self.logger_obj.add_log(self.log_file_obj, error_message)
+            raise Exception(error_message)
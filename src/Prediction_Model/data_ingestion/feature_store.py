@@ -0,0 +1,270 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from Prediction_Model.config.config import FEATURE_STORE_DIR, FEATURE_STORE_KEEP
+
+# Bumped whenever the preprocessing applied before storing changes, so old entries are not reused
+STORE_VERSION = 1
+# Rows copied at a time when an entry is reordered into partitions
+PARTITION_COPY_ROWS = 100000
+
+
+class StoredPartition:
+    """
+    Rows of a feature store entry, e.g. one cluster, stored next to each other.
+
+    Only the location of the partitioned copy and the bounds of the rows are pickled, so a
+    worker process maps the stored files itself and shares their pages with every other
+    process reading them.
+
+    Attributes:
+    partitions_dir (str): Directory of the entry reordered by partition, see `FeatureStore.partitions`.
+    start (int): First row of the partition in the reordered copy.
+    stop (int): End of the rows of the partition in the reordered copy.
+    """
+    def __init__(self, partitions_dir, start, stop):
+        self.partitions_dir = partitions_dir
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def load(self):
+        """
+        Read the rows of the partition without copying them.
+
+        Returns:
+        tuple: features (pandas.DataFrame), label (pandas.Series), views of the read-only memory maps
+               indexed by the row numbers in the entry.
+        """
+        features = np.load(os.path.join(self.partitions_dir, 'features.npy'), mmap_mode='r')
+        labels = np.load(os.path.join(self.partitions_dir, 'labels.npy'), mmap_mode='r')
+        rows = np.load(os.path.join(self.partitions_dir, 'rows.npy'), mmap_mode='r')
+        with open(os.path.join(self.partitions_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        index = pd.Index(rows[self.start:self.stop])
+        # Basic slices of the maps, copy=False keeps the frame on the mapped pages
+        return (pd.DataFrame(features[self.start:self.stop], columns=meta['feature_columns'], index=index, copy=False),
+                pd.Series(labels[self.start:self.stop], name=meta['label_column'], index=index, copy=False))
+
+
+class FeatureStore:
+    """
+    Cleaned and log-transformed training features persisted as memory-mapped NumPy files.
+
+    Every entry is a directory named after a hash of the training data file, holding
+    features.npy, labels.npy and meta.json, and the same rows grouped by cluster in its
+    partitions directory. Reading an entry maps the files instead of
+    parsing and preprocessing the CSV again, and processes reading the same entry share
+    its pages through the page cache.
+    """
+    def __init__(self, log_file, logger, store_dir=FEATURE_STORE_DIR, keep=FEATURE_STORE_KEEP):
+        """
+        Initialize the FeatureStore.
+
+        Parameters:
+        log_file: Log file object.
+        logger: Logger object.
+        store_dir (str, optional): Directory of the entries.
+        keep (int, optional): Number of entries kept, the least recently written are removed.
+        """
+        self.log_file = log_file
+        self.logger = logger
+        self.store_dir = store_dir
+        self.keep = keep
+
+    def source_key(self, source_file, feature_columns, label_column, variant=None):
+        """
+        Hash the training data file together with the layout of the stored features.
+
+        Parameters:
+        source_file (str): The training data file.
+        feature_columns (list): Feature columns stored.
+        label_column (str): Label column stored.
+        variant (str, optional): Distinguishes entries preprocessed differently from the same file,
+                                 e.g. imputed chunk by chunk.
+
+        Returns:
+        str: Hex digest naming the entry.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps([STORE_VERSION, list(feature_columns), label_column, variant]).encode('utf-8'))
+        with open(source_file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.store_dir, key)
+
+    @staticmethod
+    def read_entry(entry_dir):
+        """
+        Map the files of an entry.
+
+        Parameters:
+        entry_dir (str): Directory of the entry.
+
+        Returns:
+        tuple: features (pandas.DataFrame), label (pandas.Series), both backed by read-only memory maps.
+        """
+        with open(os.path.join(entry_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        features = np.load(os.path.join(entry_dir, 'features.npy'), mmap_mode='r')
+        labels = np.load(os.path.join(entry_dir, 'labels.npy'), mmap_mode='r')
+        # copy=False keeps the frame on the mapped pages
+        return (pd.DataFrame(features, columns=meta['feature_columns'], copy=False),
+                pd.Series(labels, name=meta['label_column'], copy=False))
+
+    def load(self, key):
+        """
+        Read a stored entry.
+
+        Parameters:
+        key (str): Key of the entry, from `source_key`.
+
+        Returns:
+        tuple or None: features (pandas.DataFrame), label (pandas.Series), None when the entry is not stored.
+        """
+        entry_dir = self.entry_dir(key)
+        if not os.path.exists(os.path.join(entry_dir, 'meta.json')):
+            return None
+        try:
+            features, label = self.read_entry(entry_dir)
+            # Marks the entry as recently used for pruning
+            os.utime(entry_dir)
+            self.logger.add_log(self.log_file, f"Loaded {len(features)} preprocessed rows from the feature store entry {key}.")
+            return features, label
+        except (OSError, ValueError, KeyError) as e:
+            # A damaged entry is rebuilt from the training data
+            self.logger.add_log(self.log_file, f"Ignoring the unreadable feature store entry {key} :: {str(e)}")
+            return None
+
+    def save(self, key, features, label):
+        """
+        Store the preprocessed features and labels and map them back.
+
+        Parameters:
+        key (str): Key of the entry, from `source_key`.
+        features (pandas.DataFrame): Cleaned, log-transformed features.
+        label (pandas.Series): Target values.
+
+        Returns:
+        tuple: features (pandas.DataFrame), label (pandas.Series), backed by the stored files.
+        """
+        return self.save_chunks(key, [(features, label)], len(features), list(features.columns), label.name)
+
+    def save_chunks(self, key, chunks, n_rows, feature_columns, label_column):
+        """
+        Store preprocessed chunks one at a time, so the entry can be larger than memory.
+
+        Parameters:
+        key (str): Key of the entry, from `source_key`.
+        chunks (iterable): (features (pandas.DataFrame), label (pandas.Series)) of every chunk, in row order.
+        n_rows (int): Total number of rows of the chunks.
+        feature_columns (list): Feature columns stored, in this order.
+        label_column (str): Name of the label.
+
+        Returns:
+        tuple: features (pandas.DataFrame), label (pandas.Series), backed by the stored files.
+        """
+        try:
+            entry_dir = self.entry_dir(key)
+            tmp_dir = entry_dir + '.tmp'
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            features = np.lib.format.open_memmap(os.path.join(tmp_dir, 'features.npy'), mode='w+',
+                                                 dtype=np.float64, shape=(n_rows, len(feature_columns)))
+            labels = np.lib.format.open_memmap(os.path.join(tmp_dir, 'labels.npy'), mode='w+',
+                                               dtype=np.float64, shape=(n_rows,))
+            written = 0
+            for chunk_features, chunk_label in chunks:
+                stop = written + len(chunk_features)
+                if stop > n_rows:
+                    raise ValueError(f"received more than the expected {n_rows} rows")
+                features[written:stop] = chunk_features[feature_columns].to_numpy(dtype=np.float64)
+                labels[written:stop] = chunk_label.to_numpy(dtype=np.float64)
+                written = stop
+            if written != n_rows:
+                raise ValueError(f"received {written} rows, expected {n_rows}")
+            features.flush()
+            labels.flush()
+            del features, labels
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+                json.dump({'feature_columns': [str(col) for col in feature_columns],
+                           'label_column': str(label_column),
+                           'rows': n_rows,
+                           'version': STORE_VERSION}, f, indent=4)
+            # Readers only ever see a complete entry
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+            self.logger.add_log(self.log_file, f"Saved {n_rows} preprocessed rows to the feature store entry {key}.")
+            self.prune()
+            return self.read_entry(entry_dir)
+        except Exception as e:
+            self.logger.add_log(self.log_file, f"Error while saving the feature store entry {key} :: {str(e)}")
+            raise Exception(f"Error while saving the feature store entry {key} :: {str(e)}")
+
+    def partitions(self, key, labels):
+        """
+        Store the rows of an entry grouped by partition, e.g. by cluster, and describe every partition.
+
+        The rows of every partition are copied next to each other, in their order in the entry,
+        into the `partitions` directory of the entry, replacing the grouping of a previous run.
+        Loading a partition then maps a contiguous slice instead of gathering its rows.
+
+        Parameters:
+        key (str): Key of the entry.
+        labels (array-like): Partition of every row of the entry.
+
+        Returns:
+        dict: Mapping of partition label to its StoredPartition, a picklable handle of the rows.
+        """
+        try:
+            entry_dir = self.entry_dir(key)
+            partitions_dir = os.path.join(entry_dir, 'partitions')
+            tmp_dir = partitions_dir + '.tmp'
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            labels = np.asarray(labels)
+            # Stable, so every partition keeps the row order of the entry
+            order = np.argsort(labels, kind='stable')
+            features = np.load(os.path.join(entry_dir, 'features.npy'), mmap_mode='r')
+            label_values = np.load(os.path.join(entry_dir, 'labels.npy'), mmap_mode='r')
+            grouped_features = np.lib.format.open_memmap(os.path.join(tmp_dir, 'features.npy'), mode='w+',
+                                                         dtype=features.dtype, shape=features.shape)
+            grouped_labels = np.lib.format.open_memmap(os.path.join(tmp_dir, 'labels.npy'), mode='w+',
+                                                       dtype=label_values.dtype, shape=label_values.shape)
+            for start in range(0, len(order), PARTITION_COPY_ROWS):
+                rows = order[start:start + PARTITION_COPY_ROWS]
+                grouped_features[start:start + len(rows)] = features[rows]
+                grouped_labels[start:start + len(rows)] = label_values[rows]
+            grouped_features.flush()
+            grouped_labels.flush()
+            del grouped_features, grouped_labels
+            np.save(os.path.join(tmp_dir, 'rows.npy'), order.astype(np.int64))
+            shutil.copyfile(os.path.join(entry_dir, 'meta.json'), os.path.join(tmp_dir, 'meta.json'))
+            shutil.rmtree(partitions_dir, ignore_errors=True)
+            os.replace(tmp_dir, partitions_dir)
+
+            values, starts, counts = np.unique(labels[order], return_index=True, return_counts=True)
+            return {value.item(): StoredPartition(partitions_dir, int(start), int(start + count))
+                    for value, start, count in zip(values, starts, counts)}
+        except Exception as e:
+            self.logger.add_log(self.log_file, f"Error while partitioning the feature store entry {key} :: {str(e)}")
+            raise Exception(f"Error while partitioning the feature store entry {key} :: {str(e)}")
+
+    def prune(self):
+        """
+        Remove the least recently used entries beyond `keep`.
+        """
+        entries = [os.path.join(self.store_dir, name) for name in os.listdir(self.store_dir)
+                   if not name.endswith('.tmp') and os.path.isdir(os.path.join(self.store_dir, name))]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for entry_dir in entries[self.keep:]:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            self.logger.add_log(self.log_file, f"Removed the feature store entry {os.path.basename(entry_dir)}.")
@@ -0,0 +1,108 @@
+import json
+import os
+from datetime import datetime
+from Prediction_Model.data_ingestion.validation_manifest import file_checksum
+
+
+class IngestionLedger:
+    """
+    Persistent record of the batch files already inserted in the DB.
+
+    Every ingested file is recorded with its size, modification time and SHA-256, so a
+    validation run only processes the files that arrived or changed since. A file whose
+    size and modification time are unchanged is skipped without being read. Otherwise its
+    checksum decides, so a file that was only touched is not ingested twice.
+
+    Attributes:
+    ledger_file (str): Location of the ledger.
+    files (dict): Mapping of file name to {'sha256', 'size', 'mtime_ns', 'ingested_at'}.
+    """
+    def __init__(self, ledger_file, files=None):
+        """
+        Initialize an IngestionLedger.
+
+        Parameters:
+        ledger_file (str): Location of the ledger.
+        files (dict, optional): Existing entries.
+        """
+        self.ledger_file = ledger_file
+        self.files = dict(files or {})
+
+    def classify(self, manifest):
+        """
+        Compare the files of a validation run with the ledger.
+
+        Parameters:
+        manifest (ValidationManifest): Verdicts of the file name validation.
+
+        Returns:
+        tuple: new (list), changed (list), unchanged (list) file names.
+        """
+        new, changed, unchanged = [], [], []
+        for file_name in sorted(manifest.verdicts):
+            entry = self.files.get(file_name)
+            if entry is None:
+                new.append(file_name)
+                continue
+            try:
+                stat = os.stat(manifest.path(file_name))
+            except FileNotFoundError:
+                # Removed since the file names were validated, its rows no longer match the directory
+                changed.append(file_name)
+                continue
+            if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+                unchanged.append(file_name)
+            elif stat.st_size == entry['size'] and file_checksum(manifest.path(file_name)) == entry['sha256']:
+                # Touched but identical, later runs skip it from its size and modification time again
+                entry['mtime_ns'] = stat.st_mtime_ns
+                unchanged.append(file_name)
+            else:
+                changed.append(file_name)
+        return new, changed, unchanged
+
+    def record(self, manifest):
+        """
+        Record the accepted files of a validation run as ingested.
+
+        Parameters:
+        manifest (ValidationManifest): Verdicts with the checksums of the inserted files.
+        """
+        ingested_at = datetime.now().isoformat(timespec='seconds')
+        for file_name in manifest.accepted_files():
+            verdict = manifest.verdicts[file_name]
+            self.files[file_name] = {'sha256': verdict['sha256'],
+                                     'size': verdict['size'],
+                                     'mtime_ns': verdict['mtime_ns'],
+                                     'ingested_at': ingested_at}
+
+    def clear(self):
+        """
+        Forget every file, e.g. before a full re-ingest.
+        """
+        self.files = {}
+
+    def save(self):
+        """
+        Write the ledger atomically, so readers never see a partially written file.
+        """
+        os.makedirs(os.path.dirname(self.ledger_file), exist_ok=True)
+        tmp_file = self.ledger_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'files': self.files}, f, indent=4)
+        os.replace(tmp_file, self.ledger_file)
+
+    @classmethod
+    def load(cls, ledger_file):
+        """
+        Read the ledger, empty when no file was ingested yet.
+
+        Parameters:
+        ledger_file (str): Location of the ledger.
+
+        Returns:
+        IngestionLedger: The loaded ledger.
+        """
+        if not os.path.exists(ledger_file):
+            return cls(ledger_file)
+        with open(ledger_file, 'r') as f:
+            return cls(ledger_file, **json.load(f))
@@ -1,9 +1,12 @@
+import csv
+import itertools
 import json
 import os
 import shutil
 import re
-import pandas as pd
-from Prediction_Model.config.config import PACKAGE_ROOT
+from concurrent.futures import ThreadPoolExecutor
+from Prediction_Model.config.config import PACKAGE_ROOT, RAW_VALIDATION_WORKERS, RAW_VALIDATION_SAMPLE_ROWS
+from Prediction_Model.data_ingestion.validation_manifest import ValidationManifest
 from Prediction_Model.app_logging.app_logger import App_Logger
 import traceback
 
@@ -54,204 +57,191 @@ class Raw_Data_Validation:
         
         return LengthOfDateStampInFile, LengthOfTimeStampInFile, NumberofColumns, ColName
         
-    def create_good_bad_archive_data_dir(self, data_ingestion_logs_path, good_raw_dir, bad_raw_dir, archive_dir):
+    def create_archive_dir(self, data_ingestion_logs_path, archive_dir):
         """
-        Creates the Good, Bad and Archive Data folders if they do not exist.
+        Creates the Archive Data folder if it does not exist.
 
         Parameters:
         data_ingestion_logs_path (str): Path to the data ingestion logs file.
-        good_raw_dir (str): Path to the directory to store good raw data files.
-        bad_raw_dir (str): Path to the directory to store bad raw data files.
         archive_dir (str): Path to the directory to store archived data files.
 
         """
         try:
-            if not os.path.exists(good_raw_dir):
-                os.makedirs(good_raw_dir)
-            if not os.path.exists(bad_raw_dir):
-                os.makedirs(bad_raw_dir)
             if not os.path.exists(archive_dir):
                 os.makedirs(archive_dir)
             logs_file = open(f"{data_ingestion_logs_path}", 'a+')
-            self.logger.add_log(logs_file, "Created Good, Bad and Archive Data folders.")
+            self.logger.add_log(logs_file, "Created Archive Data folder.")
             logs_file.close()
         except Exception as e:
             logs_file = open(f"{data_ingestion_logs_path}", 'a+')
-            self.logger.add_log(logs_file, "Error occurred while creating Good, Bad and Archive Data folder :: "+str(e))
+            self.logger.add_log(logs_file, "Error occurred while creating Archive Data folder :: "+str(e))
             logs_file.close()
             raise Exception()
-        
-    def remove_good_bad_dirs(self, data_ingestion_logs_path, good_raw_dir, bad_raw_dir):
-        """
-        Deletes the Good and Bad raw directories once the data is inserted in the DB.
-
-        Parameters:
-        data_ingestion_logs_path (str): Path to the data ingestion logs file.
-        good_raw_dir (str): Path to the directory storing good raw data files.
-        bad_raw_dir (str): Path to the directory storing bad raw data files.
 
+    def move_bad_files_to_archive(self, data_ingestion_logs_path, manifest, archive_dir):
         """
-        try:
-            if os.path.exists(good_raw_dir):
-                shutil.rmtree(good_raw_dir)
-            if os.path.exists(bad_raw_dir):
-                shutil.rmtree(bad_raw_dir)
-            logs_file = open(data_ingestion_logs_path, 'a+')
-            self.logger.add_log(logs_file, "Removed Good and Bad data folders.")
-            logs_file.close()
-        except Exception as e:
-            logs_file = open(f"{data_ingestion_logs_path}", 'a+')
-            self.logger.add_log(logs_file, "Error occurred while deleting Good and Bad data folder :: "+str(e))
-            logs_file.close()
-            raise Exception()
-
-    def move_bad_files_to_archive(self, data_ingestion_logs_path, bad_raw_dir, archive_dir):
-        """
-        Moves the bad raw files to archive.
+        Moves the rejected raw files to archive, the only files that are ever moved.
 
         Parameters:
         data_ingestion_logs_path (str): Path to the data ingestion logs file.
-        bad_raw_dir (str): Path to the directory storing bad raw data files.
+        manifest (ValidationManifest): Verdicts of the validation run.
         archive_dir (str): Path to the directory to store archived data files.
 
         """
         try:
-            if os.path.exists(bad_raw_dir):
-                # Iterate over all the files in Bad Dir and move to Archive
-                for filename in os.listdir(bad_raw_dir):
-                    csv_file = os.path.join(bad_raw_dir, filename)
-                    if os.path.isfile(csv_file) and filename.lower().endswith('.csv'):
-                        shutil.move(csv_file, archive_dir)                
+            self.create_archive_dir(data_ingestion_logs_path, archive_dir)
+            for filename in manifest.rejected_files():
+                csv_file = manifest.path(filename)
+                if os.path.isfile(csv_file):
+                    # Replaces an archived file of the same name
+                    os.replace(csv_file, os.path.join(archive_dir, filename))
         except Exception as e:
             logs_file = open(f"{data_ingestion_logs_path}", 'a+')
             self.logger.add_log(logs_file, "Error occurred while moving bad files to archive folder :: "+str(e))
             logs_file.close()
             raise Exception()
     
-    def validate_file_name(self, regex, LengthOfDateStampInFile, LengthOfTimeStampInFile, data_ingestion_logs_path, good_raw_dir, bad_raw_dir, archive_dir, files_dir):
+    def validate_file_name(self, regex, LengthOfDateStampInFile, LengthOfTimeStampInFile, data_ingestion_logs_path, files_dir):
         """
-        Validates the name of the file and moves it to the Good Raw folder if it matches the pattern,
-        otherwise copies it to the Bad Raw folder.
+        Validates the names of the files in place and records a verdict for each of them.
 
         Parameters:
         regex (str): Regular expression pattern for file name validation.
         LengthOfDateStampInFile (int): Length of date stamp in file name.
         LengthOfTimeStampInFile (int): Length of timestamp in file name.
         data_ingestion_logs_path (str): Path to the data ingestion logs file.
-        good_raw_dir (str): Path to the directory to store good raw data files.
-        bad_raw_dir (str): Path to the directory to store bad raw data files.
-        archive_dir (str): Path to the directory to store archived data files.
         files_dir (str): Path to the directory containing the files to be validated.
 
-        """
-        def match_pattern(file_name):
-            pattern = regex % (LengthOfDateStampInFile, LengthOfTimeStampInFile)
-            return bool(re.match(pattern, file_name))
+        Returns:
+        ValidationManifest: Verdicts of the files, the accepted ones are validated further by `validate_column_names`.
 
-        self.remove_good_bad_dirs(data_ingestion_logs_path, good_raw_dir, bad_raw_dir)
-        self.create_good_bad_archive_data_dir(data_ingestion_logs_path, good_raw_dir, bad_raw_dir, archive_dir)
+        """
+        pattern = regex % (LengthOfDateStampInFile, LengthOfTimeStampInFile)
+        manifest = ValidationManifest(files_dir)
         logs_file = open(data_ingestion_logs_path, 'a+')
         try:
-            files = [file for file in os.listdir(files_dir)]
-            for filename in files:
-                if match_pattern(filename):
-                    shutil.copy(f"{files_dir}/{filename}", good_raw_dir)
-                    self.logger.add_log(logs_file, "Valid file name! File moved to Good Raw folder::"+str(filename))
+            for filename in sorted(os.listdir(files_dir)):
+                if not os.path.isfile(os.path.join(files_dir, filename)):
+                    continue
+                if re.match(pattern, filename):
+                    manifest.add(filename)
+                    self.logger.add_log(logs_file, "Valid file name! File accepted::"+str(filename))
                 else:
-                    shutil.copy(f"{files_dir}/{filename}", bad_raw_dir)
-                    self.logger.add_log(logs_file, "Invalid file name! File moved to Bad Raw folder::"+str(filename))
+                    manifest.add(filename, reason="Invalid file name!")
+                    self.logger.add_log(logs_file, "Invalid file name! File rejected::"+str(filename))
             logs_file.close()
+            return manifest
 
         except Exception as e:
-            logs_file = open(f"{data_ingestion_logs_path}", 'a+')
             self.logger.add_log(logs_file, "Error occurred while validating file name::"+str(e))
             logs_file.close()
             raise Exception()
         
         
-    def validate_file_name_without_path(self, regex, LengthOfDateStampInFile, LengthOfTimeStampInFile, data_ingestion_logs_path, good_raw_dir, bad_raw_dir, archive_dir, uploaded_file, file_name):
+    def validate_file_name_without_path(self, regex, LengthOfDateStampInFile, LengthOfTimeStampInFile, data_ingestion_logs_path, upload_dir, uploaded_file, file_name):
         """
-        Validates the name of the file and moves it to the Good Raw folder if it matches the pattern,
-        otherwise copies it to the Bad Raw folder.
+        Writes an uploaded file once to the upload folder and validates its name there.
 
         Parameters:
         regex (str): Regular expression pattern for file name validation.
         LengthOfDateStampInFile (int): Length of date stamp in file name.
         LengthOfTimeStampInFile (int): Length of timestamp in file name.
         data_ingestion_logs_path (str): Path to the data ingestion logs file.
-        good_raw_dir (str): Path to the directory to store good raw data files.
-        bad_raw_dir (str): Path to the directory to store bad raw data files.
-        archive_dir (str): Path to the directory to store archived data files.
+        upload_dir (str): Path to the directory receiving the uploaded file, emptied first.
         uploaded_file (file): File object containing the uploaded file data.
         file_name (str): Name of the uploaded file.
 
-        """
-        def match_pattern(file_name):
-            pattern = regex % (LengthOfDateStampInFile, LengthOfTimeStampInFile)
-            return bool(re.match(pattern, file_name))
+        Returns:
+        ValidationManifest: Verdict of the uploaded file.
 
-        self.remove_good_bad_dirs(data_ingestion_logs_path, good_raw_dir, bad_raw_dir)
-        self.create_good_bad_archive_data_dir(data_ingestion_logs_path, good_raw_dir, bad_raw_dir, archive_dir)
+        """
+        # Uploads of previous runs were already inserted in the DB
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        os.makedirs(upload_dir)
         logs_file = open(data_ingestion_logs_path, 'a+')
         try:
-            # Read the BytesIO object as pandas DataFrame
-            df = pd.read_csv(uploaded_file)
-
-            # Get the file name from the uploaded file
-            filename = file_name
-            if match_pattern(filename):
-                # Copy the file to the good_raw_dir
-                with open(f"{good_raw_dir}/{filename}", "wb") as good_file:
-                    good_file.write(uploaded_file.getvalue())
-                self.logger.add_log(logs_file, "Valid file name! File moved to Good Raw folder::"+str(filename))
-            else:
-                # Copy the file to the bad_raw_dir
-                with open(f"{bad_raw_dir}/{filename}", "wb") as bad_file:
-                    bad_file.write(uploaded_file.getvalue())
-                self.logger.add_log(logs_file, "Invalid file name! File moved to Bad Raw folder::"+str(filename))
-
+            filename = os.path.basename(file_name)
+            with open(os.path.join(upload_dir, filename), "wb") as upload:
+                upload.write(uploaded_file.getvalue())
             logs_file.close()
-
         except Exception as e:
             error_message = traceback.format_exc()
             self.logger.add_log(logs_file, "Error occurred: " + error_message)
+            logs_file.close()
             raise Exception()
+        return self.validate_file_name(regex, LengthOfDateStampInFile, LengthOfTimeStampInFile, data_ingestion_logs_path, upload_dir)
 
-    def validate_column_names(self, NumberofColumns, ColName, data_ingestion_logs_path, good_raw_dir, bad_raw_dir, archive_dir):
+    @staticmethod
+    def inspect_columns(csv_path, NumberofColumns, schema_col_names, sample_rows=RAW_VALIDATION_SAMPLE_ROWS):
         """
-        Validates the column names of CSV files and moves the invalid files to the Bad Raw folder.
+        Check the header of a CSV file against the schema without reading the whole file.
+
+        Only the header and the first `sample_rows` data rows are parsed, so the cost does not
+        depend on the size of the file.
+
+        Parameters:
+        csv_path (str): Path of the CSV file.
+        NumberofColumns (int): Expected number of columns.
+        schema_col_names (iterable): Column names required by the schema.
+        sample_rows (int): Data rows checked against the header.
+
+        Returns:
+        str or None: Reason the file is invalid, None when it is valid.
+        """
+        # utf-8-sig drops a byte order mark, as pandas does
+        with open(csv_path, 'r', newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            column_names = next(reader, None)
+            if not column_names:
+                return "Empty file!"
+            if len(column_names) != NumberofColumns:
+                return "Invalid number of columns!"
+            if not set(schema_col_names).issubset(column_names):
+                return "Invalid column headings!"
+            for row in itertools.islice(reader, sample_rows):
+                # Shorter rows are read with missing values, longer ones cannot be parsed
+                if len(row) > len(column_names):
+                    return "Rows with more fields than columns!"
+        return None
+
+    def validate_column_names(self, NumberofColumns, ColName, data_ingestion_logs_path, manifest, max_workers=RAW_VALIDATION_WORKERS):
+        """
+        Validates the column names of the accepted CSV files, rejects the invalid ones and
+        records the size and modification time of every file in the manifest.
+
+        Only the header and a bounded sample of every file are parsed, by a pool of threads.
 
         Parameters:
         NumberofColumns (int): Expected number of columns in the CSV files.
         ColName (dict): Dictionary containing column names.
         data_ingestion_logs_path (str): Path to the data ingestion logs file.
-        good_raw_dir (str): Path to the directory storing good raw data files.
-        bad_raw_dir (str): Path to the directory storing bad raw data files.
-        archive_dir (str): Path to the directory to store archived data files.
+        manifest (ValidationManifest): Verdicts of the file name validation, updated in place.
+        max_workers (int, optional): Files inspected at the same time.
 
         """
-        schema_col_names = ColName.keys()
-        logs_file = open(f"{data_ingestion_logs_path}", 'a+')
-        try:
-            if os.path.exists(good_raw_dir):
-                files = [file for file in os.listdir(good_raw_dir)]
-                for filename in files:
-                    csv_file = pd.read_csv(good_raw_dir+"/"+filename)
-                    column_names = csv_file.columns
+        schema_col_names = list(ColName.keys())
 
-                    if csv_file.shape[1] == NumberofColumns:
-                        if set(schema_col_names).issubset(column_names):
-                            pass
-                        else:
-                            shutil.move(good_raw_dir+"/"+filename, bad_raw_dir)
-                            self.logger.add_log(logs_file, "Invalid column headings! File moved to Bad Raw folder::"+str(filename))   
-                    else:
-                        shutil.move(good_raw_dir+"/"+filename, bad_raw_dir)
-                        self.logger.add_log(logs_file, "Invalid number of columns! File moved to Bad Raw folder::"+str(filename))                        
+        def inspect(filename):
+            csv_path = manifest.path(filename)
+            stat = os.stat(csv_path)
+            reason = None
+            if manifest.verdicts[filename]['accepted']:
+                reason = self.inspect_columns(csv_path, NumberofColumns, schema_col_names)
+            return reason, stat.st_size, stat.st_mtime_ns
 
+        logs_file = open(f"{data_ingestion_logs_path}", 'a+')
+        try:
+            files = sorted(manifest.verdicts)
+            with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='column-validation') as executor:
+                # Recorded and logged by this thread only, in file name order
+                for filename, (reason, size, mtime_ns) in zip(files, executor.map(inspect, files)):
+                    manifest.record_stat(filename, size, mtime_ns)
+                    if reason is not None:
+                        manifest.reject(filename, reason)
+                        self.logger.add_log(logs_file, reason+" File rejected::"+str(filename))
+            logs_file.close()
 
         except Exception as e:
-            logs_file = open(f"{data_ingestion_logs_path}", 'a+')
             self.logger.add_log(logs_file, "Error occurred while validating training file columns::"+str(e))
             logs_file.close()
             raise Exception()
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+
+
+def file_checksum(file_path):
+    """
+    Compute the SHA-256 checksum of a file, reading it in blocks.
+
+    Parameters:
+    file_path (str): Path of the file.
+
+    Returns:
+    str: Hex digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ValidationManifest:
+    """
+    Verdicts of one validation run over a directory of raw data files.
+
+    Files are validated where they are instead of being copied to Good and Bad folders:
+    every file gets a verdict with its size and modification time and, when rejected, the
+    reason. The DB insert reads the accepted files in place, recording their checksum as it
+    reads them, and only the rejected files are moved to the archive.
+
+    Attributes:
+    files_dir (str): Directory of the validated files.
+    verdicts (dict): Mapping of file name to {'accepted', 'reason', 'sha256', 'size', 'mtime_ns'}.
+    """
+    def __init__(self, files_dir, verdicts=None):
+        """
+        Initialize a ValidationManifest.
+
+        Parameters:
+        files_dir (str): Directory of the validated files.
+        verdicts (dict, optional): Existing verdicts.
+        """
+        self.files_dir = files_dir
+        self.verdicts = dict(verdicts or {})
+
+    def path(self, file_name):
+        return os.path.join(self.files_dir, file_name)
+
+    def add(self, file_name, reason=None):
+        """
+        Record the verdict of a file.
+
+        Parameters:
+        file_name (str): Name of the file in `files_dir`.
+        reason (str, optional): Why the file is rejected, None when it is accepted.
+        """
+        self.verdicts[file_name] = {'accepted': reason is None, 'reason': reason,
+                                    'sha256': None, 'size': None, 'mtime_ns': None}
+
+    def reject(self, file_name, reason):
+        """
+        Reject a previously accepted file.
+        """
+        self.verdicts[file_name].update(accepted=False, reason=reason)
+
+    def remove(self, file_names):
+        """
+        Leave files out of the run, e.g. the files already ingested.
+        """
+        for file_name in file_names:
+            self.verdicts.pop(file_name, None)
+
+    def record_stat(self, file_name, size, mtime_ns):
+        """
+        Record the version of a file a verdict applies to.
+
+        Parameters:
+        file_name (str): Name of the file.
+        size (int): Size of the file in bytes.
+        mtime_ns (int): Modification time of the file when it was validated.
+        """
+        self.verdicts[file_name].update(size=size, mtime_ns=mtime_ns)
+
+    def record_checksum(self, file_name, sha256):
+        """
+        Record the checksum of an accepted file, taken while it is inserted in the DB.
+
+        Parameters:
+        file_name (str): Name of the file.
+        sha256 (str): Checksum of the file.
+        """
+        self.verdicts[file_name].update(sha256=sha256)
+
+    def is_unchanged(self, file_name):
+        """
+        Check that a file was not modified since it was validated, from its size and modification time.
+        """
+        verdict = self.verdicts[file_name]
+        try:
+            stat = os.stat(self.path(file_name))
+        except FileNotFoundError:
+            return False
+        return stat.st_size == verdict['size'] and stat.st_mtime_ns == verdict['mtime_ns']
+
+    def accepted_files(self):
+        """
+        Return the names of the accepted files in ascending order.
+        """
+        return sorted(name for name, verdict in self.verdicts.items() if verdict['accepted'])
+
+    def rejected_files(self):
+        """
+        Return the names of the rejected files in ascending order.
+        """
+        return sorted(name for name, verdict in self.verdicts.items() if not verdict['accepted'])
+
+    def to_dict(self):
+        return {
+            'files_dir': self.files_dir,
+            'verdicts': self.verdicts,
+        }
+
+    def save(self, manifest_file):
+        """
+        Write the manifest atomically, so readers never see a partially written file.
+
+        Parameters:
+        manifest_file (str): Destination of the manifest.
+        """
+        os.makedirs(os.path.dirname(manifest_file), exist_ok=True)
+        tmp_file = manifest_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+        os.replace(tmp_file, manifest_file)
+
+    @classmethod
+    def load(cls, manifest_file):
+        """
+        Read a manifest written by a validation run.
+
+        Parameters:
+        manifest_file (str): Location of the manifest.
+
+        Returns:
+        ValidationManifest: The loaded manifest.
+        """
+        with open(manifest_file, 'r') as f:
+            return cls(**json.load(f))
@@ -1,7 +1,4 @@
-import pandas as pd
 import numpy as np
-from sklearn.impute import KNNImputer
-from sklearn.preprocessing import StandardScaler
 
 class Preprocessor:
     def __init__(self, logger_file, logger):
@@ -109,24 +106,50 @@ class Preprocessor:
             self.logger.add_log(self.log_file, f'Error while checking nulls in columns :: {str(e)}')
             raise Exception()
 
-    def standardize_data(self, dataframe, numeric_cols):
+    def fit_scaler(self, dataframe, numeric_cols):
+        """
+        Fit a StandardScaler on numeric variables of a DataFrame.
+
+        Parameters:
+        dataframe (pandas.DataFrame): DataFrame containing numeric variables.
+        numeric_cols (list): List of column names containing numeric variables.
+
+        Returns:
+        sklearn.preprocessing.StandardScaler: The fitted scaler.
+        """
+        try:
+            self.logger.add_log(self.log_file, 'Entered into the fit_scaler function of Preprocessor class.')
+            from sklearn.preprocessing import StandardScaler
+            scaler = StandardScaler()
+            scaler.fit(dataframe[numeric_cols])
+            self.logger.add_log(self.log_file, "Fitted the scaler.")
+            return scaler
+        except Exception as e:
+            self.logger.add_log(self.log_file, f'Error while fitting the scaler :: {str(e)}')
+            raise Exception()
+
+    def standardize_data(self, dataframe, numeric_cols, scaler=None):
         """
         Standardize numeric variables in a DataFrame.
 
         Parameters:
         dataframe (pandas.DataFrame): DataFrame containing numeric variables.
         numeric_cols (list): List of column names containing numeric variables.
+        scaler (StandardScaler, optional): Already fitted scaler. When omitted a new scaler is fitted on the DataFrame.
 
         Returns:
         pandas.DataFrame: DataFrame with standardized numeric variables.
         """
         try:
             self.logger.add_log(self.log_file, 'Entered into the standardize_data function of Preprocessor class.')
-            scaler = StandardScaler()
-
-            # Fit and transform the scaler on the DataFrame
             df_standardized = dataframe.copy()
-            df_standardized[numeric_cols] = scaler.fit_transform(df_standardized[numeric_cols])
+            if scaler is None:
+                # Fit and transform the scaler on the DataFrame
+                from sklearn.preprocessing import StandardScaler
+                scaler = StandardScaler()
+                df_standardized[numeric_cols] = scaler.fit_transform(df_standardized[numeric_cols])
+            else:
+                df_standardized[numeric_cols] = scaler.transform(df_standardized[numeric_cols])
             self.logger.add_log(self.log_file, "Standardized the data.")
             return df_standardized
         except Exception as e:
@@ -169,6 +192,8 @@ class Preprocessor:
         pandas.DataFrame: DataFrame with missing values imputed using KNN.
         """
         self.logger.add_log(self.log_file, 'Entered into the impute_missing_values function of Preprocessor class.')
+        # Imported here, prediction only needs sklearn when the input has missing values
+        from sklearn.impute import KNNImputer
         imputer = KNNImputer(n_neighbors=n_neighbors)
         try: 
             # Impute missing values in numeric columns
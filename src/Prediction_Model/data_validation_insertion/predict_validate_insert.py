@@ -1,8 +1,8 @@
 from Prediction_Model.config.config import (PREDICTION_DATA_VALIDATION_LOGS_FILE, 
                                             FILE_NAME_PATTERN,
-                                            GOOD_RAW_DIR_PRED,
-                                            BAD_RAW_DIR_PRED,
                                             ARCHIVE_DIR_PRED,
+                                            VALIDATION_MANIFEST_PRED,
+                                            UPLOAD_DIR_PRED,
                                             PREDICTION_DATA_INGESTION_LOGS_FILE,
                                             PREDICTION_DATA_DIR,
                                             PREDICTION_DATA_FILE,
@@ -34,43 +34,35 @@ class Prediction_Validation:
             LengthOfDateStampInFile, LengthOfTimeStampInFile, NumberofColumns, ColName = self.raw_data_validator.get_values_from_schema(PREDICTION_DATA_INGESTION_LOGS_FILE)
             self.logger.add_log(self.logs_file, "Fetched JSON prediction schema details.")
             if is_file_from_path:
-                self.raw_data_validator.validate_file_name(FILE_NAME_PATTERN, 
-                                                        LengthOfDateStampInFile, 
-                                                        LengthOfTimeStampInFile, 
-                                                        PREDICTION_DATA_INGESTION_LOGS_FILE, 
-                                                        GOOD_RAW_DIR_PRED, 
-                                                        BAD_RAW_DIR_PRED, 
-                                                        ARCHIVE_DIR_PRED,
-                                                        PREDICTION_FILES_DIR)
+                manifest = self.raw_data_validator.validate_file_name(FILE_NAME_PATTERN, 
+                                                                      LengthOfDateStampInFile, 
+                                                                      LengthOfTimeStampInFile, 
+                                                                      PREDICTION_DATA_INGESTION_LOGS_FILE, 
+                                                                      PREDICTION_FILES_DIR)
             else:
-                self.raw_data_validator.validate_file_name_without_path(FILE_NAME_PATTERN, 
+                manifest = self.raw_data_validator.validate_file_name_without_path(FILE_NAME_PATTERN, 
                                             LengthOfDateStampInFile, 
                                             LengthOfTimeStampInFile, 
                                             PREDICTION_DATA_INGESTION_LOGS_FILE, 
-                                            GOOD_RAW_DIR_PRED, 
-                                            BAD_RAW_DIR_PRED, 
-                                            ARCHIVE_DIR_PRED,
+                                            UPLOAD_DIR_PRED,
                                             uploaded_file,
                                             file_name)
             self.logger.add_log(self.logs_file, "Validated prediction data file name format.")
             self.raw_data_validator.validate_column_names(NumberofColumns, 
                                                           ColName, 
                                                           PREDICTION_DATA_INGESTION_LOGS_FILE,
-                                                          GOOD_RAW_DIR_PRED, 
-                                                          BAD_RAW_DIR_PRED,
-                                                          ARCHIVE_DIR_PRED)
+                                                          manifest)
+            manifest.save(VALIDATION_MANIFEST_PRED)
             self.logger.add_log(self.logs_file, "Validated prediction data file columns.")
             self.logger.add_log(self.logs_file, "Raw Data Validation Complete!!")
 
             self.logger.add_log(self.logs_file, "Started dB operations...")
             self.db_operation_handler.create_table(ColName, PREDICTION_DATA_INGESTION_LOGS_FILE, GOOD_RAW_TABLE_PREDICTION)
             self.logger.add_log(self.logs_file, "Created table in dB.")
-            self.db_operation_handler.insert_good_data_into_db(PREDICTION_DATA_INGESTION_LOGS_FILE, GOOD_RAW_DIR_PRED, GOOD_RAW_TABLE_PREDICTION)
+            self.db_operation_handler.insert_good_data_into_db(PREDICTION_DATA_INGESTION_LOGS_FILE, manifest, GOOD_RAW_TABLE_PREDICTION)
             self.logger.add_log(self.logs_file, "Inserted Good Raw Data in dB.")
-            self.raw_data_validator.move_bad_files_to_archive(PREDICTION_DATA_INGESTION_LOGS_FILE, BAD_RAW_DIR_PRED, ARCHIVE_DIR_PRED)
+            self.raw_data_validator.move_bad_files_to_archive(PREDICTION_DATA_INGESTION_LOGS_FILE, manifest, ARCHIVE_DIR_PRED)
             self.logger.add_log(self.logs_file, "Moved Bad Data files to archive.")
-            self.raw_data_validator.remove_good_bad_dirs(PREDICTION_DATA_INGESTION_LOGS_FILE, GOOD_RAW_DIR_PRED, BAD_RAW_DIR_PRED)
-            self.logger.add_log(self.logs_file, "Deleted Good and Bad Raw Data folders.")
             self.db_operation_handler.select_data_from_table(PREDICTION_DATA_INGESTION_LOGS_FILE, PREDICTION_DATA_DIR, PREDICTION_DATA_FILE, GOOD_RAW_TABLE_PREDICTION)
             self.logger.add_log(self.logs_file, "Fetched prediction data from dB.")
 
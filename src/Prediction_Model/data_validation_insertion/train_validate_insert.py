@@ -1,14 +1,16 @@
 from Prediction_Model.config.config import (TRAINING_DATA_VALIDATION_LOGS_FILE, 
                                             FILE_NAME_PATTERN,
-                                            GOOD_RAW_DIR_TRAIN,
-                                            BAD_RAW_DIR_TRAIN,
                                             ARCHIVE_DIR_TRAIN,
+                                            VALIDATION_MANIFEST_TRAIN,
+                                            INGESTION_LEDGER_TRAIN,
+                                            INGESTION_FORCE_FULL,
                                             TRAINING_DATA_INGESTION_LOGS_FILE,
                                             TRAINING_DATA_DIR,
                                             TRAINING_DATA_FILE,
                                             TRAINING_FILES_DIR,
                                             GOOD_RAW_TABLE_TRAIN)
 from Prediction_Model.data_ingestion.raw_data_validation import Raw_Data_Validation
+from Prediction_Model.data_ingestion.ingestion_ledger import IngestionLedger
 from Prediction_Model.db_operations.db_operation import dBOperations
 from Prediction_Model.app_logging.app_logger import App_Logger
 
@@ -25,41 +27,61 @@ class Train_Validation:
         self.db_operation_handler = dBOperations()
         self.logs_file = open(TRAINING_DATA_VALIDATION_LOGS_FILE, 'a+')
 
-    def validate_training_data(self):
+    def validate_training_data(self, force_full=INGESTION_FORCE_FULL):
         """
-        Validate the training data files.
+        Validate the training data files and insert them in the DB.
+
+        Files recorded in the ingestion ledger are skipped, so only new files are validated and
+        inserted. Rows are not traced back to their file, so when an ingested file changed, or
+        when `force_full` is set, the table is emptied and every file is ingested again.
+
+        Parameters:
+        force_full (bool): Ignore the ledger and ingest every file again.
         """
         try:
             self.logger.add_log(self.logs_file, "Started validating training data files...")
             LengthOfDateStampInFile, LengthOfTimeStampInFile, NumberofColumns, ColName = self.raw_data_validator.get_values_from_schema(TRAINING_DATA_INGESTION_LOGS_FILE)
             self.logger.add_log(self.logs_file, "Fetched JSON training schema details.")
-            self.raw_data_validator.validate_file_name(FILE_NAME_PATTERN, 
-                                                       LengthOfDateStampInFile, 
-                                                       LengthOfTimeStampInFile, 
-                                                       TRAINING_DATA_INGESTION_LOGS_FILE, 
-                                                       GOOD_RAW_DIR_TRAIN, 
-                                                       BAD_RAW_DIR_TRAIN, 
-                                                       ARCHIVE_DIR_TRAIN,
-                                                       TRAINING_FILES_DIR)
+            manifest = self.raw_data_validator.validate_file_name(FILE_NAME_PATTERN, 
+                                                                  LengthOfDateStampInFile, 
+                                                                  LengthOfTimeStampInFile, 
+                                                                  TRAINING_DATA_INGESTION_LOGS_FILE, 
+                                                                  TRAINING_FILES_DIR)
             self.logger.add_log(self.logs_file, "Validated training data file name format.")
+            ledger = IngestionLedger.load(INGESTION_LEDGER_TRAIN)
+            # Without a ledger the rows already in the table cannot be attributed to files
+            full_ingest = force_full or not ledger.files
+            if not full_ingest:
+                new_files, changed_files, unchanged_files = ledger.classify(manifest)
+                if changed_files:
+                    self.logger.add_log(self.logs_file, f"Ingested files changed {changed_files}, ingesting every file again.")
+                    full_ingest = True
+                else:
+                    manifest.remove(unchanged_files)
+                    self.logger.add_log(self.logs_file, f"Skipping {len(unchanged_files)} ingested files, processing {len(new_files)} new files.")
             self.raw_data_validator.validate_column_names(NumberofColumns, 
                                                           ColName, 
                                                           TRAINING_DATA_INGESTION_LOGS_FILE,
-                                                          GOOD_RAW_DIR_TRAIN, 
-                                                          BAD_RAW_DIR_TRAIN,
-                                                          ARCHIVE_DIR_TRAIN)
+                                                          manifest)
+            manifest.save(VALIDATION_MANIFEST_TRAIN)
             self.logger.add_log(self.logs_file, "Validated training data file columns.")
             self.logger.add_log(self.logs_file, "Raw Data Validation Complete!!")
 
             self.logger.add_log(self.logs_file, "Started dB operations...")
             self.db_operation_handler.create_table(ColName, TRAINING_DATA_INGESTION_LOGS_FILE, GOOD_RAW_TABLE_TRAIN)
             self.logger.add_log(self.logs_file, "Created table in dB.")
-            self.db_operation_handler.insert_good_data_into_db(TRAINING_DATA_INGESTION_LOGS_FILE, GOOD_RAW_DIR_TRAIN, GOOD_RAW_TABLE_TRAIN)
+            if full_ingest:
+                # Saved before the truncate commits, so a failed insert is retried in full by the next run
+                ledger.clear()
+                ledger.save()
+                self.db_operation_handler.truncate_table(TRAINING_DATA_INGESTION_LOGS_FILE, GOOD_RAW_TABLE_TRAIN)
+            self.db_operation_handler.insert_good_data_into_db(TRAINING_DATA_INGESTION_LOGS_FILE, manifest, GOOD_RAW_TABLE_TRAIN)
+            # Recorded once the rows are committed, a failed insert is retried by the next run
+            ledger.record(manifest)
+            ledger.save()
             self.logger.add_log(self.logs_file, "Inserted Good Raw Data in dB.")
-            self.raw_data_validator.move_bad_files_to_archive(TRAINING_DATA_INGESTION_LOGS_FILE, BAD_RAW_DIR_TRAIN, ARCHIVE_DIR_TRAIN)
+            self.raw_data_validator.move_bad_files_to_archive(TRAINING_DATA_INGESTION_LOGS_FILE, manifest, ARCHIVE_DIR_TRAIN)
             self.logger.add_log(self.logs_file, "Moved Bad Data files to archive.")
-            self.raw_data_validator.remove_good_bad_dirs(TRAINING_DATA_INGESTION_LOGS_FILE, GOOD_RAW_DIR_TRAIN, BAD_RAW_DIR_TRAIN)
-            self.logger.add_log(self.logs_file, "Deleted Good and Bad Raw Data folders.")
             self.db_operation_handler.select_data_from_table(TRAINING_DATA_INGESTION_LOGS_FILE, TRAINING_DATA_DIR, TRAINING_DATA_FILE, GOOD_RAW_TABLE_TRAIN)
             self.logger.add_log(self.logs_file, "Fetched training data from dB.")
 
@@ -1,8 +1,6 @@
 import os
 import csv
-import mysql
-import mysql.connector
-import configparser
+import hashlib
 from Prediction_Model.app_logging.app_logger import App_Logger
 from Prediction_Model.config.config import ( 
                                             CHUNK_SIZE,
@@ -26,6 +24,8 @@ class dBOperations:
         """
         Description: Establish a connection to the MySQL database.
         """
+        # The connector is only loaded by the code paths that talk to the database
+        import mysql.connector
         try:
             connection = mysql.connector.connect(
                 host = host,
@@ -74,23 +74,57 @@ class dBOperations:
                 cursor.close()
                 conn.close()
 
-    def insert_good_data_into_db(self, data_ingestion_logs_path, good_raw_dir, good_data_table):
+    def truncate_table(self, data_ingestion_logs_path, good_data_table):
         """
-        Description: Insert the good raw data into Db by reading the files from good data folder.
+        Description: Remove every row of a table, before all the files are inserted again.
+        """
+        try:
+            conn = self.connect_to_db()
+            cursor = conn.cursor()
+            cursor.execute(f"TRUNCATE TABLE `{good_data_table}`")
+            conn.commit()
+            logs_file = open(f"{data_ingestion_logs_path}", 'a+')
+            self.logger.add_log(logs_file ,f"Emptied the {good_data_table} table.")
+            logs_file.close()
+
+        except Exception as e:
+            logs_file = open(f"{data_ingestion_logs_path}", 'a+')
+            self.logger.add_log(logs_file ,"Error while emptying dB table::"+str(e))
+            logs_file.close()
+            raise Exception()
+
+        finally:
+            if conn.is_connected():
+                cursor.close()
+                conn.close()
+
+    def insert_good_data_into_db(self, data_ingestion_logs_path, manifest, good_data_table):
+        """
+        Description: Insert the good raw data into Db by reading the accepted files of the validation manifest in place.
+                     The checksum of every file is recorded in the manifest from the same read.
         """   
         try:
-            files = [file for file in os.listdir(good_raw_dir)]
+            files = manifest.accepted_files()
             conn = self.connect_to_db()
             cursor = conn.cursor()
             table_name = good_data_table
             
             for filename in files:
-                with open(f"{good_raw_dir}/{filename}", "r") as csv_file:
-                    csv_reader = csv.reader(csv_file)
+                if not manifest.is_unchanged(filename):
+                    raise Exception(f"{filename} was modified after it was validated")
+                digest = hashlib.sha256()
+                with open(manifest.path(filename), "rb") as csv_file:
+                    def lines():
+                        # Hashed as they are read, so the file is only read once
+                        for line in csv_file:
+                            digest.update(line)
+                            yield line.decode('utf-8')
+                    csv_reader = csv.reader(lines())
                     next(csv_reader)
                     for row in csv_reader:
                         insert_query = f"INSERT INTO {table_name} VALUES ({','.join(['%s'] * len(row))})"
                         cursor.execute(insert_query, row)
+                manifest.record_checksum(filename, digest.hexdigest())
             conn.commit()
             logs_file = open(f"{data_ingestion_logs_path}", 'a+')
             self.logger.add_log(logs_file ,"Inserted good raw data into dB successfully.")
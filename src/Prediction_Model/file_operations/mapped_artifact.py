@@ -0,0 +1,110 @@
+import json
+import os
+import pickle
+import shutil
+import numpy as np
+from Prediction_Model.config.config import MAPPED_ARRAY_MIN_BYTES
+
+# Version of the directory layout below
+FORMAT_VERSION = 1
+OBJECT_FILE = 'object.pkl'
+META_FILE = 'meta.json'
+
+
+class _ArrayPickler(pickle.Pickler):
+    # Large numeric arrays are written next to the pickle and referenced by name
+    def __init__(self, file, directory, min_array_bytes):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.directory = directory
+        self.min_array_bytes = min_array_bytes
+        self.arrays = {}
+        self._names = {}
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, np.ndarray) or obj.dtype.hasobject or obj.nbytes < self.min_array_bytes:
+            return None
+        # An array referenced twice is stored once
+        name = self._names.get(id(obj))
+        if name is None:
+            name = f"array_{len(self._names)}.npy"
+            self._names[id(obj)] = name
+            np.save(os.path.join(self.directory, name), np.ascontiguousarray(obj), allow_pickle=False)
+            self.arrays[name] = {'shape': list(obj.shape), 'dtype': obj.dtype.str}
+        return name
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+    def __init__(self, file, directory, mmap):
+        super().__init__(file)
+        self.directory = directory
+        self.mmap_mode = 'r' if mmap else None
+
+    def persistent_load(self, name):
+        return np.load(os.path.join(self.directory, os.path.basename(name)), mmap_mode=self.mmap_mode, allow_pickle=False)
+
+
+def save_mapped(obj, directory, meta=None, min_array_bytes=MAPPED_ARRAY_MIN_BYTES, parts=None):
+    """
+    Save an object with its large arrays as uncompressed .npy files that can be memory-mapped.
+
+    Parameters:
+    obj: Object to save, anything picklable.
+    directory (str): Artifact directory, replaced as a whole.
+    meta (dict, optional): JSON metadata stored in meta.json, e.g. the feature order and model generation.
+    min_array_bytes (int): Smaller arrays stay inside the pickle.
+    parts (dict, optional): Extra objects saved the same way and loaded separately, by name.
+    """
+    tmp_dir = directory + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    arrays = {}
+    for name, part in [(None, obj)] + sorted((parts or {}).items()):
+        prefix = OBJECT_FILE if name is None else f"{name}.pkl"
+        part_dir = tmp_dir if name is None else os.path.join(tmp_dir, name)
+        os.makedirs(part_dir, exist_ok=True)
+        with open(os.path.join(part_dir, prefix), 'wb') as f:
+            pickler = _ArrayPickler(f, part_dir, min_array_bytes)
+            pickler.dump(part)
+        arrays[name or 'object'] = pickler.arrays
+    with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+        json.dump({'format_version': FORMAT_VERSION,
+                   'parts': sorted(parts or {}),
+                   'arrays': arrays,
+                   **(meta or {})}, f, indent=4)
+    # Processes still mapping the previous files keep reading them until they reload
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+
+
+def read_meta(directory):
+    """
+    Read the metadata of an artifact.
+
+    Parameters:
+    directory (str): Artifact directory.
+
+    Returns:
+    dict: Contents of meta.json.
+    """
+    with open(os.path.join(directory, META_FILE)) as f:
+        return json.load(f)
+
+
+def load_mapped(directory, part=None, mmap=True):
+    """
+    Load an object saved with `save_mapped`.
+
+    Parameters:
+    directory (str): Artifact directory.
+    part (str, optional): Name of an extra part to load instead of the main object.
+    mmap (bool): Map the arrays read-only, so every process loading the artifact shares their pages.
+
+    Returns:
+    The loaded object.
+    """
+    meta = read_meta(directory)
+    if meta.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format {meta.get('format_version')} in '{directory}'")
+    part_dir = directory if part is None else os.path.join(directory, part)
+    with open(os.path.join(part_dir, OBJECT_FILE if part is None else f"{part}.pkl"), 'rb') as f:
+        return _ArrayUnpickler(f, part_dir, mmap).load()
@@ -0,0 +1,148 @@
+import json
+import os
+from Prediction_Model.config.config import MODELS_DIR, MODEL_MANIFEST_NAME, MODEL_MANIFEST_FILE
+from Prediction_Model.file_operations.model_registry import model_registry, generation_dir
+
+
+class ModelManifest:
+    """
+    Compact description of one trained model generation.
+
+    The manifest maps every cluster number to its MLflow run, model URI, saved model file
+    and scaler, so prediction can resolve all models without searching the tracking server.
+    The manifest is saved in the directory of its generation, and file paths are stored
+    relative to that directory.
+
+    Attributes:
+    generation (str): Identifier of the model generation.
+    clustering_model (str): Path of the saved clustering model.
+    feature_order (list): Feature columns in the order the models were trained on.
+    clusters (dict): Mapping of cluster number (as str) to its model entry.
+    pipeline_file (str): Path of the saved inference pipeline.
+    directory (str): Directory the paths are relative to.
+    """
+    def __init__(self, generation=None, clustering_model=None, feature_order=None, clusters=None, pipeline_file=None, directory=None):
+        """
+        Initialize a ModelManifest.
+
+        Parameters:
+        generation (str): Identifier of the model generation.
+        clustering_model (str): Path of the saved clustering model, relative to the generation directory.
+        feature_order (list): Feature columns in training order.
+        clusters (dict, optional): Existing cluster entries.
+        pipeline_file (str, optional): Saved inference pipeline, relative to the generation directory.
+        directory (str, optional): Directory the paths are relative to, the directory of the generation by default.
+        """
+        self.generation = generation
+        self.clustering_model = clustering_model
+        self.feature_order = list(feature_order or [])
+        self.clusters = dict(clusters or {})
+        self.pipeline_file = pipeline_file
+        self.directory = directory or (generation_dir(generation) if generation else MODELS_DIR)
+
+    def add_cluster(self, cluster_number, model_name, run_id, model_uri, model_file, scaler_file, fingerprint=None):
+        """
+        Record the artifacts of one cluster.
+
+        Parameters:
+        cluster_number (int): The cluster number.
+        model_name (str): Name of the selected algorithm.
+        run_id (str or None): MLflow run holding the logged model, None when the run could not be logged.
+        model_uri (str or None): URI the model can be loaded from with MLflow, None without a run.
+        model_file (str): Saved model file, relative to the generation directory.
+        scaler_file (str): Saved scaler file, relative to the generation directory.
+        fingerprint (str, optional): Fingerprint of the training partition and search configuration the model was trained on.
+        """
+        self.clusters[str(cluster_number)] = {
+            'model_name': model_name,
+            'run_id': run_id,
+            'model_uri': model_uri,
+            'model_file': model_file,
+            'scaler_file': scaler_file,
+            'fingerprint': fingerprint,
+        }
+
+    def cluster(self, cluster_number):
+        """
+        Return the entry of a cluster.
+
+        Parameters:
+        cluster_number (int): The cluster number.
+
+        Returns:
+        dict: The recorded artifacts of the cluster.
+        """
+        try:
+            return self.clusters[str(cluster_number)]
+        except KeyError:
+            raise ValueError(f"No model recorded in the manifest for cluster '{cluster_number}'")
+
+    def cluster_numbers(self):
+        """
+        Return the recorded cluster numbers in ascending order.
+        """
+        return sorted(int(i) for i in self.clusters)
+
+    def resolve(self, relative_path):
+        """
+        Turn a path stored in the manifest into an absolute path.
+        """
+        return os.path.join(self.directory, relative_path)
+
+    def load_artifact(self, file_op, relative_path):
+        """
+        Load a pickled artifact recorded in the manifest.
+
+        Parameters:
+        file_op (FileOperations): File operations helper used to load the artifact.
+        relative_path (str): Path of the artifact relative to the generation directory.
+
+        Returns:
+        object: The loaded artifact.
+        """
+        model_path = self.resolve(relative_path)
+        model_name = os.path.splitext(os.path.basename(model_path))[0]
+        return file_op.load_model(model_name, os.path.dirname(model_path))
+
+    def to_dict(self):
+        return {
+            'generation': self.generation,
+            'clustering_model': self.clustering_model,
+            'feature_order': self.feature_order,
+            'clusters': self.clusters,
+            'pipeline_file': self.pipeline_file,
+        }
+
+    def save(self):
+        """
+        Write the manifest atomically into its directory, so readers never see a partially written file.
+        """
+        manifest_file = os.path.join(self.directory, MODEL_MANIFEST_NAME)
+        os.makedirs(os.path.dirname(manifest_file), exist_ok=True)
+        tmp_file = manifest_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+        os.replace(tmp_file, manifest_file)
+
+    @classmethod
+    def load(cls, generation=None):
+        """
+        Read the manifest of a generation written by training.
+
+        Parameters:
+        generation (str, optional): Generation to read, the current generation by default.
+
+        Returns:
+        ModelManifest: The loaded manifest.
+        """
+        if generation is None:
+            generation = model_registry.current_generation()
+        directory = generation_dir(generation)
+        manifest_file = os.path.join(directory, MODEL_MANIFEST_NAME)
+        if not os.path.exists(manifest_file) and os.path.exists(MODEL_MANIFEST_FILE):
+            # Models trained before generation directories, saved directly in the models directory
+            directory, manifest_file = MODELS_DIR, MODEL_MANIFEST_FILE
+        if not os.path.exists(manifest_file):
+            raise FileNotFoundError(f"Model manifest '{manifest_file}' not found. Train the model first.")
+        with open(manifest_file, 'r') as f:
+            return cls(**json.load(f), directory=directory)
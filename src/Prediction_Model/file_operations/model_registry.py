@@ -0,0 +1,205 @@
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from Prediction_Model.config.config import (MODELS_DIR,
+                                            GENERATIONS_DIR,
+                                            CLUSTERING_MODEL_NAME,
+                                            MODEL_MANIFEST_NAME,
+                                            MODEL_GENERATION_FILE,
+                                            MODEL_GENERATIONS_KEEP,
+                                            MODEL_REGISTRY_CAPACITY)
+
+
+def _release(models):
+    # Evicted models may hold worker pools, shut down once they leave the registry
+    close = getattr(models, 'close', None)
+    if close is not None:
+        close()
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded model generations.
+
+    A generation is the clustering model together with all the per-cluster regressors
+    produced by one training run. Generations are kept in least-recently-used order and
+    the oldest one is evicted once more than `capacity` generations are loaded. Generations
+    are loaded outside the registry lock, so scoring with a loaded generation never waits
+    for another one to load.
+
+    Attributes:
+    capacity (int): Maximum number of generations kept in memory.
+    """
+    def __init__(self, capacity=MODEL_REGISTRY_CAPACITY):
+        """
+        Initialize an empty ModelRegistry.
+
+        Parameters:
+        capacity (int): Maximum number of generations kept in memory.
+        """
+        self.capacity = capacity
+        self._generations = OrderedDict()
+        self._lock = threading.RLock()
+        # One generation is loaded at a time, requests for the same generation wait for a single load
+        self._load_lock = threading.Lock()
+        self._loading = {}
+
+    def current_generation(self):
+        """
+        Identify the model generation currently on disk.
+
+        Returns:
+        str: The generation written by the last training run, or a fingerprint of the
+             clustering model file when no generation has been recorded.
+        """
+        if os.path.exists(MODEL_GENERATION_FILE):
+            with open(MODEL_GENERATION_FILE, 'r') as f:
+                generation = f.read().strip()
+            if generation:
+                return generation
+        stat = os.stat(os.path.join(MODELS_DIR, f'{CLUSTERING_MODEL_NAME}.sav'))
+        return f'{stat.st_mtime_ns}_{stat.st_size}'
+
+    def get(self, loader, generation=None, background=False):
+        """
+        Return the models of a generation, loading them only on the first request.
+
+        Parameters:
+        loader (callable): Called with the generation identifier to load its models on a cache miss.
+        generation (str, optional): Generation to fetch. Defaults to the current generation.
+        background (bool): When the generation is not loaded yet but another one is, load it in a
+                           background thread and return the most recently used generation meanwhile,
+                           so publishing a new generation never pauses scoring.
+
+        Returns:
+        tuple: (generation (str), models loaded by `loader` for that generation)
+        """
+        if generation is None:
+            generation = self.current_generation()
+        with self._lock:
+            if generation in self._generations:
+                self._generations.move_to_end(generation)
+                return generation, self._generations[generation]
+            if background and self._generations:
+                if generation not in self._loading:
+                    thread = threading.Thread(target=self._load, args=(loader, generation),
+                                              name=f'load-generation-{generation}', daemon=True)
+                    self._loading[generation] = thread
+                    thread.start()
+                previous = next(reversed(self._generations))
+                return previous, self._generations[previous]
+        return self._load(loader, generation)
+
+    def _load(self, loader, generation):
+        with self._load_lock:
+            try:
+                with self._lock:
+                    if generation in self._generations:
+                        return generation, self._generations[generation]
+                models = loader(generation)
+                with self._lock:
+                    self._generations[generation] = models
+                    while len(self._generations) > self.capacity:
+                        _release(self._generations.popitem(last=False)[1])
+                return generation, models
+            finally:
+                with self._lock:
+                    # A failed background load is retried by the next request
+                    self._loading.pop(generation, None)
+
+    def is_loaded(self, generation):
+        """
+        Check whether a generation is already held in memory.
+        """
+        with self._lock:
+            return generation in self._generations
+
+    def invalidate(self, generation=None):
+        """
+        Drop one generation, or every generation when none is given.
+
+        Parameters:
+        generation (str, optional): Generation to drop.
+        """
+        with self._lock:
+            if generation is None:
+                released = list(self._generations.values())
+                self._generations.clear()
+            else:
+                released = [self._generations.pop(generation, None)]
+        for models in released:
+            _release(models)
+
+
+def generation_dir(generation):
+    """
+    Return the directory holding the models of a generation.
+    """
+    return os.path.join(GENERATIONS_DIR, generation)
+
+
+def new_generation_id():
+    """
+    Create the identifier of a new model generation.
+    """
+    return datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+
+
+def mark_new_generation(generation=None):
+    """
+    Point to a new model generation so that every registry reloads its models.
+
+    The pointer file is replaced atomically, so readers see either the previous generation
+    or the new one, whose directory is complete by then.
+
+    Parameters:
+    generation (str, optional): Identifier to publish. A new one is created when omitted.
+
+    Returns:
+    str: The identifier of the new generation.
+    """
+    if generation is None:
+        generation = new_generation_id()
+    tmp_file = MODEL_GENERATION_FILE + '.tmp'
+    with open(tmp_file, 'w') as f:
+        f.write(generation)
+    os.replace(tmp_file, MODEL_GENERATION_FILE)
+    return generation
+
+
+def prune_generations(keep=MODEL_GENERATIONS_KEEP):
+    """
+    Remove the directories of old model generations.
+
+    The current generation and the newest published generations before it are kept, up to
+    `keep`, so processes that read the pointer just before it moved still find their models.
+    Directories of generations newer than the current one may belong to a training run in
+    progress and are left alone, older unpublished ones are the remains of failed runs.
+
+    Parameters:
+    keep (int): Number of published generations kept, the current one included.
+
+    Returns:
+    list: Identifiers of the removed generations.
+    """
+    if not os.path.isdir(GENERATIONS_DIR):
+        return []
+    current = model_registry.current_generation()
+    # Identifiers are timestamps, so they sort by age
+    older = sorted((name for name in os.listdir(GENERATIONS_DIR) if name <= current), reverse=True)
+    removed = []
+    kept = 0
+    for generation in older:
+        published = os.path.exists(os.path.join(generation_dir(generation), MODEL_MANIFEST_NAME))
+        if published and kept < keep:
+            kept += 1
+            continue
+        shutil.rmtree(generation_dir(generation), ignore_errors=True)
+        removed.append(generation)
+    return removed
+
+
+# Registry shared by every prediction made in this process
+model_registry = ModelRegistry()
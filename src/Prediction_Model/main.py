@@ -1,12 +1,9 @@
 import streamlit as st
-import pandas as pd
-from io import BytesIO
-from Prediction_Model.data_validation_insertion.train_validate_insert import Train_Validation
-from Prediction_Model.data_validation_insertion.predict_validate_insert import Prediction_Validation
-from Prediction_Model.train_model.train import TrainModel
 from Prediction_Model.utils.utils import empty_dirs
-from Prediction_Model.predict.predict import MakePredictions
-from Prediction_Model.config.config import TRAINING_FILES_DIR, PREDICTION_FILES_DIR, PREDICTION_OUTPUT_FILE
+from Prediction_Model.config.config import TRAINING_FILES_DIR, PREDICTION_FILES_DIR, PREDICTION_OUTPUT_FILE, UPLOAD_DIR_PRED
+
+# The training and prediction modules pull in pandas, sklearn, mlflow and the MySQL
+# connector, so every tab imports only what its own action needs
 
 # Main function
 def main():
@@ -22,6 +19,8 @@ def main():
         st.write("Click below to start model training.")
 
         if st.button("Train Model"):
+            from Prediction_Model.data_validation_insertion.train_validate_insert import Train_Validation
+            from Prediction_Model.train_model.train import TrainModel
             try:
                 st.info("Starting the model training. Please wait...")
                 Train_Validation(path=TRAINING_FILES_DIR).validate_training_data()
@@ -35,6 +34,9 @@ def main():
         st.write("Get the predictions based on")
 
         if st.button("Predict Cement Strength"):
+            import pandas as pd
+            from Prediction_Model.data_validation_insertion.predict_validate_insert import Prediction_Validation
+            from Prediction_Model.predict.predict import MakePredictions
             try:
                 st.info("Starting the model prediction. Please wait...")
                 Prediction_Validation(path=PREDICTION_FILES_DIR).validate_prediction_data()
@@ -57,17 +59,15 @@ def main():
         uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
 
         if uploaded_file is not None:
+            import pandas as pd
+            from Prediction_Model.data_validation_insertion.predict_validate_insert import Prediction_Validation
+            from Prediction_Model.predict.predict import MakePredictions
             st.info("Analysing the file please wait...")
-            prediction_df = pd.read_csv(uploaded_file)
             try:
                 st.info("Validating the uploaded data. Please wait...")
-                # Convert DataFrame to BytesIO object
-                csv_buffer = BytesIO()
-                prediction_df.to_csv(csv_buffer, index=False)
-                csv_buffer.seek(0)
                 file_name = uploaded_file.name
-                # Pass the BytesIO object to the validation function
-                Prediction_Validation(path=csv_buffer).validate_prediction_data(is_file_from_path=False,uploaded_file=csv_buffer, file_name=file_name)
+                # The upload is written to disk once and validated and inserted from there
+                Prediction_Validation(path=UPLOAD_DIR_PRED).validate_prediction_data(is_file_from_path=False,uploaded_file=uploaded_file, file_name=file_name)
                 st.success("Data validation completed successfully!")
                 
                 predictor = MakePredictions()
@@ -0,0 +1,410 @@
+import copy
+import os
+import threading
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from Prediction_Model.predict.tree_engine import CompactTreeEnsemble, compile_model
+from Prediction_Model.file_operations.file_methods import FileOperations
+from Prediction_Model.file_operations.model_manifest import ModelManifest
+from Prediction_Model.file_operations.mapped_artifact import save_mapped, load_mapped
+from Prediction_Model.app_logging.metrics import optional_stage
+from Prediction_Model.utils.cpu_budget import resolve_n_jobs
+from Prediction_Model.config.config import (PREDICTION_BATCH_SIZE,
+                                            PREDICTION_PARALLEL_BACKEND,
+                                            PREDICTION_N_JOBS,
+                                            PREDICTION_PARALLEL_MIN_ROWS,
+                                            COMPILE_TREE_ENSEMBLES,
+                                            TREE_ENGINE_MAX_BATCH_ROWS,
+                                            MLFLOW_URI)
+
+# Pipeline held by each process of a process-pool scoring run
+_worker_pipeline = None
+
+
+def _init_worker(pipeline):
+    global _worker_pipeline
+    _worker_pipeline = pipeline
+
+
+def _score_in_worker(cluster_number, X_log, batch_size):
+    return _worker_pipeline.score_cluster_timed(cluster_number, X_log, batch_size)
+
+
+class InferencePipeline:
+    """
+    Compiled prediction path of one model generation.
+
+    Applies the log transform, routes every row to its nearest cluster centroid, scales it
+    with the scaler fitted on that cluster's training split and scores it with the cluster's
+    model. All steps work on a single contiguous float array, without pandas copies and
+    without refitting anything at prediction time.
+
+    Attributes:
+    feature_order (list): Feature columns in the order the models were trained on.
+    centroids (numpy.ndarray): Cluster centroids, one row per cluster.
+    scaler_means (numpy.ndarray): Per-cluster feature means, one row per cluster.
+    scaler_scales (numpy.ndarray): Per-cluster feature scales, one row per cluster.
+    cluster_models (dict): Mapping of cluster number to its model.
+    generation (str): Identifier of the model generation.
+    compact_models (dict): Mapping of cluster number to its array-backed tree ensemble, when it has one.
+    compact_max_rows (int): Largest batch scored with the array-backed tree ensembles.
+
+    The worker pool of the parallel backends is created on the first parallel prediction and
+    reused by the following ones, until `close` shuts it down.
+    """
+    def __init__(self, feature_order, centroids, scaler_means, scaler_scales, cluster_models, generation=None,
+                 compact_models=None, compact_max_rows=TREE_ENGINE_MAX_BATCH_ROWS):
+        """
+        Initialize the InferencePipeline from plain arrays.
+
+        Parameters:
+        feature_order (list): Feature columns in training order.
+        centroids (array-like): Cluster centroids of shape (n_clusters, n_features).
+        scaler_means (array-like): Per-cluster means of shape (n_clusters, n_features).
+        scaler_scales (array-like): Per-cluster scales of shape (n_clusters, n_features).
+        cluster_models (dict): Mapping of cluster number to a model exposing predict.
+        generation (str, optional): Identifier of the model generation.
+        compact_models (dict, optional): Mapping of cluster number to its CompactTreeEnsemble.
+        compact_max_rows (int): Largest batch scored with the array-backed tree ensembles.
+        """
+        self.feature_order = list(feature_order)
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float64)
+        self.scaler_means = np.ascontiguousarray(scaler_means, dtype=np.float64)
+        self.scaler_scales = np.ascontiguousarray(scaler_scales, dtype=np.float64)
+        self.cluster_models = {int(i): model for i, model in cluster_models.items()}
+        self.generation = generation
+        self.compact_models = {int(i): model for i, model in (compact_models or {}).items()}
+        self.compact_max_rows = compact_max_rows
+        self._centroid_sq_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        self._init_pool()
+
+    def _init_pool(self):
+        self._pool_lock = threading.Lock()
+        self._pool = None
+        self._pool_key = None
+        self._pool_users = 0
+        self._closed = False
+
+    def __getstate__(self):
+        # Pools and locks belong to the process that created them
+        state = self.__dict__.copy()
+        for key in ('_pool_lock', '_pool', '_pool_key', '_pool_users', '_closed'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_pool()
+
+    @classmethod
+    def from_fitted(cls, feature_order, clustering_model, scalers, cluster_models, generation=None,
+                    compile_trees=COMPILE_TREE_ENSEMBLES, validation_data=None):
+        """
+        Build the pipeline from the fitted training objects.
+
+        Parameters:
+        feature_order (list): Feature columns in training order.
+        clustering_model (sklearn.cluster.KMeans): Fitted clustering model.
+        scalers (dict): Mapping of cluster number to its fitted StandardScaler.
+        cluster_models (dict): Mapping of cluster number to its fitted model.
+        generation (str, optional): Identifier of the model generation.
+        compile_trees (bool): Flatten the tree ensembles into CompactTreeEnsemble evaluators.
+        validation_data (dict, optional): Mapping of cluster number to scaled rows on which a
+                                          flattened ensemble must reproduce its sklearn predictions.
+
+        Returns:
+        InferencePipeline: The compiled pipeline.
+        """
+        centroids = clustering_model.cluster_centers_
+        n_clusters, n_features = centroids.shape
+        scaler_means = np.zeros((n_clusters, n_features))
+        scaler_scales = np.ones((n_clusters, n_features))
+        for i, scaler in scalers.items():
+            scaler_means[int(i)] = scaler.mean_
+            scaler_scales[int(i)] = scaler.scale_
+
+        compact_models = {}
+        if compile_trees:
+            validation_data = validation_data or {}
+            for i, model in cluster_models.items():
+                compact = compile_model(model, validation_data.get(i))
+                if isinstance(compact, CompactTreeEnsemble):
+                    compact_models[int(i)] = compact
+        return cls(feature_order, centroids, scaler_means, scaler_scales, cluster_models, generation, compact_models)
+
+    def save_mapped(self, directory):
+        """
+        Save the pipeline as a memory-mappable artifact, see file_operations/mapped_artifact.py.
+
+        Centroids, scaler statistics and the node arrays of the array-backed ensembles are stored
+        as .npy files, so every process mapping the artifact shares one physical copy. The sklearn
+        models of clusters that have an array-backed ensemble are stored as a separate part,
+        which serving processes may leave out.
+
+        Parameters:
+        directory (str): Artifact directory, replaced as a whole.
+        """
+        pipeline = copy.copy(self)
+        pipeline.cluster_models = {i: model for i, model in self.cluster_models.items() if i not in self.compact_models}
+        tree_models = {i: model for i, model in self.cluster_models.items() if i in self.compact_models}
+        save_mapped(pipeline, directory,
+                    meta={'feature_order': self.feature_order,
+                          'generation': self.generation,
+                          'n_clusters': self.n_clusters,
+                          'compact_clusters': sorted(self.compact_models)},
+                    parts={'tree_models': tree_models})
+
+    @classmethod
+    def load_mapped(cls, directory, load_tree_models=True):
+        """
+        Map a pipeline saved with `save_mapped`.
+
+        Parameters:
+        directory (str): Artifact directory.
+        load_tree_models (bool): Also load the sklearn ensembles, used for batches larger than
+                                 `compact_max_rows`. Without them every batch is scored by the
+                                 array-backed ensembles and nothing is copied per process.
+
+        Returns:
+        InferencePipeline: The pipeline, backed by read-only memory maps.
+        """
+        pipeline = load_mapped(directory)
+        if load_tree_models:
+            pipeline.cluster_models.update(load_mapped(directory, part='tree_models'))
+        return pipeline
+
+    @property
+    def n_clusters(self):
+        return self.centroids.shape[0]
+
+    def as_array(self, data):
+        """
+        Convert the input into a contiguous float64 matrix in training feature order.
+
+        Parameters:
+        data (pandas.DataFrame or array-like): Raw feature values.
+
+        Returns:
+        numpy.ndarray: Matrix of shape (n_rows, n_features).
+        """
+        if hasattr(data, 'columns'):
+            data = data[self.feature_order].to_numpy(dtype=np.float64)
+        X = np.ascontiguousarray(data, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != len(self.feature_order):
+            raise ValueError(f"Expected {len(self.feature_order)} features, got {X.shape[1]}")
+        return X
+
+    def transform(self, X):
+        """
+        Apply the log transform used during training.
+
+        Parameters:
+        X (numpy.ndarray): Raw feature matrix.
+
+        Returns:
+        numpy.ndarray: Log-transformed copy of the matrix.
+        """
+        return np.log1p(X)
+
+    def route(self, X_log):
+        """
+        Assign every log-transformed row to its nearest centroid.
+
+        Parameters:
+        X_log (numpy.ndarray): Log-transformed feature matrix.
+
+        Returns:
+        numpy.ndarray: Cluster number of every row.
+        """
+        # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, and ||x||^2 does not change the argmin
+        distances = self._centroid_sq_norms - 2.0 * (X_log @ self.centroids.T)
+        return np.argmin(distances, axis=1)
+
+    def score_cluster(self, cluster_number, X_log, batch_size=PREDICTION_BATCH_SIZE):
+        """
+        Scale and score the rows routed to one cluster.
+
+        Parameters:
+        cluster_number (int): The cluster the rows were routed to.
+        X_log (numpy.ndarray): Log-transformed rows of the cluster.
+        batch_size (int): Maximum number of rows passed to a single predict call.
+
+        Returns:
+        numpy.ndarray: Predictions in the same order as the input rows.
+        """
+        model = self.cluster_models.get(cluster_number)
+        compact = self.compact_models.get(cluster_number)
+        if model is None and compact is None:
+            raise ValueError(f"No model found for cluster number '{cluster_number}'")
+        scaled = (X_log - self.scaler_means[cluster_number]) / self.scaler_scales[cluster_number]
+        predictions = np.empty(len(scaled), dtype=np.float64)
+        for start in range(0, len(scaled), batch_size):
+            stop = start + batch_size
+            batch = scaled[start:stop]
+            # Small batches are cheaper on the array-backed engine, large ones on sklearn
+            if compact is not None and (model is None or len(batch) <= self.compact_max_rows):
+                predictions[start:stop] = compact.predict(batch)
+            else:
+                predictions[start:stop] = np.asarray(model.predict(batch), dtype=np.float64).ravel()
+        return predictions
+
+    def score_cluster_timed(self, cluster_number, X_log, batch_size=PREDICTION_BATCH_SIZE):
+        """
+        Score the rows of one cluster and measure how long it took.
+
+        Returns:
+        tuple: (predictions (numpy.ndarray), seconds (float))
+        """
+        start = time.perf_counter()
+        predictions = self.score_cluster(cluster_number, X_log, batch_size)
+        return predictions, time.perf_counter() - start
+
+    def _acquire_pool(self, backend, n_workers):
+        """
+        Return the worker pool of a backend, created on first use, or None once the pipeline is closed.
+
+        Every acquired pool must be given back with `_release_pool`.
+        """
+        with self._pool_lock:
+            if self._closed:
+                return None
+            key = (backend, n_workers)
+            if self._pool_key != key:
+                if self._pool is not None and self._pool_users == 0:
+                    self._pool.shutdown(wait=False)
+                elif self._pool is not None:
+                    # Still used by another prediction, scored without the pool meanwhile
+                    return None
+                if backend == 'thread':
+                    self._pool = ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix='cluster-scoring')
+                else:
+                    # The pipeline is sent to every process once, not with every prediction
+                    self._pool = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(self,))
+                self._pool_key = key
+            self._pool_users += 1
+            return self._pool
+
+    def _release_pool(self):
+        with self._pool_lock:
+            self._pool_users -= 1
+            if self._closed and self._pool_users == 0 and self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool, self._pool_key = None, None
+
+    def close(self):
+        """
+        Shut the worker pool down, e.g. when the generation is replaced. Predictions still
+        running finish with the pool, later ones are scored sequentially.
+        """
+        with self._pool_lock:
+            self._closed = True
+            if self._pool is not None and self._pool_users == 0:
+                self._pool.shutdown(wait=False)
+                self._pool, self._pool_key = None, None
+
+    def predict(self, data, batch_size=PREDICTION_BATCH_SIZE, backend=PREDICTION_PARALLEL_BACKEND, n_jobs=PREDICTION_N_JOBS,
+                metrics=None, min_parallel_rows=PREDICTION_PARALLEL_MIN_ROWS):
+        """
+        Predict the cement strength of every row.
+
+        Each cluster partition is split into batches of at most `batch_size` rows. With a
+        parallel backend the batches of inputs of at least `min_parallel_rows` rows are scored
+        concurrently by the pool of the pipeline and written back at the positions of their
+        rows, so the output keeps the input order.
+
+        Parameters:
+        data (pandas.DataFrame or array-like): Raw feature values.
+        batch_size (int): Maximum number of rows passed to a single predict call.
+        backend (str, optional): None to score sequentially, 'thread' or 'process' to score concurrently.
+        n_jobs (int): Maximum number of workers, -1 for every core.
+        metrics (StageMetrics, optional): Collector receiving the log transform, routing and per-cluster scoring times.
+        min_parallel_rows (int): Inputs with fewer rows are scored sequentially.
+
+        Returns:
+        tuple: (predictions (numpy.ndarray), clusters (numpy.ndarray)), both in input row order.
+        """
+        X = self.as_array(data)
+        with optional_stage(metrics, 'log_transform', len(X)):
+            X_log = self.transform(X)
+        with optional_stage(metrics, 'cluster_routing', len(X_log)):
+            clusters = self.route(X_log)
+        predictions = np.empty(len(X_log), dtype=np.float64)
+
+        tasks = []
+        for i in np.unique(clusters):
+            positions = np.flatnonzero(clusters == i)
+            for start in range(0, len(positions), batch_size):
+                tasks.append((int(i), positions[start:start + batch_size]))
+
+        if backend not in (None, 'thread', 'process'):
+            raise ValueError(f"Unknown parallel backend '{backend}', expected None, 'thread' or 'process'")
+        n_workers = resolve_n_jobs(n_jobs, len(tasks))
+        executor = None
+        if backend is not None and n_workers > 1 and len(X_log) >= min_parallel_rows:
+            executor = self._acquire_pool(backend, n_workers)
+        if executor is None:
+            for i, positions in tasks:
+                predictions[positions], seconds = self.score_cluster_timed(i, X_log[positions], batch_size)
+                if metrics is not None:
+                    metrics.record('cluster_scoring', seconds, len(positions), cluster=i)
+            return predictions, clusters
+
+        score = self.score_cluster_timed if backend == 'thread' else _score_in_worker
+        try:
+            futures = [(i, positions, executor.submit(score, i, X_log[positions], batch_size)) for i, positions in tasks]
+            for i, positions, future in futures:
+                predictions[positions], seconds = future.result()
+                if metrics is not None:
+                    metrics.record('cluster_scoring', seconds, len(positions), cluster=i)
+        finally:
+            self._release_pool()
+        return predictions, clusters
+
+
+def load_inference_pipeline(generation, log_file, logger, load_tree_models=True):
+    """
+    Load the inference pipeline of a generation from the model manifest.
+
+    Parameters:
+    generation (str): Identifier of the model generation being loaded.
+    log_file (file): Log file object.
+    logger (App_Logger): Logger instance.
+    load_tree_models (bool): Load the sklearn tree ensembles next to their array-backed copies, see `InferencePipeline.load_mapped`.
+
+    Returns:
+    InferencePipeline: The compiled prediction path of the generation.
+    """
+    logger.add_log(log_file, f"Loading model generation {generation}.")
+    manifest = ModelManifest.load(generation)
+    file_op = FileOperations(log_file, logger)
+    if manifest.pipeline_file is not None:
+        pipeline_path = manifest.resolve(manifest.pipeline_file)
+        if os.path.isdir(pipeline_path):
+            return InferencePipeline.load_mapped(pipeline_path, load_tree_models=load_tree_models)
+        # Pickled pipeline of an older generation
+        return manifest.load_artifact(file_op, manifest.pipeline_file)
+
+    # Generations trained before the pipeline artifact existed are compiled from their parts
+    k_means_model = manifest.load_artifact(file_op, manifest.clustering_model)
+    scalers = {}
+    cluster_models = {}
+    for i in manifest.cluster_numbers():
+        entry = manifest.cluster(i)
+        scalers[i] = manifest.load_artifact(file_op, entry['scaler_file'])
+        if os.path.exists(manifest.resolve(entry['model_file'])):
+            cluster_models[i] = manifest.load_artifact(file_op, entry['model_file'])
+        else:
+            # The local copy is gone, fall back to the model logged in MLflow
+            if entry['model_uri'] is None:
+                raise FileNotFoundError(f"Model of cluster {i} is missing and was not logged in MLflow")
+            import mlflow.pyfunc
+            mlflow.set_tracking_uri(uri=MLFLOW_URI)
+            cluster_models[i] = mlflow.pyfunc.load_model(entry['model_uri'])
+    return InferencePipeline.from_fitted(feature_order=manifest.feature_order,
+                                         clustering_model=k_means_model,
+                                         scalers=scalers,
+                                         cluster_models=cluster_models,
+                                         generation=manifest.generation)
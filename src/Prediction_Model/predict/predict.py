@@ -1,24 +1,24 @@
-from sklearn.model_selection import train_test_split
 from Prediction_Model.data_ingestion.data_loader import Data_Loader
 from Prediction_Model.data_preprocessing.data_preprocessing import Preprocessor
-from Prediction_Model.file_operations.file_methods import FileOperations
+from Prediction_Model.file_operations.model_registry import model_registry
+from Prediction_Model.predict.inference_pipeline import load_inference_pipeline
+from Prediction_Model.predict.prediction_cache import prediction_cache
 from Prediction_Model.app_logging.app_logger import App_Logger
+from Prediction_Model.app_logging.metrics import StageMetrics
 from Prediction_Model.config.config import (PREDICTION_LOGS,
                                             PREDICTION_DATA_DIR,
                                             PREDICTION_DATA_FILE,
                                             NUMERIC_COLS_PRED,
-                                            CLUSTERING_MODEL_NAME,
                                             PREDICTION_OUTPUT_DIR,
                                             PREDICTION_OUTPUT_FILE,
-                                            MODELS_DIR,
-                                            PREDICTION_MODELS_DIR,
-                                            MLFLOW_EXPERIMENT_NAME)
+                                            PREDICTION_STREAMING,
+                                            PREDICTION_CHUNK_SIZE,
+                                            PREDICTION_CACHE_ENABLED,
+                                            METRICS_DIR,
+                                            METRICS_TRACE_MEMORY)
 import os
-import pandas as pd
 import traceback
 
-import mlflow
-import mlflow.pyfunc
 
 class MakePredictions:
     """
@@ -27,87 +27,155 @@ class MakePredictions:
     Attributes:
     log_file (file): Log file to store prediction logs.
     logger (App_Logger): Logger instance for logging prediction process.
+    use_cache (bool): Answer repeated mix designs from the prediction cache.
+    metrics (StageMetrics): Per-stage timings of the last prediction run.
     """
-    def __init__(self):
+    def __init__(self, use_cache=PREDICTION_CACHE_ENABLED):
         """
         Initialize MakePredictions object with log file and logger.
+
+        Parameters:
+        use_cache (bool): Answer repeated mix designs from the prediction cache.
         """
         self.log_file = open(PREDICTION_LOGS, 'a+')
         self.logger = App_Logger()
+        self.use_cache = use_cache
+        self.metrics = StageMetrics('prediction', METRICS_TRACE_MEMORY)
+
+    def _load_model_generation(self, generation):
+        """
+        Load the inference pipeline of a generation.
+
+        Parameters:
+        generation (str): Identifier of the model generation being loaded.
+
+        Returns:
+        InferencePipeline: The compiled prediction path of the generation.
+        """
+        return load_inference_pipeline(generation, self.log_file, self.logger)
+
+    def _score(self, pipeline, generation, data):
+        """
+        Score the rows with the pipeline, going through the prediction cache when enabled.
+
+        Parameters:
+        pipeline (InferencePipeline): Pipeline of the current model generation.
+        generation (str): Identifier of the current model generation.
+        data (pandas.DataFrame): Raw feature values.
+
+        Returns:
+        tuple: (predictions (numpy.ndarray), clusters (numpy.ndarray)), both in input row order.
+        """
+        if self.use_cache:
+            return prediction_cache.predict(pipeline, data, generation, metrics=self.metrics)
+        return pipeline.predict(data, metrics=self.metrics)
 
-    def _get_experiment_id_by_name(self, experiment_name):
-        experiment = mlflow.get_experiment_by_name(experiment_name)
-        if experiment is None:
-            raise ValueError(f"Experiment '{experiment_name}' does not exist.")
-        return experiment.experiment_id
-
-
-    def _load_model_by_prefix_number(self, experiment_id, cluster_number):
-        runs = mlflow.search_runs(experiment_id)
-        for run_id in runs['run_id']:
-            # Check for the tag 
-            run = mlflow.get_run(run_id)
-            custom_model_name = "prediction_model"+"_"+str(cluster_number)
-            if run.data.tags.get("model_name") == custom_model_name:
-                model_uri = f"runs:/{run_id}/{custom_model_name}"
-                model = mlflow.pyfunc.load_model(model_uri)
-                return model
-        raise ValueError(f"No model found with prefix number '{cluster_number}'")
-
-    def start_prediction(self):
+    def _predict_in_chunks(self, pipeline, generation, preprocessor, chunk_size, progress_callback=None):
+        """
+        Stream the prediction input through the pipeline chunk by chunk.
+
+        Every chunk is imputed, scored and appended to the output file before the next one
+        is read, so memory use depends on the chunk size and not on the size of the input.
+
+        Parameters:
+        pipeline (InferencePipeline): Pipeline of the current model generation.
+        generation (str): Identifier of the current model generation.
+        preprocessor (Preprocessor): Preprocessor used for imputation.
+        chunk_size (int): Number of rows per chunk.
+        progress_callback (callable, optional): Called with (chunk_number, rows_scored) after every chunk.
+
+        Returns:
+        int: Total number of rows scored.
+        """
+        data_loader = Data_Loader(file=os.path.join(PREDICTION_DATA_DIR, PREDICTION_DATA_FILE),
+                                  log_file_obj=self.log_file,
+                                  logger_obj=self.logger,
+                                  data_type='Prediction')
+        # Results go to a temporary file that replaces the output only once every chunk is written
+        partial_output_file = PREDICTION_OUTPUT_FILE + '.part'
+        rows_scored = 0
+        chunks = data_loader.get_data_in_chunks(chunk_size)
+        chunk_number = 0
+        while True:
+            with self.metrics.stage('data_load') as call:
+                chunk = next(chunks, None)
+                call['rows'] = 0 if chunk is None else len(chunk)
+            if chunk is None:
+                break
+            chunk_number += 1
+            with self.metrics.stage('null_check', len(chunk)):
+                is_null_present, cols_with_na = preprocessor.is_null_present(chunk)
+            if is_null_present:
+                with self.metrics.stage('imputation', len(chunk)):
+                    chunk = preprocessor.impute_missing_values(chunk, numeric_cols=NUMERIC_COLS_PRED)
+            predictions, clusters = self._score(pipeline, generation, chunk)
+            chunk['cluster'] = clusters
+            chunk['Predictions'] = predictions
+            with self.metrics.stage('output_write', len(chunk)):
+                chunk.to_csv(partial_output_file, mode='w' if chunk_number == 1 else 'a', header=chunk_number == 1, index=False)
+
+            rows_scored += len(chunk)
+            self.logger.add_log(self.log_file, f"Scored chunk {chunk_number} with {len(chunk)} rows, {rows_scored} rows so far.")
+            if progress_callback is not None:
+                progress_callback(chunk_number, rows_scored)
+        os.replace(partial_output_file, PREDICTION_OUTPUT_FILE)
+        return rows_scored
+
+    def start_prediction(self, streaming=PREDICTION_STREAMING, chunk_size=PREDICTION_CHUNK_SIZE, progress_callback=None):
         """
         Start the prediction process.
 
+        Parameters:
+        streaming (bool): Read and score the input in chunks of `chunk_size` rows instead of loading it whole.
+        chunk_size (int): Number of rows per chunk in streaming mode.
+        progress_callback (callable, optional): Called with (chunk_number, rows_scored) after every chunk in streaming mode.
+
         Returns:
         bool: True if prediction is successful, False otherwise.
         """
         self.logger.add_log(self.log_file, "Received prediction request.")
         is_prediction_successful = False
+        self.metrics = StageMetrics('prediction', METRICS_TRACE_MEMORY)
         try:
-            # Load prediction data
-            data = Data_Loader(file=os.path.join(PREDICTION_DATA_DIR, PREDICTION_DATA_FILE),
-                               log_file_obj=self.log_file,
-                               logger_obj=self.logger,
-                               data_type='Prediction').get_data()
-
-            # Preprocess data
             preprocessor = Preprocessor(self.log_file, self.logger)
-            is_null_present, cols_with_na = preprocessor.is_null_present(data)
-            if is_null_present:
-                data = preprocessor.impute_missing_values(data, numeric_cols=NUMERIC_COLS_PRED)
-
-            # Data Transformation
-            X = preprocessor.log_transform(data, NUMERIC_COLS_PRED)
-
-            # Dividing data into clusters
-            file_op = FileOperations(self.log_file, self.logger)
-            k_means_model = file_op.load_model(CLUSTERING_MODEL_NAME, MODELS_DIR)
-            clusters = k_means_model.predict(X)
-            X['cluster'] = clusters
-            list_of_clusters = X['cluster'].unique()
-            result = []
-
-            # Making predictions for each cluster
-            for i in list_of_clusters:
-                cluster_data = X[X['cluster'] == i]
-                cluster_data.drop('cluster', axis=1, inplace=True)
-                scaled_data = preprocessor.standardize_data(cluster_data, NUMERIC_COLS_PRED)
-                # model = file_op.find_correct_model(i, PREDICTION_MODELS_DIR)
-                experiment_id = self._get_experiment_id_by_name(experiment_name=MLFLOW_EXPERIMENT_NAME)
-                model = self._load_model_by_prefix_number(experiment_id=experiment_id, cluster_number=i)
-
-                for val in scaled_data.values:
-                    val_reshaped = val.reshape(1, -1)
-                    result.append(model.predict(val_reshaped))
-
-            # Creating DataFrame of predictions
-            result = pd.DataFrame(result, columns=['Predictions'])
-            merged_df = pd.concat([X, result], axis=1)
-
-            # Saving predictions to file
+
+            # Fetching the pipeline of the current generation, loaded once per process
+            with self.metrics.stage('model_load'):
+                generation, pipeline = model_registry.get(self._load_model_generation)
+            self.logger.add_log(self.log_file, f"Using model generation {generation}.")
+
             if not os.path.exists(PREDICTION_OUTPUT_DIR):
                 os.makedirs(PREDICTION_OUTPUT_DIR)
-            merged_df.to_csv(PREDICTION_OUTPUT_FILE, index=False)
+
+            if streaming:
+                rows_scored = self._predict_in_chunks(pipeline, generation, preprocessor, chunk_size, progress_callback)
+                self.logger.add_log(self.log_file, f"Scored {rows_scored} rows in streaming mode.")
+            else:
+                # Load prediction data
+                with self.metrics.stage('data_load') as call:
+                    data = Data_Loader(file=os.path.join(PREDICTION_DATA_DIR, PREDICTION_DATA_FILE),
+                                       log_file_obj=self.log_file,
+                                       logger_obj=self.logger,
+                                       data_type='Prediction').get_data()
+                    call['rows'] = len(data)
+
+                # Preprocess data
+                with self.metrics.stage('null_check', len(data)):
+                    is_null_present, cols_with_na = preprocessor.is_null_present(data)
+                if is_null_present:
+                    with self.metrics.stage('imputation', len(data)):
+                        data = preprocessor.impute_missing_values(data, numeric_cols=NUMERIC_COLS_PRED)
+
+                # Log transform, cluster routing, scaling and scoring in a single pass
+                predictions, clusters = self._score(pipeline, generation, data)
+                data['cluster'] = clusters
+                data['Predictions'] = predictions
+
+                # Saving predictions to file
+                with self.metrics.stage('output_write', len(data)):
+                    data.to_csv(PREDICTION_OUTPUT_FILE, index=False)
+            if self.use_cache:
+                self.logger.add_log(self.log_file, f"Prediction cache: {prediction_cache.stats()}")
             is_prediction_successful = True
             self.logger.add_log(self.log_file, 'Successful End of Prediction')
 
@@ -116,6 +184,11 @@ class MakePredictions:
             error_message_with_line = error_message + "\n" + traceback.format_exc()
             self.logger.add_log(self.log_file, error_message_with_line)
         finally:
+            try:
+                self.metrics.export(METRICS_DIR)
+                self.logger.add_log(self.log_file, "Prediction stage metrics:\n" + self.metrics.summary())
+            except Exception as e:
+                self.logger.add_log(self.log_file, 'Error while exporting prediction metrics: ' + str(e))
             self.log_file.close()
 
         return is_prediction_successful
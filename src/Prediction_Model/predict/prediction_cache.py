@@ -0,0 +1,159 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from Prediction_Model.config.config import PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL_SECONDS
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of predictions for repeated mix designs.
+
+    Rows are keyed by a hash of their canonical float64 feature vector. The cache belongs
+    to one model generation at a time and is flushed as soon as a different generation
+    is used. Entries expire after `ttl_seconds` and the least recently used entries are
+    evicted beyond `max_size`.
+
+    Attributes:
+    max_size (int): Maximum number of cached rows.
+    ttl_seconds (float): Lifetime of an entry, None to keep entries until evicted.
+    hits (int): Rows answered from the cache.
+    misses (int): Rows that had to be scored.
+    """
+    def __init__(self, max_size=PREDICTION_CACHE_SIZE, ttl_seconds=PREDICTION_CACHE_TTL_SECONDS):
+        """
+        Initialize an empty PredictionCache.
+
+        Parameters:
+        max_size (int): Maximum number of cached rows.
+        ttl_seconds (float, optional): Lifetime of an entry, None to keep entries until evicted.
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def row_keys(X):
+        """
+        Hash every row of a feature matrix.
+
+        Parameters:
+        X (numpy.ndarray): Raw feature matrix.
+
+        Returns:
+        list: One digest per row.
+        """
+        # Adding 0.0 turns -0.0 into 0.0 so equal mixes always hash the same
+        X = np.ascontiguousarray(X, dtype=np.float64) + 0.0
+        return [hashlib.blake2b(row.tobytes(), digest_size=16).digest() for row in X]
+
+    def _use_generation(self, generation):
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+    def lookup(self, keys, generation):
+        """
+        Fetch the cached predictions of many rows at once.
+
+        Parameters:
+        keys (list): Row digests from `row_keys`.
+        generation (str): The active model generation.
+
+        Returns:
+        tuple: (predictions, clusters, miss_positions) where the first two hold the cached
+               values and miss_positions lists the rows that still need scoring.
+        """
+        predictions = np.full(len(keys), np.nan)
+        clusters = np.full(len(keys), -1, dtype=np.int64)
+        miss_positions = []
+        now = time.monotonic()
+        with self._lock:
+            self._use_generation(generation)
+            for position, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is None or (entry[0] is not None and entry[0] < now):
+                    miss_positions.append(position)
+                    continue
+                self._entries.move_to_end(key)
+                predictions[position] = entry[1]
+                clusters[position] = entry[2]
+            self.hits += len(keys) - len(miss_positions)
+            self.misses += len(miss_positions)
+        return predictions, clusters, np.asarray(miss_positions, dtype=np.intp)
+
+    def store(self, keys, predictions, clusters, generation):
+        """
+        Cache freshly scored rows.
+
+        Parameters:
+        keys (list): Row digests from `row_keys`.
+        predictions (numpy.ndarray): Predictions of the rows.
+        clusters (numpy.ndarray): Clusters of the rows.
+        generation (str): The model generation that produced the predictions.
+        """
+        expires_at = None if self.ttl_seconds is None else time.monotonic() + self.ttl_seconds
+        with self._lock:
+            if generation != self._generation:
+                # A newer generation took over while these rows were being scored
+                return
+            for key, prediction, cluster in zip(keys, predictions, clusters):
+                self._entries[key] = (expires_at, float(prediction), int(cluster))
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def predict(self, pipeline, data, generation, **predict_kwargs):
+        """
+        Predict through the cache, scoring only the rows that miss it.
+
+        Parameters:
+        pipeline (InferencePipeline): Pipeline of the active generation.
+        data (pandas.DataFrame or array-like): Raw feature values.
+        generation (str): The active model generation.
+        **predict_kwargs: Forwarded to `pipeline.predict`.
+
+        Returns:
+        tuple: (predictions (numpy.ndarray), clusters (numpy.ndarray)), both in input row order.
+        """
+        X = pipeline.as_array(data)
+        keys = self.row_keys(X)
+        predictions, clusters, miss_positions = self.lookup(keys, generation)
+        if len(miss_positions):
+            miss_predictions, miss_clusters = pipeline.predict(X[miss_positions], **predict_kwargs)
+            predictions[miss_positions] = miss_predictions
+            clusters[miss_positions] = miss_clusters
+            self.store([keys[i] for i in miss_positions], miss_predictions, miss_clusters, generation)
+        return predictions, clusters
+
+    def clear(self):
+        """
+        Drop every cached prediction.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._generation = None
+
+    def stats(self):
+        """
+        Report the cache counters.
+
+        Returns:
+        dict: Hits, misses, hit rate and the number of cached rows.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'size': len(self._entries),
+                    'generation': self._generation}
+
+
+# Cache shared by every prediction made in this process
+prediction_cache = PredictionCache()
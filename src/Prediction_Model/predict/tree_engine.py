@@ -0,0 +1,266 @@
+import os
+import pickle
+import time
+import numpy as np
+from Prediction_Model.file_operations.model_manifest import ModelManifest
+
+# Number of (row, tree) pairs traversed together, small enough to stay in cache
+TRAVERSAL_BLOCK_SIZE = 32768
+
+
+class CompactTreeEnsemble:
+    """
+    Array-backed evaluator for RandomForestRegressor and GradientBoostingRegressor models.
+
+    All trees are flattened into shared contiguous node arrays. Leaves point to themselves,
+    so a batch is evaluated by stepping every (row, tree) pair down one level at a time with
+    vectorized NumPy operations, dropping pairs as they reach a leaf. The prediction is
+    `base + scale * sum(leaf values)`.
+
+    The per-call cost is a handful of NumPy operations per tree level instead of a Python
+    call per tree, which makes small batches much cheaper than sklearn. For very large
+    batches sklearn's compiled traversal remains faster.
+
+    Attributes:
+    feature (numpy.ndarray): Split feature of every node.
+    threshold (numpy.ndarray): Split threshold of every node.
+    children (numpy.ndarray): Left and right child of every node, interleaved. Leaves point to themselves.
+    value (numpy.ndarray): Output value of every node.
+    roots (numpy.ndarray): Root node of every tree.
+    max_depth (int): Depth of the deepest tree.
+    scale (float): Factor applied to the sum of leaf values.
+    base (float): Constant added to the scaled sum.
+    n_features (int): Number of input features.
+    """
+    def __init__(self, feature, threshold, children, value, roots, max_depth, scale, base, n_features):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.scale = float(scale)
+        self.base = float(base)
+        self.n_features = int(n_features)
+        self._is_leaf = children[0::2] == np.arange(len(feature))
+
+    def __setstate__(self, state):
+        # The leaf mask is kept in the pickle, so memory-mapped artifacts share it between processes
+        self.__dict__.update(state)
+        if '_is_leaf' not in state:
+            # Pickled before the leaf mask was stored
+            self._is_leaf = self.children[0::2] == np.arange(len(self.feature))
+
+    @staticmethod
+    def is_supported(model):
+        """
+        Check whether a model can be flattened.
+
+        Parameters:
+        model: A fitted model.
+
+        Returns:
+        bool: True for fitted single-output RandomForestRegressor and GradientBoostingRegressor models.
+        """
+        from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+        if not isinstance(model, (RandomForestRegressor, GradientBoostingRegressor)):
+            return False
+        return hasattr(model, 'estimators_') and getattr(model, 'n_outputs_', 1) == 1
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """
+        Flatten a fitted sklearn tree ensemble.
+
+        Parameters:
+        model (RandomForestRegressor or GradientBoostingRegressor): The fitted ensemble.
+
+        Returns:
+        CompactTreeEnsemble: The flattened ensemble.
+        """
+        from sklearn.ensemble import GradientBoostingRegressor
+        if not cls.is_supported(model):
+            raise ValueError(f"Unsupported model type '{type(model).__name__}'")
+
+        n_features = model.n_features_in_
+        if isinstance(model, GradientBoostingRegressor):
+            trees = [estimator.tree_ for estimator in model.estimators_[:, 0]]
+            scale = model.learning_rate
+            if model.init_ == 'zero':
+                base = 0.0
+            else:
+                base = float(np.ravel(model.init_.predict(np.zeros((1, n_features))))[0])
+        else:
+            trees = [estimator.tree_ for estimator in model.estimators_]
+            scale = 1.0 / len(trees)
+            base = 0.0
+
+        node_counts = np.array([tree.node_count for tree in trees])
+        offsets = np.concatenate([[0], np.cumsum(node_counts)[:-1]]).astype(np.intp)
+        total_nodes = int(node_counts.sum())
+        feature = np.zeros(total_nodes, dtype=np.intp)
+        threshold = np.zeros(total_nodes, dtype=np.float64)
+        children = np.empty(2 * total_nodes, dtype=np.intp)
+        value = np.empty(total_nodes, dtype=np.float64)
+
+        for tree, offset in zip(trees, offsets):
+            nodes = slice(offset, offset + tree.node_count)
+            node_ids = np.arange(offset, offset + tree.node_count, dtype=np.intp)
+            is_leaf = tree.children_left == -1
+            feature[nodes] = np.where(is_leaf, 0, tree.feature)
+            threshold[nodes] = np.where(is_leaf, 0.0, tree.threshold)
+            children[2 * offset:2 * (offset + tree.node_count):2] = np.where(is_leaf, node_ids, tree.children_left + offset)
+            children[2 * offset + 1:2 * (offset + tree.node_count):2] = np.where(is_leaf, node_ids, tree.children_right + offset)
+            value[nodes] = tree.value[:, 0, 0]
+
+        return cls(feature=feature,
+                   threshold=threshold,
+                   children=children,
+                   value=value,
+                   roots=offsets,
+                   max_depth=max(tree.max_depth for tree in trees),
+                   scale=scale,
+                   base=base,
+                   n_features=n_features)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the node arrays, in bytes.
+        """
+        return sum(array.nbytes for array in (self.feature, self.threshold, self.children, self.value, self.roots))
+
+    def _leaf_sum(self, X_block):
+        n_rows = len(X_block)
+        X_flat = X_block.ravel()
+        # Leaf reached by every (row, tree) pair, row-major
+        leaves = np.tile(self.roots, n_rows)
+        row_offsets = np.repeat(np.arange(n_rows, dtype=np.intp) * self.n_features, self.n_trees)
+        active = None
+        nodes = leaves
+        for _ in range(self.max_depth):
+            go_right = X_flat[row_offsets + self.feature[nodes]] > self.threshold[nodes]
+            nodes = self.children[2 * nodes + go_right]
+            if active is None:
+                leaves = nodes
+            else:
+                leaves[active] = nodes
+            # Only the pairs that have not reached a leaf are stepped further
+            still_inside = np.flatnonzero(~self._is_leaf[nodes])
+            if len(still_inside) < len(nodes):
+                active = still_inside if active is None else active[still_inside]
+                if len(active) == 0:
+                    break
+                nodes = nodes[still_inside]
+                row_offsets = row_offsets[still_inside]
+        return self.value[leaves].reshape(n_rows, self.n_trees).sum(axis=1)
+
+    def predict(self, X):
+        """
+        Predict with every tree over a batch of rows.
+
+        Parameters:
+        X (array-like): Feature matrix of shape (n_rows, n_features).
+
+        Returns:
+        numpy.ndarray: Predictions of shape (n_rows,).
+        """
+        # Trees compare float32 features with float64 thresholds, exactly like sklearn
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        predictions = np.empty(len(X), dtype=np.float64)
+        block_rows = max(1, TRAVERSAL_BLOCK_SIZE // max(self.n_trees, 1))
+        for start in range(0, len(X), block_rows):
+            block = X[start:start + block_rows]
+            predictions[start:start + len(block)] = self._leaf_sum(block)
+        return self.base + self.scale * predictions
+
+
+def compile_model(model, X_check=None, rtol=1e-7, atol=1e-7):
+    """
+    Flatten a model when supported and when it reproduces the original predictions.
+
+    Parameters:
+    model: A fitted model.
+    X_check (array-like, optional): Rows used to check that both evaluators agree.
+    rtol (float): Relative tolerance of the check.
+    atol (float): Absolute tolerance of the check.
+
+    Returns:
+    The CompactTreeEnsemble, or the original model when it cannot be flattened faithfully.
+    """
+    if not CompactTreeEnsemble.is_supported(model):
+        return model
+    compact = CompactTreeEnsemble.from_sklearn(model)
+    if X_check is not None and not np.allclose(compact.predict(X_check), model.predict(X_check), rtol=rtol, atol=atol):
+        return model
+    return compact
+
+
+def benchmark(model, X, repeat=5):
+    """
+    Compare the sklearn evaluator of a tree ensemble with its flattened counterpart.
+
+    Parameters:
+    model (RandomForestRegressor or GradientBoostingRegressor): The fitted ensemble.
+    X (numpy.ndarray): Rows to score.
+    repeat (int): Number of timed runs, the fastest one is reported.
+
+    Returns:
+    dict: Best wall times, speedup, serialized sizes and the largest prediction difference.
+    """
+    compact = CompactTreeEnsemble.from_sklearn(model)
+
+    def best_time(predict):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            predict(X)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    sklearn_seconds = best_time(model.predict)
+    compact_seconds = best_time(compact.predict)
+    return {
+        'rows': len(X),
+        'trees': compact.n_trees,
+        'sklearn_seconds': sklearn_seconds,
+        'compact_seconds': compact_seconds,
+        'speedup': sklearn_seconds / compact_seconds,
+        'sklearn_bytes': len(pickle.dumps(model)),
+        'compact_bytes': len(pickle.dumps(compact)),
+        'max_abs_diff': float(np.max(np.abs(compact.predict(X) - model.predict(X)))),
+    }
+
+
+def main():
+    """
+    Benchmark every saved tree ensemble of the current model generation.
+    """
+    rng = np.random.default_rng(0)
+    manifest = ModelManifest.load()
+    for i in manifest.cluster_numbers():
+        model_file = manifest.resolve(manifest.cluster(i)['model_file'])
+        if not os.path.exists(model_file):
+            continue
+        file_name = os.path.basename(model_file)
+        with open(model_file, 'rb') as f:
+            model = pickle.load(f)
+        if not CompactTreeEnsemble.is_supported(model):
+            continue
+        # Cluster models are trained on standardized features
+        X = rng.standard_normal((100_000, model.n_features_in_))
+        result = benchmark(model, X)
+        print(f"{file_name}: {result['trees']} trees, sklearn {result['sklearn_seconds']:.4f}s, "
+              f"compact {result['compact_seconds']:.4f}s ({result['speedup']:.1f}x), "
+              f"size {result['sklearn_bytes']} -> {result['compact_bytes']} bytes, "
+              f"max abs diff {result['max_abs_diff']:.2e}")
+
+
+if __name__ == '__main__':
+    main()
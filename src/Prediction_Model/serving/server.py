@@ -0,0 +1,332 @@
+import argparse
+import json
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from Prediction_Model.app_logging.app_logger import App_Logger
+from Prediction_Model.file_operations.model_registry import model_registry
+from Prediction_Model.predict.inference_pipeline import load_inference_pipeline
+from Prediction_Model.predict.prediction_cache import prediction_cache
+from Prediction_Model.config.config import (NUMERIC_COLS_PRED,
+                                            SERVING_HOST,
+                                            SERVING_PORT,
+                                            SERVING_MAX_BATCH_SIZE,
+                                            SERVING_BACKLOG,
+                                            SERVING_MAX_WAIT_MS,
+                                            SERVING_LOGS,
+                                            SERVING_LOAD_TREE_MODELS,
+                                            PREDICTION_CACHE_ENABLED)
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent scoring requests into micro-batches.
+
+    Requests are queued and a single worker thread scores everything that arrives within
+    `max_wait_ms` of the first queued request, up to `max_batch_size` rows, with one call
+    to the inference pipeline.
+
+    Attributes:
+    max_batch_size (int): Maximum number of rows scored together.
+    max_wait_ms (float): Longest time a request waits for others to join its batch.
+    """
+    def __init__(self, score_batch, max_batch_size=SERVING_MAX_BATCH_SIZE, max_wait_ms=SERVING_MAX_WAIT_MS):
+        """
+        Initialize the MicroBatcher and start its worker thread.
+
+        Parameters:
+        score_batch (callable): Called with a feature matrix, returns (generation, predictions, clusters).
+        max_batch_size (int): Maximum number of rows scored together.
+        max_wait_ms (float): Longest time a request waits for others to join its batch.
+        """
+        self.score_batch = score_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, features):
+        """
+        Queue rows for scoring.
+
+        Parameters:
+        features (numpy.ndarray): Feature matrix of shape (n_rows, n_features).
+
+        Returns:
+        concurrent.futures.Future: Resolves to (generation, predictions, clusters) for the submitted rows.
+        """
+        future = Future()
+        self._queue.put((features, future))
+        return future
+
+    def close(self):
+        """
+        Stop the worker thread once the queued requests are scored.
+        """
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect_batch(self, first):
+        """
+        Gather the requests that join the batch opened by `first`.
+        """
+        batch = [first]
+        rows = len(first[0])
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while rows < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Put the stop signal back so the worker exits after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect_batch(first)
+            try:
+                generation, predictions, clusters = self.score_batch(np.vstack([features for features, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            # Hand every request back its own slice of the batch
+            start = 0
+            for features, future in batch:
+                stop = start + len(features)
+                future.set_result((generation, predictions[start:stop], clusters[start:stop]))
+                start = stop
+
+
+class ScoringHTTPServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server with a configurable listen backlog, so bursts of concurrent
+    clients are queued for the micro-batcher instead of being reset.
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, backlog=SERVING_BACKLOG):
+        # Read by server_activate when the socket starts listening
+        self.request_queue_size = backlog
+        super().__init__(server_address, handler_class)
+
+
+class PredictionServer:
+    """
+    Local HTTP endpoint scoring cement mixes with warm models.
+
+    Endpoints:
+    GET /health: Reports the loaded model generation and the prediction cache counters.
+    POST /predict: Scores a single mix, a list of mixes or {"instances": [...]} given as JSON
+                   objects keyed by the prediction feature columns.
+
+    Attributes:
+    host (str): Address the server binds to.
+    port (int): Port the server listens on.
+    use_cache (bool): Answer repeated mix designs from the prediction cache.
+    backlog (int): Connections waiting to be accepted.
+    """
+    def __init__(self, host=SERVING_HOST, port=SERVING_PORT, max_batch_size=SERVING_MAX_BATCH_SIZE, max_wait_ms=SERVING_MAX_WAIT_MS,
+                 use_cache=PREDICTION_CACHE_ENABLED, backlog=SERVING_BACKLOG):
+        """
+        Initialize the PredictionServer.
+
+        Parameters:
+        host (str): Address the server binds to.
+        port (int): Port the server listens on.
+        max_batch_size (int): Maximum number of rows scored together.
+        max_wait_ms (float): Longest time a request waits for others to join its batch.
+        use_cache (bool): Answer repeated mix designs from the prediction cache.
+        backlog (int): Connections waiting to be accepted.
+        """
+        self.host = host
+        self.port = port
+        self.use_cache = use_cache
+        self.backlog = backlog
+        self.log_file = open(SERVING_LOGS, 'a+')
+        self.logger = App_Logger()
+        self.batcher = MicroBatcher(self.score, max_batch_size, max_wait_ms)
+        self.httpd = None
+        # Generation of the pipeline that scored the last batch, None until a pipeline is loaded
+        self.loaded_generation = None
+
+    def _load_pipeline(self, generation):
+        pipeline = load_inference_pipeline(generation, self.log_file, self.logger, load_tree_models=SERVING_LOAD_TREE_MODELS)
+        self.log_file.flush()
+        return pipeline
+
+    def score(self, features):
+        """
+        Score a feature matrix with the pipeline of the current model generation.
+
+        Parameters:
+        features (numpy.ndarray): Feature matrix in prediction column order.
+
+        Returns:
+        tuple: (generation (str), predictions (numpy.ndarray), clusters (numpy.ndarray))
+        """
+        # A newly published generation is loaded in the background, requests keep the loaded one meanwhile
+        generation, pipeline = model_registry.get(self._load_pipeline, background=True)
+        self.loaded_generation = generation
+        if self.use_cache:
+            predictions, clusters = prediction_cache.predict(pipeline, features, generation)
+        else:
+            predictions, clusters = pipeline.predict(features)
+        return generation, predictions, clusters
+
+    @staticmethod
+    def parse_instances(payload):
+        """
+        Convert a JSON payload into a feature matrix.
+
+        Parameters:
+        payload (dict or list): A single mix, a list of mixes or {"instances": [...]}.
+
+        Returns:
+        numpy.ndarray: Feature matrix in prediction column order.
+        """
+        if isinstance(payload, dict) and 'instances' in payload:
+            payload = payload['instances']
+        if isinstance(payload, dict):
+            payload = [payload]
+        if not isinstance(payload, list) or not payload:
+            raise ValueError("Expected a mix, a list of mixes or {\"instances\": [...]}")
+        rows = []
+        for instance in payload:
+            if not isinstance(instance, dict):
+                raise ValueError("Every mix must be a JSON object keyed by the feature names")
+            missing = [col for col in NUMERIC_COLS_PRED if col not in instance]
+            if missing:
+                raise ValueError(f"Missing features: {missing}")
+            row = []
+            for col in NUMERIC_COLS_PRED:
+                value = instance[col]
+                # bool is an int, but never a valid amount
+                if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+                    raise ValueError(f"Feature '{col}' must be a number")
+                try:
+                    value = float(value)
+                except ValueError:
+                    raise ValueError(f"Feature '{col}' must be a number")
+                # The features are log1p-transformed, which is only defined above -1
+                if not np.isfinite(value) or value <= -1:
+                    raise ValueError(f"Feature '{col}' must be a finite number greater than -1")
+                row.append(value)
+            rows.append(row)
+        return np.asarray(rows, dtype=np.float64)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _send_json(self, status, body):
+                content = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                if self.path != '/health':
+                    self._send_json(404, {'error': 'Not found'})
+                    return
+                # The generation being served, which lags the published one while a new generation loads
+                generation = server.loaded_generation
+                if generation is None:
+                    self._send_json(503, {'status': 'loading', 'generation': None})
+                    return
+                self._send_json(200, {'status': 'ok',
+                                      'generation': generation,
+                                      'cache': prediction_cache.stats() if server.use_cache else None})
+
+            def do_POST(self):
+                if self.path != '/predict':
+                    self._send_json(404, {'error': 'Not found'})
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    features = server.parse_instances(json.loads(self.rfile.read(length)))
+                except (ValueError, TypeError, KeyError) as e:
+                    self._send_json(400, {'error': str(e)})
+                    return
+                try:
+                    generation, predictions, clusters = server.batcher.submit(features).result()
+                except Exception as e:
+                    server.logger.add_log(server.log_file, 'Error while scoring request: ' + str(e) + "\n" + traceback.format_exc())
+                    self._send_json(500, {'error': str(e)})
+                    return
+                self._send_json(200, {'generation': generation,
+                                      'predictions': predictions.tolist(),
+                                      'clusters': clusters.tolist()})
+
+            def log_message(self, format, *args):
+                # Per-request access logs would dominate the latency of small requests
+                pass
+
+        return Handler
+
+    def serve_forever(self):
+        """
+        Load the current models and serve requests until interrupted.
+        """
+        generation, _ = model_registry.get(self._load_pipeline)
+        self.loaded_generation = generation
+        self.httpd = ScoringHTTPServer((self.host, self.port), self._make_handler(), self.backlog)
+        self.logger.add_log(self.log_file, f"Serving model generation {generation} on http://{self.host}:{self.port}.")
+        self.log_file.flush()
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """
+        Stop accepting requests and release the log file.
+        """
+        if self.httpd is not None:
+            self.httpd.server_close()
+            self.httpd = None
+        self.batcher.close()
+        self.logger.add_log(self.log_file, "Scoring server stopped.")
+        self.log_file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Online cement strength scoring server.')
+    parser.add_argument('--host', default=SERVING_HOST)
+    parser.add_argument('--port', type=int, default=SERVING_PORT)
+    parser.add_argument('--max-batch-size', type=int, default=SERVING_MAX_BATCH_SIZE)
+    parser.add_argument('--max-wait-ms', type=float, default=SERVING_MAX_WAIT_MS)
+    parser.add_argument('--backlog', type=int, default=SERVING_BACKLOG)
+    parser.add_argument('--cache', action='store_true', default=PREDICTION_CACHE_ENABLED,
+                        help='Answer repeated mix designs from the prediction cache.')
+    args = parser.parse_args()
+    server = PredictionServer(args.host, args.port, args.max_batch_size, args.max_wait_ms, args.cache, args.backlog)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
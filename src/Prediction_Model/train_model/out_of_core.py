@@ -0,0 +1,173 @@
+import numpy as np
+from Prediction_Model.app_logging.metrics import optional_stage
+from Prediction_Model.config.config import (RANDOM_SEED,
+                                            OUT_OF_CORE_CHUNK_SIZE,
+                                            OUT_OF_CORE_SAMPLE_ROWS,
+                                            OUT_OF_CORE_EPOCHS)
+
+# Share of the rows held out for validation, as test_size in the in-memory training
+VALIDATION_SHARE = 1 / 3
+
+
+class OutOfCoreTrainer:
+    """
+    Fits the clustering model, the scalers and the cluster models one slice of rows at a time.
+
+    The rows are read from a memory-mapped feature store entry, so only the current slice is
+    copied into memory. MiniBatchKMeans routes the rows, StandardScaler and SGDRegressor learn
+    with partial_fit, and a fixed random third of the rows is held out for validation.
+    The fitted objects have the same interface as the in-memory ones, so they are saved and
+    compiled into the inference pipeline in the same way.
+
+    Attributes:
+    features (numpy.ndarray): Memory-mapped, log-transformed features.
+    label (numpy.ndarray): Memory-mapped target values.
+    chunk_size (int): Rows per slice.
+    """
+    def __init__(self, log_file, logger, features, label, chunk_size=OUT_OF_CORE_CHUNK_SIZE, metrics=None):
+        """
+        Initialize the OutOfCoreTrainer.
+
+        Parameters:
+        log_file: Log file object.
+        logger: Logger object.
+        features (numpy.ndarray): Memory-mapped, log-transformed features.
+        label (numpy.ndarray): Memory-mapped target values.
+        chunk_size (int, optional): Rows per slice.
+        metrics (StageMetrics, optional): Collector receiving the timing of every pass.
+        """
+        self.log_file = log_file
+        self.logger = logger
+        self.features = features
+        self.label = label
+        self.chunk_size = chunk_size
+        self.metrics = metrics
+
+    def slices(self):
+        """
+        Copy the rows into memory one slice at a time.
+
+        Yields:
+        tuple: X (numpy.ndarray), y (numpy.ndarray), holdout (numpy.ndarray of bool) of the slice.
+        """
+        for start in range(0, len(self.features), self.chunk_size):
+            stop = min(start + self.chunk_size, len(self.features))
+            # Seeded by the position, so every pass holds out the same rows
+            holdout = np.random.default_rng([RANDOM_SEED, start]).random(stop - start) < VALIDATION_SHARE
+            yield np.array(self.features[start:stop]), np.array(self.label[start:stop]), holdout
+
+    def sample(self, n_rows=OUT_OF_CORE_SAMPLE_ROWS):
+        """
+        Draw a uniform sample of the rows, e.g. for the elbow search.
+
+        Parameters:
+        n_rows (int): Maximum size of the sample.
+
+        Returns:
+        numpy.ndarray: The sampled rows, in storage order.
+        """
+        if len(self.features) <= n_rows:
+            return np.array(self.features)
+        rows = np.sort(np.random.default_rng(RANDOM_SEED).choice(len(self.features), n_rows, replace=False))
+        return np.array(self.features[rows])
+
+    def fit_clustering(self, n_clusters):
+        """
+        Fit the clustering model in one pass over the rows.
+
+        Parameters:
+        n_clusters (int): Number of clusters, e.g. from the elbow search on `sample`.
+
+        Returns:
+        sklearn.cluster.MiniBatchKMeans: The fitted clustering model.
+        """
+        from sklearn.cluster import MiniBatchKMeans
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=RANDOM_SEED, n_init=3)
+        with optional_stage(self.metrics, 'clustering', len(self.features)):
+            for X, _, _ in self.slices():
+                kmeans.partial_fit(X)
+        self.logger.add_log(self.log_file, f"Fitted MiniBatchKMeans with {n_clusters} clusters out of core.")
+        return kmeans
+
+    def fit_scalers(self, kmeans):
+        """
+        Fit the scaler of every cluster on its training rows.
+
+        Parameters:
+        kmeans (sklearn.cluster.MiniBatchKMeans): The fitted clustering model.
+
+        Returns:
+        dict: Mapping of cluster number to its fitted StandardScaler.
+        """
+        from sklearn.preprocessing import StandardScaler
+        scalers = {}
+        with optional_stage(self.metrics, 'scaling', len(self.features)):
+            for X, _, holdout in self.slices():
+                clusters = kmeans.predict(X)
+                for i in np.unique(clusters[~holdout]):
+                    scalers.setdefault(int(i), StandardScaler()).partial_fit(X[(clusters == i) & ~holdout])
+        missing = sorted(set(range(kmeans.n_clusters)) - set(scalers))
+        if missing:
+            raise Exception(f"Clusters {missing} received no training rows, train with fewer clusters.")
+        return scalers
+
+    def fit_regressors(self, kmeans, scalers, epochs=OUT_OF_CORE_EPOCHS):
+        """
+        Fit an SGDRegressor per cluster with several passes over its training rows.
+
+        Parameters:
+        kmeans (sklearn.cluster.MiniBatchKMeans): The fitted clustering model.
+        scalers (dict): Fitted scaler of every cluster.
+        epochs (int): Passes over the rows.
+
+        Returns:
+        dict: Mapping of cluster number to its fitted SGDRegressor.
+        """
+        from sklearn.linear_model import SGDRegressor
+        models = {i: SGDRegressor(random_state=RANDOM_SEED) for i in scalers}
+        rng = np.random.default_rng(RANDOM_SEED)
+        for epoch in range(epochs):
+            with optional_stage(self.metrics, 'regression', len(self.features), epoch=epoch):
+                for X, y, holdout in self.slices():
+                    clusters = kmeans.predict(X)
+                    for i, model in models.items():
+                        mask = (clusters == i) & ~holdout
+                        if not mask.any():
+                            continue
+                        # SGD converges better when the rows of a slice are not in storage order
+                        order = rng.permutation(np.count_nonzero(mask))
+                        model.partial_fit(scalers[i].transform(X[mask])[order], y[mask][order])
+            self.logger.add_log(self.log_file, f"Finished epoch {epoch + 1} of {epochs} of the out-of-core regressors.")
+        return models
+
+    def evaluate(self, kmeans, scalers, models):
+        """
+        Score every cluster model on its held out rows.
+
+        Parameters:
+        kmeans (sklearn.cluster.MiniBatchKMeans): The fitted clustering model.
+        scalers (dict): Fitted scaler of every cluster.
+        models (dict): Fitted model of every cluster.
+
+        Returns:
+        dict: Mapping of cluster number to {'r2_score', 'training_rows', 'validation_rows'}.
+        """
+        # Running sums, so the R2 score needs no second pass and no stored predictions
+        sums = {i: np.zeros(5) for i in models}
+        with optional_stage(self.metrics, 'evaluation', len(self.features)):
+            for X, y, holdout in self.slices():
+                clusters = kmeans.predict(X)
+                for i, model in models.items():
+                    train_rows = np.count_nonzero((clusters == i) & ~holdout)
+                    mask = (clusters == i) & holdout
+                    y_true = y[mask]
+                    y_pred = model.predict(scalers[i].transform(X[mask])) if mask.any() else y_true
+                    sums[i] += [train_rows, len(y_true), y_true.sum(), np.square(y_true).sum(), np.square(y_true - y_pred).sum()]
+
+        scores = {}
+        for i, (train_rows, n, total, squares, residual) in sums.items():
+            variance = squares - total * total / n if n else 0.0
+            scores[i] = {'r2_score': float(1 - residual / variance) if variance > 0 else float('nan'),
+                         'training_rows': int(train_rows),
+                         'validation_rows': int(n)}
+        return scores
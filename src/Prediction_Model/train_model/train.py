@@ -1,77 +1,276 @@
 from sklearn.model_selection import train_test_split
 from Prediction_Model.data_ingestion.data_loader import Data_Loader
+from Prediction_Model.data_ingestion.feature_store import FeatureStore
+from Prediction_Model.train_model.out_of_core import OutOfCoreTrainer
 from Prediction_Model.data_preprocessing.data_preprocessing import Preprocessor
 from Prediction_Model.clustering.clustering import KMeansClustering
-from Prediction_Model.best_model_finder.model_finder import BestModelFinder
+from Prediction_Model.best_model_finder.model_finder import BestModelFinder, search_config
 from Prediction_Model.file_operations.file_methods import FileOperations
+from Prediction_Model.file_operations.model_registry import (model_registry,
+                                                             mark_new_generation,
+                                                             new_generation_id,
+                                                             generation_dir,
+                                                             prune_generations)
+from Prediction_Model.file_operations.model_manifest import ModelManifest
+from Prediction_Model.predict.inference_pipeline import InferencePipeline
+from Prediction_Model.predict.prediction_cache import prediction_cache
 from Prediction_Model.app_logging.app_logger import App_Logger
+from Prediction_Model.app_logging.metrics import StageMetrics
+from Prediction_Model.app_logging.tracking import AsyncTracker
+from Prediction_Model.utils.cpu_budget import CpuBudget, apply_thread_limits, thread_limits
 from Prediction_Model.config.config import (TRAINING_LOGS, 
                                             TRAINING_DATA_DIR, 
                                             TRAINING_DATA_FILE,
                                             NUMERIC_COLS,
                                             RANDOM_SEED,
-                                            PREDICTION_MODELS_DIR)
+                                            CLUSTERING_MODEL_NAME,
+                                            INFERENCE_PIPELINE_NAME,
+                                            PREDICTION_MODELS_SUBDIR,
+                                            SCALERS_SUBDIR,
+                                            METRICS_DIR,
+                                            METRICS_TRACE_MEMORY,
+                                            MLFLOW_EXPERIMENT_NAME,
+                                            TRAINING_PARALLEL_BACKEND,
+                                            CANDIDATE_MODELS,
+                                            INCREMENTAL_TRAINING,
+                                            OUT_OF_CORE_TRAINING,
+                                            OUT_OF_CORE_CHUNK_SIZE,
+                                            OUT_OF_CORE_EPOCHS)
+import hashlib
+import io
+import json
 import os
+import shutil
 import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+def train_cluster(cluster_number, partition, allocation, trace_memory=METRICS_TRACE_MEMORY):
+    """
+    Split, scale and find the best model of one cluster.
+
+    Runs in a worker process in parallel training mode. It therefore buffers its log lines
+    and timings instead of writing them, and leaves saving the artifacts to the caller.
+
+    Parameters:
+    cluster_number (int): The cluster being trained.
+    partition (StoredPartition): Rows of the cluster in the feature store.
+    allocation (TrainingAllocation): Workers of the candidate fits, the search and the estimators.
+    trace_memory (bool): Record the peak Python allocation of every stage.
+
+    Returns:
+    dict: Best model name, model, scaler, the MLflow run to log (see AsyncTracker.log_run),
+          scaled validation rows, buffered log lines and stage metrics of the cluster.
+    """
+    log_buffer = io.StringIO()
+    logger = App_Logger()
+    metrics = StageMetrics('training', trace_memory)
+    preprocessor = Preprocessor(log_buffer, logger)
+    logger.add_log(log_buffer, f"Training on the cluster number {cluster_number}")
+    cluster_features, cluster_label = partition.load()
+
+    # splitting the data into training and test set for each cluster one by one
+    x_train, x_test, y_train, y_test = train_test_split(cluster_features, cluster_label, test_size=1 / 3, random_state=RANDOM_SEED)
+    with metrics.stage('scaling', len(cluster_features), cluster=cluster_number):
+        scaler = preprocessor.fit_scaler(x_train, NUMERIC_COLS[:-1])
+        x_train_scaled = preprocessor.standardize_data(x_train, NUMERIC_COLS[:-1], scaler=scaler)
+        x_test_scaled = preprocessor.standardize_data(x_test, NUMERIC_COLS[:-1], scaler=scaler)
+
+    model_finder = BestModelFinder(log_file=log_buffer,
+                                   logger=logger,
+                                   X_train=x_train_scaled.to_numpy(),
+                                   y_train=y_train,
+                                   X_test=x_test_scaled.to_numpy(),
+                                   y_test=y_test,
+                                   cluster_number=cluster_number,
+                                   metrics=metrics,
+                                   estimator_jobs=allocation.estimator_jobs
+                                   )
+    best_model_name, best_model = model_finder.find_best_model(n_jobs=allocation.candidate_workers)
+    best_model_name, best_model = model_finder.optimize_best_model(best_model_name, best_model, n_jobs=allocation.search_jobs)
+
+    return {'cluster_number': cluster_number,
+            'model_name': best_model_name,
+            'model': best_model,
+            'scaler': scaler,
+            'tracking': model_finder.tracking_record,
+            'validation_data': x_test_scaled.to_numpy(),
+            'log': log_buffer.getvalue(),
+            'metrics': metrics.records()}
+
+
+def partition_fingerprint(cluster_features, cluster_label, config):
+    """
+    Fingerprint the training partition of a cluster together with the search configuration.
+
+    Rows are sorted first, so the fingerprint does not depend on the order the rows were loaded in.
+
+    Parameters:
+    cluster_features (pandas.DataFrame): Log-transformed features of the cluster.
+    cluster_label (pandas.Series): Target values of the cluster.
+    config (dict): Search configuration, see `search_config`.
+
+    Returns:
+    str: Hex digest that changes whenever the cluster would be trained differently.
+    """
+    import sklearn
+    rows = np.column_stack([cluster_features.to_numpy(dtype=np.float64), cluster_label.to_numpy(dtype=np.float64)])
+    rows = rows[np.lexsort(rows.T[::-1])]
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([list(cluster_features.columns), config, sklearn.__version__], sort_keys=True, default=str).encode('utf-8'))
+    digest.update(np.ascontiguousarray(rows).tobytes())
+    return digest.hexdigest()
+
 
 class TrainModel:
     def __init__(self):
         self.log_file = open(TRAINING_LOGS, 'a+')
         self.logger = App_Logger()
+        self.metrics = StageMetrics('training', METRICS_TRACE_MEMORY)
 
-    def start_training(self):
+    def start_training(self, incremental=INCREMENTAL_TRAINING, out_of_core=OUT_OF_CORE_TRAINING):
         """
+        Train the clustering model and the model of every cluster, then publish them as a new generation.
+
+        Parameters:
+        incremental (bool): Keep the clusters of the previous generation and retrain only the clusters
+                            whose training partition or search configuration changed.
+        out_of_core (bool): Train with bounded memory, see `start_out_of_core_training`.
         """
+        if out_of_core:
+            return self.start_out_of_core_training()
         self.logger.add_log(self.log_file, "Started training the model...")
+        self.reused_clusters = []
+        self.retrained_clusters = []
+        self.tracker = AsyncTracker(self.log_file, self.logger, MLFLOW_EXPERIMENT_NAME)
+        # Every model of this run is saved to a new directory, published only once training succeeds
+        generation = new_generation_id()
         try:
-            data = Data_Loader(file=os.path.join(TRAINING_DATA_DIR,TRAINING_DATA_FILE),
-                                          log_file_obj=self.log_file,
-                                          logger_obj=self.logger,
-                                          data_type='training').get_data()
+            previous = self._previous_manifest() if incremental else None
+
+            source_file = os.path.join(TRAINING_DATA_DIR,TRAINING_DATA_FILE)
+            store = FeatureStore(self.log_file, self.logger)
+            with self.metrics.stage('feature_store_lookup'):
+                store_key = store.source_key(source_file, NUMERIC_COLS[:-1], NUMERIC_COLS[-1])
+                stored = store.load(store_key)
             file_op = FileOperations(self.log_file, self.logger)
-            
-            # Data preprocessing
+            scaler_file_op = FileOperations(self.log_file, self.logger)
             preprocessor = Preprocessor(self.log_file, self.logger)
-            is_null_present, cols_with_na = preprocessor.is_null_present(dataframe=data)
-            if is_null_present:
-                data = preprocessor.impute_missing_values(dataframe=data, numeric_cols=NUMERIC_COLS)
-            X,y = preprocessor.separate_features_label(dataframe=data, label_column="Concrete_compressive _strength")
-            X = preprocessor.log_transform(dataframe=X, numeric_cols=NUMERIC_COLS[:-1])
+
+            if stored is not None:
+                # Unchanged training data, the preprocessed features are mapped instead of recomputed
+                X, y = stored
+            else:
+                with self.metrics.stage('data_load') as call:
+                    data = Data_Loader(file=source_file,
+                                                  log_file_obj=self.log_file,
+                                                  logger_obj=self.logger,
+                                                  data_type='training').get_data()
+                    call['rows'] = len(data)
+
+                # Data preprocessing
+                with self.metrics.stage('null_check', len(data)):
+                    is_null_present, cols_with_na = preprocessor.is_null_present(dataframe=data)
+                if is_null_present:
+                    with self.metrics.stage('imputation', len(data)):
+                        data = preprocessor.impute_missing_values(dataframe=data, numeric_cols=NUMERIC_COLS)
+                X,y = preprocessor.separate_features_label(dataframe=data, label_column=NUMERIC_COLS[-1])
+                with self.metrics.stage('log_transform', len(X)):
+                    X = preprocessor.log_transform(dataframe=X, numeric_cols=NUMERIC_COLS[:-1])
+                with self.metrics.stage('feature_store_write', len(X)):
+                    X, y = store.save(store_key, X[NUMERIC_COLS[:-1]], y)
 
             # Dividing data into clusters
+            budget = CpuBudget()
             kmeans = KMeansClustering(self.log_file, self.logger)
-            number_of_clusters = kmeans.elbow_plot(data=X)
-            X = kmeans.create_clusters(dataframe=X, optimal_clusters=number_of_clusters)
-            X['label'] = y
+            if previous is not None:
+                # Keeping the previous clusters is what makes the partitions comparable between runs
+                with self.metrics.stage('clustering', len(X)):
+                    X = kmeans.assign_clusters(dataframe=X, model=previous.load_artifact(file_op, previous.clustering_model))
+                # Own instance, as in create_clusters, so the new generation holds the clustering model too
+                FileOperations(self.log_file, self.logger).save_model(kmeans.model, CLUSTERING_MODEL_NAME, generation_dir(generation))
+            else:
+                with self.metrics.stage('elbow_search', len(X)):
+                    number_of_clusters = kmeans.elbow_plot(data=X, n_jobs=budget.total_cores)
+                with self.metrics.stage('clustering', len(X)):
+                    X = kmeans.create_clusters(dataframe=X, optimal_clusters=number_of_clusters,
+                                               models_dir=generation_dir(generation))
             # List of clusters
+            clusters = X['cluster'].to_numpy()
             list_of_clusters = X['cluster'].unique()
+            manifest = ModelManifest(generation=generation,
+                                     clustering_model=CLUSTERING_MODEL_NAME + '.sav',
+                                     feature_order=NUMERIC_COLS[:-1])
+            scalers = {}
+            cluster_models = {}
+            validation_data = {}
 
+            config = search_config()
+            cluster_jobs = []
+            fingerprints = {}
+            reused = {}
+            # Workers receive the bounds of their cluster and map the stored features themselves
+            partitions = store.partitions(store_key, clusters)
             for i in list_of_clusters:
-                self.logger.add_log(self.log_file, f"Training on the cluster number {i}")
-                cluster_data = X[X['cluster']==i]
-                cluster_features = cluster_data.drop(['label','cluster'],axis=1)
-                cluster_label = cluster_data['label']
-
-                # splitting the data into training and test set for each cluster one by one
-                x_train, x_test, y_train, y_test = train_test_split(cluster_features, cluster_label, test_size=1 / 3, random_state=RANDOM_SEED)
-                x_train_scaled = preprocessor.standardize_data(x_train, NUMERIC_COLS[:-1])
-                x_test_scaled = preprocessor.standardize_data(x_test, NUMERIC_COLS[:-1])
-
-                model_finder = BestModelFinder(log_file=self.log_file,
-                                               logger=self.logger,
-                                               X_train=x_train_scaled,
-                                               y_train=y_train,
-                                               X_test=x_test_scaled,
-                                               y_test=y_test,
-                                               cluster_number=i
-                                               )
-                best_model_name, best_model = model_finder.find_best_model()
-                best_model_name, best_model = model_finder.optimize_best_model(best_model_name, best_model)
-
-
-                # Saving the best model
-                file_op.save_model(best_model, best_model_name+str(i), PREDICTION_MODELS_DIR)
-            
+                partition = partitions[int(i)]
+                cluster_features, cluster_label = partition.load()
+                fingerprints[int(i)] = partition_fingerprint(cluster_features, cluster_label, config)
+                entry = previous.clusters.get(str(int(i))) if previous is not None else None
+                if entry is not None and entry.get('fingerprint') == fingerprints[int(i)]:
+                    reused[int(i)] = (entry, cluster_features, cluster_label)
+                else:
+                    cluster_jobs.append((int(i), partition))
+            if previous is not None:
+                # Clusters that received no rows this time keep serving with their previous model
+                for i in previous.cluster_numbers():
+                    if i not in fingerprints:
+                        reused[i] = (previous.cluster(i), None, None)
+            reused_artifacts = {i: (previous.load_artifact(file_op, entry['model_file']),
+                                    previous.load_artifact(file_op, entry['scaler_file']))
+                                for i, (entry, _, _) in reused.items()}
+
+            results = []
+            if cluster_jobs:
+                # Nothing buffered may be inherited by the worker processes
+                self.log_file.flush()
+                allocation = budget.plan_training(n_clusters=len(cluster_jobs),
+                                                  n_candidates=len(CANDIDATE_MODELS),
+                                                  parallel_clusters=TRAINING_PARALLEL_BACKEND == 'process')
+                self.logger.add_log(self.log_file, f"CPU allocation: {allocation}")
+                results = self.train_clusters(cluster_jobs, allocation)
+
+            tracked_clusters = {}
+            for result in results:
+                i = result['cluster_number']
+                # Worker log lines and timings are written here, by the only process holding the log file
+                self.log_file.write(result['log'])
+                self.metrics.merge(result['metrics'])
+
+                # Uploaded in the background, the models are saved once their runs exist
+                tracked_clusters[i] = (self.tracker.log_run(**result['tracking']), result['model_name'], fingerprints[i])
+                scalers[i] = result['scaler']
+                cluster_models[i] = result['model']
+                validation_data[i] = result['validation_data']
+                self.retrained_clusters.append(i)
+
+            for i, (entry, cluster_features, cluster_label) in sorted(reused.items()):
+                model, scaler = reused_artifacts[i]
+                # The previous MLflow run still holds this exact model
+                self._save_cluster(manifest, file_op, scaler_file_op, i, entry['model_name'], model, scaler,
+                                   entry['run_id'], entry['model_uri'], entry.get('fingerprint'))
+                scalers[i] = scaler
+                cluster_models[i] = model
+                if cluster_features is not None:
+                    _, x_test, _, _ = train_test_split(cluster_features, cluster_label, test_size=1 / 3, random_state=RANDOM_SEED)
+                    validation_data[i] = preprocessor.standardize_data(x_test, NUMERIC_COLS[:-1], scaler=scaler).to_numpy()
+                self.reused_clusters.append(i)
+            self.logger.add_log(self.log_file, f"Retrained clusters {sorted(self.retrained_clusters)}, "
+                                               f"reused clusters {sorted(self.reused_clusters)}.")
+
+            self._publish(manifest, file_op, scaler_file_op, kmeans.model, scalers, cluster_models, validation_data, tracked_clusters)
+            self.export_metrics()
+
             # logging the successful Training
             self.logger.add_log(self.log_file, 'Successful End of Training')
             self.log_file.close()
@@ -80,4 +279,254 @@ class TrainModel:
             error_message = 'Error while making predictions::' + str(e)
             error_message_with_line = error_message + "\n" + traceback.format_exc()
             self.logger.add_log(self.log_file, error_message_with_line)
-            raise e
\ No newline at end of file
+            self.tracker.close()
+            self._discard_generation(generation)
+            self.export_metrics()
+            raise e
+
+    def start_out_of_core_training(self, chunk_size=OUT_OF_CORE_CHUNK_SIZE):
+        """
+        Train on data larger than memory and publish the models as a new generation.
+
+        The training file is read, imputed and log-transformed chunk by chunk into the feature
+        store, then every estimator is fitted slice by slice from the memory-mapped entry:
+        the elbow search on a bounded sample, MiniBatchKMeans for the clusters, partial_fit
+        scaling and an SGDRegressor per cluster. The artifacts are saved like those of
+        `start_training`, so prediction routes and scores with them unchanged.
+
+        Parameters:
+        chunk_size (int): Rows held in memory at a time.
+        """
+        self.logger.add_log(self.log_file, f"Started out-of-core training with chunks of {chunk_size} rows...")
+        self.reused_clusters = []
+        self.retrained_clusters = []
+        self.tracker = AsyncTracker(self.log_file, self.logger, MLFLOW_EXPERIMENT_NAME)
+        generation = new_generation_id()
+        try:
+            source_file = os.path.join(TRAINING_DATA_DIR,TRAINING_DATA_FILE)
+            store = FeatureStore(self.log_file, self.logger)
+            # Imputed chunk by chunk, which differs from the entry of the in-memory training
+            variant = f"chunks_{chunk_size}"
+            with self.metrics.stage('feature_store_lookup'):
+                store_key = store.source_key(source_file, NUMERIC_COLS[:-1], NUMERIC_COLS[-1], variant=variant)
+                stored = store.load(store_key)
+            if stored is None:
+                data_loader = Data_Loader(file=source_file, log_file_obj=self.log_file, logger_obj=self.logger, data_type='training')
+                n_rows = data_loader.count_rows()
+                stored = store.save_chunks(store_key, self._prepared_chunks(data_loader, chunk_size), n_rows,
+                                           NUMERIC_COLS[:-1], NUMERIC_COLS[-1])
+            X, y = stored
+            trainer = OutOfCoreTrainer(self.log_file, self.logger, X.to_numpy(), y.to_numpy(),
+                                       chunk_size=chunk_size, metrics=self.metrics)
+
+            # The number of clusters is searched on a sample, the clusters are fitted on every row
+            kmeans = KMeansClustering(self.log_file, self.logger)
+            sample = trainer.sample()
+            with self.metrics.stage('elbow_search', len(sample)):
+                number_of_clusters = kmeans.elbow_plot(data=sample, n_jobs=CpuBudget().total_cores)
+            clustering_model = trainer.fit_clustering(number_of_clusters)
+            # Own instance, as in create_clusters
+            FileOperations(self.log_file, self.logger).save_model(clustering_model, CLUSTERING_MODEL_NAME, generation_dir(generation))
+            file_op = FileOperations(self.log_file, self.logger)
+            scaler_file_op = FileOperations(self.log_file, self.logger)
+
+            scalers = trainer.fit_scalers(clustering_model)
+            cluster_models = trainer.fit_regressors(clustering_model, scalers)
+            scores = trainer.evaluate(clustering_model, scalers, cluster_models)
+
+            manifest = ModelManifest(generation=generation,
+                                     clustering_model=CLUSTERING_MODEL_NAME + '.sav',
+                                     feature_order=NUMERIC_COLS[:-1])
+            tracked_clusters = {}
+            for i, model in sorted(cluster_models.items()):
+                self.logger.add_log(self.log_file, f"Cluster {i}: {scores[i]}")
+                custom_model_name = "prediction_model" + "_" + str(i)
+                run = self.tracker.log_run(params={'model': 'SGDRegressor', 'chunk_size': chunk_size, 'epochs': OUT_OF_CORE_EPOCHS},
+                                           metrics=scores[i],
+                                           tags={'model_name': custom_model_name, 'training_mode': 'out_of_core'},
+                                           model=model,
+                                           model_path=custom_model_name)
+                tracked_clusters[i] = (run, 'SGDRegressor', None)
+                self.retrained_clusters.append(i)
+
+            self._publish(manifest, file_op, scaler_file_op, clustering_model, scalers, cluster_models, None, tracked_clusters)
+            self.export_metrics()
+
+            # logging the successful Training
+            self.logger.add_log(self.log_file, 'Successful End of Training')
+            self.log_file.close()
+
+        except Exception as e:
+            error_message = 'Error while training out of core::' + str(e)
+            error_message_with_line = error_message + "\n" + traceback.format_exc()
+            self.logger.add_log(self.log_file, error_message_with_line)
+            self.tracker.close()
+            self._discard_generation(generation)
+            self.export_metrics()
+            raise e
+
+    def _prepared_chunks(self, data_loader, chunk_size):
+        """
+        Read, impute and log-transform the training data one chunk at a time.
+
+        Parameters:
+        data_loader (Data_Loader): Loader of the training data file.
+        chunk_size (int): Rows per chunk.
+
+        Yields:
+        tuple: features (pandas.DataFrame), label (pandas.Series) of the chunk.
+        """
+        preprocessor = Preprocessor(self.log_file, self.logger)
+        for chunk in data_loader.get_data_in_chunks(chunk_size):
+            with self.metrics.stage('null_check', len(chunk)):
+                is_null_present, cols_with_na = preprocessor.is_null_present(dataframe=chunk)
+            if is_null_present:
+                with self.metrics.stage('imputation', len(chunk)):
+                    chunk = preprocessor.impute_missing_values(dataframe=chunk, numeric_cols=NUMERIC_COLS)
+            X, y = preprocessor.separate_features_label(dataframe=chunk, label_column=NUMERIC_COLS[-1])
+            with self.metrics.stage('log_transform', len(X)):
+                X = preprocessor.log_transform(dataframe=X, numeric_cols=NUMERIC_COLS[:-1])
+            yield X, y
+
+    def _publish(self, manifest, file_op, scaler_file_op, clustering_model, scalers, cluster_models, validation_data, tracked_clusters):
+        """
+        Compile the inference pipeline, save the trained clusters once their MLflow runs are logged,
+        then publish the manifest as the new model generation.
+
+        Everything is written to the directory of the generation before the current generation
+        pointer moves to it, so predictions never load a mix of two generations.
+
+        Parameters:
+        manifest (ModelManifest): Manifest receiving the cluster artifacts.
+        file_op (FileOperations): File operations helper of the cluster models.
+        scaler_file_op (FileOperations): File operations helper of the scalers.
+        clustering_model (sklearn.cluster.KMeans): Fitted clustering model.
+        scalers (dict): Fitted scaler of every cluster.
+        cluster_models (dict): Fitted model of every cluster.
+        validation_data (dict, optional): Scaled validation rows of every cluster, see `InferencePipeline.from_fitted`.
+        tracked_clusters (dict): Cluster number to (TrackedRun, model name, fingerprint) of the clusters trained in this run.
+        """
+        # Compiling the whole prediction path into a single artifact, while the runs are uploaded
+        with self.metrics.stage('pipeline_compile'):
+            pipeline = InferencePipeline.from_fitted(feature_order=manifest.feature_order,
+                                                     clustering_model=clustering_model,
+                                                     scalers=scalers,
+                                                     cluster_models=cluster_models,
+                                                     generation=manifest.generation,
+                                                     validation_data=validation_data)
+
+        # The manifest records the MLflow run of every model, so their uploads must be finished
+        with self.metrics.stage('tracking_flush'):
+            self.tracker.flush()
+        for i, (run, model_name, fingerprint) in sorted(tracked_clusters.items()):
+            # Tracking is best effort, a model whose run could not be logged is published without it
+            try:
+                run_id, model_uri = run.result()
+            except Exception as e:
+                self.logger.add_log(self.log_file, f"Cluster {i} is published without an MLflow run :: {str(e)}")
+                run_id, model_uri = None, None
+            self._save_cluster(manifest, file_op, scaler_file_op, i, model_name, cluster_models[i], scalers[i], run_id, model_uri, fingerprint)
+        # Memory-mappable, so every serving process shares one copy of the model arrays
+        pipeline.save_mapped(manifest.resolve(INFERENCE_PIPELINE_NAME))
+        manifest.pipeline_file = INFERENCE_PIPELINE_NAME
+
+        # Publishing the new models so that predictions stop using the previous ones
+        manifest.save()
+        mark_new_generation(manifest.generation)
+        prediction_cache.clear()
+        self.logger.add_log(self.log_file, f"Published model generation {manifest.generation}.")
+        removed = prune_generations()
+        if removed:
+            self.logger.add_log(self.log_file, f"Removed old model generations {removed}.")
+
+        # Stage timings of the whole run, next to the per-cluster runs of the experiment
+        self.tracker.log_run(run_name='training_stages',
+                             metrics=self.metrics.mlflow_metrics(),
+                             tags={'generation': manifest.generation,
+                                   'retrained_clusters': sorted(self.retrained_clusters),
+                                   'reused_clusters': sorted(self.reused_clusters)})
+        failed = self.tracker.close()
+        if failed:
+            self.logger.add_log(self.log_file, f"{failed} MLflow run(s) of generation {manifest.generation} could not be logged.")
+
+    def _previous_manifest(self):
+        """
+        Load the manifest of the current generation for incremental training.
+
+        Returns:
+        ModelManifest or None: The manifest, None when there is no complete previous generation to build on.
+        """
+        try:
+            previous = ModelManifest.load()
+        except FileNotFoundError:
+            self.logger.add_log(self.log_file, "No previous model generation, training every cluster.")
+            return None
+        if not os.path.exists(previous.resolve(previous.clustering_model)):
+            self.logger.add_log(self.log_file, "Clustering model of the previous generation is missing, training every cluster.")
+            return None
+        self.logger.add_log(self.log_file, f"Training incrementally on top of model generation {previous.generation}.")
+        return previous
+
+    def _discard_generation(self, generation):
+        """
+        Remove the models of a failed run, unless its generation was already published.
+        """
+        try:
+            published = model_registry.current_generation() == generation
+        except FileNotFoundError:
+            published = False
+        if not published:
+            shutil.rmtree(generation_dir(generation), ignore_errors=True)
+            self.logger.add_log(self.log_file, f"Discarded the unpublished model generation {generation}.")
+
+    def _save_cluster(self, manifest, file_op, scaler_file_op, cluster_number, model_name, model, scaler, run_id, model_uri, fingerprint):
+        """
+        Save the model and scaler of a cluster and record them in the manifest.
+        """
+        model_file_name = model_name+str(cluster_number)
+        scaler_file_name = 'StandardScaler'+str(cluster_number)
+        file_op.save_model(model, model_file_name, manifest.resolve(PREDICTION_MODELS_SUBDIR))
+        scaler_file_op.save_model(scaler, scaler_file_name, manifest.resolve(SCALERS_SUBDIR))
+        manifest.add_cluster(cluster_number=cluster_number,
+                             model_name=model_name,
+                             run_id=run_id,
+                             model_uri=model_uri,
+                             model_file=os.path.join(PREDICTION_MODELS_SUBDIR, model_file_name+'.sav'),
+                             scaler_file=os.path.join(SCALERS_SUBDIR, scaler_file_name+'.sav'),
+                             fingerprint=fingerprint)
+
+    def train_clusters(self, cluster_jobs, allocation, backend=TRAINING_PARALLEL_BACKEND):
+        """
+        Train the model of every cluster, concurrently when a parallel backend is set.
+
+        Parameters:
+        cluster_jobs (list): (cluster_number, StoredPartition) of every cluster.
+        allocation (TrainingAllocation): Workers of every parallel level, from CpuBudget.plan_training.
+        backend (str, optional): None to train the clusters one after the other, 'process' to train them in a process pool.
+
+        Returns:
+        list: The results of `train_cluster`, in the order of `cluster_jobs`.
+        """
+        n_workers = allocation.cluster_workers
+        if backend is None or n_workers == 1:
+            with thread_limits(allocation.blas_threads, allocation.cores_per_cluster):
+                return [train_cluster(i, partition, allocation) for i, partition in cluster_jobs]
+        if backend != 'process':
+            raise ValueError(f"Unknown parallel backend '{backend}', expected None or 'process'")
+
+        self.logger.add_log(self.log_file, f"Training {len(cluster_jobs)} clusters on {n_workers} worker processes.")
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=apply_thread_limits,
+                                 initargs=(allocation.blas_threads, allocation.cores_per_cluster)) as executor:
+            futures = [executor.submit(train_cluster, i, partition, allocation)
+                       for i, partition in cluster_jobs]
+            return [future.result() for future in futures]
+
+    def export_metrics(self):
+        """
+        Write the stage metrics of the run to the metrics directory and the training logs.
+        """
+        try:
+            self.metrics.export(METRICS_DIR)
+            self.logger.add_log(self.log_file, "Training stage metrics:\n" + self.metrics.summary())
+        except Exception as e:
+            self.logger.add_log(self.log_file, 'Error while exporting training metrics: ' + str(e))
\ No newline at end of file
@@ -0,0 +1,151 @@
+import os
+from contextlib import contextmanager
+from Prediction_Model.config.config import CPU_BUDGET
+
+# Thread pools of the numerical libraries, capped in every worker
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                   'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+
+def available_cores():
+    """
+    Number of cores this process may run on.
+
+    Returns:
+    int: Cores in the CPU affinity mask, or the core count where affinity is not supported.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def resolve_n_jobs(n_jobs, n_tasks):
+    """
+    Bound the number of workers by the cores this process may run on and the amount of work.
+
+    Parameters:
+    n_jobs (int): Requested number of workers, -1 or None for every core.
+    n_tasks (int): Number of independent tasks.
+
+    Returns:
+    int: Number of workers to start.
+    """
+    cores = available_cores()
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = cores
+    return max(1, min(n_jobs, cores, n_tasks))
+
+
+def apply_thread_limits(blas_threads, max_cpu_count):
+    """
+    Cap the threads of the current process, used as the initializer of worker processes.
+
+    Parameters:
+    blas_threads (int): Threads allowed to BLAS and OpenMP.
+    max_cpu_count (int): Cores joblib believes it has, which bounds the workers of nested searches.
+    """
+    from threadpoolctl import threadpool_limits
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(blas_threads)
+    os.environ['LOKY_MAX_CPU_COUNT'] = str(max_cpu_count)
+    # The environment only reaches libraries loaded later, threadpoolctl caps the loaded ones
+    threadpool_limits(limits=blas_threads)
+
+
+@contextmanager
+def thread_limits(blas_threads, max_cpu_count):
+    """
+    Cap the threads of the current process for the duration of a block.
+
+    Parameters:
+    blas_threads (int): Threads allowed to BLAS and OpenMP.
+    max_cpu_count (int): Cores joblib believes it has.
+    """
+    from threadpoolctl import threadpool_limits
+    previous = os.environ.get('LOKY_MAX_CPU_COUNT')
+    os.environ['LOKY_MAX_CPU_COUNT'] = str(max_cpu_count)
+    try:
+        with threadpool_limits(limits=blas_threads):
+            yield
+    finally:
+        if previous is None:
+            os.environ.pop('LOKY_MAX_CPU_COUNT', None)
+        else:
+            os.environ['LOKY_MAX_CPU_COUNT'] = previous
+
+
+class TrainingAllocation:
+    """
+    Workers handed to every parallel level of a training run.
+
+    Attributes:
+    total_cores (int): Core budget of the run.
+    cluster_workers (int): Clusters trained at the same time.
+    cores_per_cluster (int): Cores available to the training of one cluster.
+    candidate_workers (int): Candidate models fitted at the same time within a cluster.
+    search_jobs (int): Parallel fits of the hyperparameter search within a cluster.
+    estimator_jobs (int): n_jobs given to estimators that support it.
+    blas_threads (int): BLAS and OpenMP threads of a cluster worker.
+    """
+    def __init__(self, total_cores, cluster_workers, cores_per_cluster, candidate_workers, search_jobs, estimator_jobs, blas_threads):
+        self.total_cores = total_cores
+        self.cluster_workers = cluster_workers
+        self.cores_per_cluster = cores_per_cluster
+        self.candidate_workers = candidate_workers
+        self.search_jobs = search_jobs
+        self.estimator_jobs = estimator_jobs
+        self.blas_threads = blas_threads
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return f"TrainingAllocation({', '.join(f'{k}={v}' for k, v in self.__dict__.items())})"
+
+
+class CpuBudget:
+    """
+    Splits a total core budget across the nested parallel levels of training.
+
+    Clusters, candidate models, search folds, estimators and BLAS each get a share, so that
+    the product of the workers running at the same time never exceeds the budget.
+
+    Attributes:
+    total_cores (int): Cores the budget hands out.
+    """
+    def __init__(self, total_cores=CPU_BUDGET):
+        """
+        Initialize the CpuBudget.
+
+        Parameters:
+        total_cores (int, optional): Core budget, None or a value below 1 uses every available core.
+        """
+        cores = available_cores()
+        self.total_cores = cores if not total_cores or total_cores < 1 else min(int(total_cores), cores)
+
+    def plan_training(self, n_clusters, n_candidates, parallel_clusters=True):
+        """
+        Allocate the budget to a training run.
+
+        The candidate fits and the hyperparameter search of a cluster run one after the other,
+        so both may use every core of the cluster. Estimators and BLAS run single threaded
+        whenever a level above them is parallel.
+
+        Parameters:
+        n_clusters (int): Number of clusters to train.
+        n_candidates (int): Number of candidate models compared on every cluster.
+        parallel_clusters (bool): Train the clusters in worker processes.
+
+        Returns:
+        TrainingAllocation: The workers of every level.
+        """
+        cluster_workers = max(1, min(n_clusters, self.total_cores)) if parallel_clusters else 1
+        cores_per_cluster = max(1, self.total_cores // cluster_workers)
+        candidate_workers = max(1, min(n_candidates, cores_per_cluster))
+        return TrainingAllocation(total_cores=self.total_cores,
+                                  cluster_workers=cluster_workers,
+                                  cores_per_cluster=cores_per_cluster,
+                                  candidate_workers=candidate_workers,
+                                  search_jobs=cores_per_cluster,
+                                  estimator_jobs=1,
+                                  blas_threads=max(1, cores_per_cluster // candidate_workers))
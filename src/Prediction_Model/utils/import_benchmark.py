@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from Prediction_Model.config.config import PACKAGE_ROOT, IMPORT_TIME_BASELINE_FILE, IMPORT_TIME_TOLERANCE
+
+# Entry points timed by the benchmark and the heavy modules each of them must not load
+ENTRY_POINTS = {
+    'Prediction_Model': ['pandas', 'sklearn', 'mlflow', 'matplotlib', 'kneed', 'streamlit', 'mysql'],
+    'Prediction_Model.serving.server': ['pandas', 'mlflow', 'matplotlib', 'kneed', 'streamlit', 'mysql'],
+    'Prediction_Model.predict.predict': ['mlflow', 'matplotlib', 'kneed', 'streamlit'],
+    'Prediction_Model.train_model.train': ['mlflow', 'matplotlib', 'kneed', 'streamlit'],
+    'Prediction_Model.main': ['sklearn', 'mlflow', 'matplotlib', 'kneed', 'mysql'],
+}
+
+# Run in a fresh interpreter so nothing is already imported
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'modules': sorted({{name.split('.')[0] for name in sys.modules}})}}))
+"""
+
+
+def measure_import(module, repeat=3):
+    """
+    Measure the cold import time of a module.
+
+    Parameters:
+    module (str): Dotted name of the module to import.
+    repeat (int): Number of fresh interpreters used, the fastest import is reported.
+
+    Returns:
+    dict: Best import time in seconds and the top level packages loaded by the import.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(PACKAGE_ROOT), env.get('PYTHONPATH')]))
+    timings = []
+    loaded = []
+    for _ in range(repeat):
+        completed = subprocess.run([sys.executable, '-c', _PROBE.format(module=module)],
+                                   capture_output=True, text=True, env=env)
+        if completed.returncode != 0:
+            raise Exception(f"Importing {module} failed:\n{completed.stderr}")
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        timings.append(result['seconds'])
+        loaded = result['modules']
+    return {'seconds': min(timings), 'modules': loaded}
+
+
+def run_benchmark(entry_points=None, repeat=3, baseline_file=IMPORT_TIME_BASELINE_FILE, tolerance=IMPORT_TIME_TOLERANCE):
+    """
+    Time every entry point and compare it with the recorded baseline.
+
+    Parameters:
+    entry_points (dict, optional): Module names mapped to the packages they must not load. Defaults to ENTRY_POINTS.
+    repeat (int): Number of fresh interpreters per entry point.
+    baseline_file (str): JSON file holding the baseline import times.
+    tolerance (float): Allowed slowdown over the baseline, as a fraction.
+
+    Returns:
+    tuple: (results (dict), failures (list of str))
+    """
+    entry_points = ENTRY_POINTS if entry_points is None else entry_points
+    baseline = {}
+    if os.path.exists(baseline_file):
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+
+    results = {}
+    failures = []
+    for module, forbidden in entry_points.items():
+        measured = measure_import(module, repeat)
+        results[module] = measured['seconds']
+        leaked = sorted(set(forbidden) & set(measured['modules']))
+        if leaked:
+            failures.append(f"{module} imports {', '.join(leaked)}")
+        if module in baseline and measured['seconds'] > baseline[module] * (1 + tolerance):
+            failures.append(f"{module} took {measured['seconds']:.3f}s, baseline is {baseline[module]:.3f}s")
+    return results, failures
+
+
+def main():
+    """
+    Print the cold import time of every entry point and exit with status 1 on a regression.
+    """
+    parser = argparse.ArgumentParser(description='Cold import time benchmark of the package entry points.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=IMPORT_TIME_TOLERANCE)
+    parser.add_argument('--baseline', default=IMPORT_TIME_BASELINE_FILE)
+    parser.add_argument('--update-baseline', action='store_true', help='Record the measured times as the new baseline.')
+    args = parser.parse_args()
+
+    results, failures = run_benchmark(repeat=args.repeat, baseline_file=args.baseline, tolerance=args.tolerance)
+    for module, seconds in results.items():
+        print(f"{module}: {seconds:.3f}s")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,9 @@ from Prediction_Model.config.config import DATA_DIR
 
 def empty_dirs():
     dirs = os.listdir(DATA_DIR)
-    required_dirs = ['Prediction_Batch_Files','Training_Batch_Files','cement_strength_08012020_120021.csv']
+    # The validated folders hold the archive, the only copy of the rejected batch files
+    required_dirs = ['Prediction_Batch_Files','Training_Batch_Files','cement_strength_08012020_120021.csv','Feature_Store',
+                     'Raw_Training_Validated','Raw_Prediction_Validated']
     for dir_name in dirs:
         if dir_name not in required_dirs and os.path.exists(os.path.join(DATA_DIR,dir_name)):
             shutil.rmtree(os.path.join(DATA_DIR,dir_name))